@@ -1,6 +1,6 @@
 import json
 import logging
-from datetime import datetime
+import time
 from typing import Dict, Union, Tuple
 
 import requests.exceptions
@@ -11,6 +11,7 @@ from filip.models.ngsi_v2.subscriptions import Subscription
 from agentlib import AgentVariable, BaseModuleConfig, Source
 
 from agentlib_fiware.modules.context_broker.base import BaseContextBrokerConfig
+from agentlib_fiware.utils.timestamps import ISO_TIME_FORMAT, unix_to_time_instant
 
 logger = logging.getLogger(__name__)
 
@@ -62,6 +63,9 @@ def generate_service_to_cb_config_and_entities(
     if create_entities_for_read_fields:
         fields_to_create_entities.extend(read_field_items)
     _unsupported_types = ["pd.Series", "soft_constraint", "list"]
+    time_instant = unix_to_time_instant(
+        time.time(), context_broker_config.get("time_format", ISO_TIME_FORMAT)
+    )
     for var in fields_to_create_entities:
         ag_var = AgentVariable(**var)
         if ag_var.type in _unsupported_types:
@@ -76,7 +80,7 @@ def generate_service_to_cb_config_and_entities(
             metadata=NamedMetadata(
                 name="TimeInstant",
                 type="DateTime",
-                value=datetime.now().strftime(context_broker_config.get("time_format", "%Y-%m-%dT%H:%M:%S.%fZ"))
+                value=time_instant
             )
         )
         entity = ContextEntity(id=entity_id, type="sensor")
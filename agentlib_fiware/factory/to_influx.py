@@ -5,12 +5,14 @@ import pathlib
 from filip.clients.ngsi_v2.cb import ContextBrokerClient
 from filip.models.base import FiwareHeader
 from filip.models.ngsi_v2.subscriptions import \
-    EntityPattern, \
     Mqtt, \
     Notification, \
     Subject, \
     Subscription
 
+from agentlib_fiware.utils import subscriptions
+from agentlib_fiware.utils.subscriptions import SubscriptionGrouping
+
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +21,18 @@ def create_subscriptions(
         mqtt_url: str,
         cb_url: str,
         fiware_header: dict,
-        save_path: pathlib.Path = None
+        save_path: pathlib.Path = None,
+        subscription_grouping: SubscriptionGrouping = SubscriptionGrouping.ENTITY,
+        max_entities_per_subscription: int = 100
 ):
+    """
+    Subscribe to all entities and print the matching telegraf config.
+    By default, one subscription per entity is created, publishing to
+    a topic ending with the entity id. With any other subscription_grouping
+    (see SubscriptionGrouping), the entities are combined into few
+    subscriptions with topics ending with "group_<idx>". Use the "id"
+    tag instead of the topic to filter the entities in this case.
+    """
     fiware_header = FiwareHeader(**fiware_header)
     telegraf_mqtt_list = []
     with ContextBrokerClient(
@@ -30,21 +42,29 @@ def create_subscriptions(
     subscription_ids = []
 
     for entity in entities:
-        entity_pattern = EntityPattern(**entity.model_dump())
         attrs = entity.get_attributes()
         for attr in attrs:
             telegraf_mqtt_list.append(f"{attr.name}_value")
+
+    for idx, group in enumerate(subscriptions.group_entities(
+            entities=[(entity.id, entity.type) for entity in entities],
+            grouping=subscription_grouping,
+            max_entities_per_subscription=max_entities_per_subscription
+    )):
         # Post new subscription
         topic = "/".join([
             "/fiware_to_influx",
             fiware_header.service.strip('/'),
             fiware_header.service_path.strip('/'),
-            entity.id
+            group[0][0] if subscription_grouping == SubscriptionGrouping.ENTITY
+            else f"group_{idx}"
         ])
         sub = Subscription(
             description="Subscription for fiware to influx-db management",
             subject=Subject(
-                entities=[entity_pattern]
+                entities=subscriptions.get_entity_patterns(
+                    entities=group, grouping=subscription_grouping
+                )
             ),
             notification=Notification(
                 mqtt=Mqtt(url=mqtt_url,
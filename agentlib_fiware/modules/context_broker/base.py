@@ -1,9 +1,11 @@
 import logging
-from typing import List, Dict, Tuple
+import threading
+from typing import List, Dict, Literal, Optional, Tuple
 
 import numpy as np
-from filip.clients.ngsi_v2 import ContextBrokerClient
+import requests
 from filip.models.base import FiwareHeader
+from filip.models.ngsi_v2.context import ContextEntity, NamedContextAttribute
 from pydantic import (
     AnyHttpUrl, Field, ConfigDict,
     field_validator, ValidationInfo
@@ -12,6 +14,10 @@ from pydantic import (
 from agentlib import Agent, AgentVariable, AgentVariables, BaseModule, BaseModuleConfig, Environment
 
 from agentlib_fiware import utils
+from agentlib_fiware.utils import sessions
+from agentlib_fiware.utils.query import query_entities
+from agentlib_fiware.utils.entity_cache import get_entity_schema_cache
+from agentlib_fiware.utils.workers import BackgroundWorker, OverflowPolicy
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +34,18 @@ class BaseContextBrokerConfig(BaseModuleConfig):
         title="Context Broker",
         description="Url of the FIWARE's Context Broker"
     )
+    query_chunk_size: int = Field(
+        default=100,
+        gt=0,
+        title="Query chunk size",
+        description="Maximal number of entities requested with one "
+                    "NGSI-v2 op/query, e.g. to validate the config."
+    )
+    query_max_workers: int = Field(
+        default=4,
+        gt=0,
+        title="Maximal number of concurrent op/query requests"
+    )
     update_entity_attributes: AgentVariables = Field(
         title="Specify which attributes to update in the CB.",
         default=[],
@@ -43,24 +61,109 @@ class BaseContextBrokerConfig(BaseModuleConfig):
         default=np.inf,
         title="Skip update if x seconds too old",
         description="Skip attribute update if the variable was too "
-                    "long in the data-broker queue. "
-                    "This is a sign of bad connection or bad FIWARE performance."
+                    "long in the data-broker queue, in the queue of the "
+                    "async writer or in the batch buffer. "
+                    "This is a sign of bad connection or bad FIWARE performance. "
+                    "See get_update_statistics() for the number of skipped updates."
+    )
+    update_mode: Literal["single", "batch"] = Field(
+        default="single",
+        title="Update mode",
+        description="'single' updates each attribute with its own request. "
+                    "'batch' buffers the updates and sends them as one "
+                    "NGSI-v2 batch update (op/update) every batch_flush_interval "
+                    "or as soon as batch_max_size attributes are buffered. "
+                    "Only the latest value of each entity_id/attr_name is sent."
+    )
+    batch_flush_interval: float = Field(
+        default=1,
+        gt=0,
+        title="Batch flush interval",
+        description="Interval in seconds in which buffered updates are sent "
+                    "if update_mode='batch'."
+    )
+    batch_max_size: int = Field(
+        default=100,
+        gt=0,
+        title="Maximal batch size",
+        description="Number of buffered entity_id/attr_name combinations "
+                    "which triggers an immediate batch update."
+    )
+    batch_action_type: Literal["update", "append"] = Field(
+        default="update",
+        title="Batch action type",
+        description="actionType of the batch update. 'update' only updates "
+                    "existing attributes, 'append' creates missing ones."
+    )
+    async_updates: bool = Field(
+        default=False,
+        title="Asynchronous updates",
+        description="If True, the requests to the ContextBroker are performed "
+                    "by background threads instead of inside the data_broker "
+                    "callback, so a slow ContextBroker does not block other modules."
+    )
+    async_workers: int = Field(
+        default=1,
+        gt=0,
+        title="Number of background threads for async_updates",
+        description="Updates of the same entity_id/attr_name are never sent "
+                    "concurrently and keep their order."
+    )
+    async_queue_size: int = Field(
+        default=1000,
+        gt=0,
+        title="Maximal number of pending updates for async_updates"
+    )
+    async_overflow_policy: OverflowPolicy = Field(
+        default=OverflowPolicy.COALESCE,
+        title="Overflow policy for async_updates",
+        description="'drop_oldest' discards the oldest pending update, "
+                    "'block' waits for a free slot and 'coalesce' replaces "
+                    "a pending update of the same entity_id/attr_name."
     )
 
     @field_validator("update_entity_attributes")
     @classmethod
     def check_entity_attrs(cls, entity_attrs, info: ValidationInfo):
         unique_entities = get_unique_entities(entity_attrs)
-        with ContextBrokerClient(
+        schema_cache = get_entity_schema_cache(
+            cb_url=info.data["cb_url"],
+            fiware_header=info.data["fiware_header"]
+        )
+        if not unique_entities:
+            return entity_attrs
+        with sessions.get_context_broker_client(
                 url=info.data["cb_url"],
                 fiware_header=info.data["fiware_header"]
         ) as httpc:
-            # Check if the data even exists.
-            for entity_id, attrs in unique_entities.items():
-                entity = httpc.get_entity(entity_id=entity_id)
-                for attr_name, _ in attrs:
+            entities = query_entities(
+                http_client=httpc,
+                entity_ids=list(unique_entities),
+                attrs=sorted({attr_name for attrs in unique_entities.values()
+                            for attr_name, _ in attrs}),
+                chunk_size=info.data["query_chunk_size"],
+                max_workers=info.data["query_max_workers"]
+            )
+        entities = {entity.id: entity for entity in entities}
+        # Check if the data even exists and report all missing data at once.
+        missing = []
+        for entity_id, attrs in unique_entities.items():
+            entity = entities.get(entity_id)
+            if entity is None:
+                missing.append(f"{entity_id} (entity does not exist)")
+                continue
+            for attr_name, _ in attrs:
+                try:
                     entity.get_attribute(attr_name)
-
+                except KeyError:
+                    missing.append(f"{entity_id}/{attr_name}")
+            # Avoid fetching the entity again for each update
+            schema_cache.add_entity(entity)
+        if missing:
+            raise ValueError(
+                f"The following entity/attribute combinations do not exist in "
+                f"the ContextBroker: {', '.join(missing)}"
+            )
         return entity_attrs
 
 
@@ -69,11 +172,35 @@ class BaseContextBroker(BaseModule):
 
     def __init__(self, config: dict, agent: Agent):
         super().__init__(config=config, agent=agent)
-        self._httpc = ContextBrokerClient(
+        self._httpc = sessions.get_context_broker_client(
             url=self.config.cb_url,
             fiware_header=self.config.fiware_header
         )
         self.logger.debug("HTTPC version is %s", self._httpc.get_version())
+        self._schema_cache = get_entity_schema_cache(
+            cb_url=self.config.cb_url,
+            fiware_header=self.config.fiware_header
+        )
+        self._batch: Dict[Tuple[str, str], Tuple[str, NamedContextAttribute, float]] = {}
+        self._batch_lock = threading.Lock()
+        self._update_statistics = {"sent": 0, "shed": 0, "failed": 0}
+        self._update_statistics_lock = threading.Lock()
+        self._writer: Optional[BackgroundWorker] = None
+        if self.config.async_updates:
+            self._writer = BackgroundWorker(
+                name=f"{self.agent.id}/{self.id}_writer",
+                num_workers=self.config.async_workers,
+                max_queue_size=self.config.async_queue_size,
+                overflow_policy=self.config.async_overflow_policy
+            )
+        if self.config.update_mode == "batch":
+            self.env.process(self._batch_flush_process())
+
+    def get_writer_metrics(self) -> Dict[str, float]:
+        """Return the queue metrics of the async writer, if active."""
+        if self._writer is None:
+            return {}
+        return self._writer.get_metrics()
 
     def register_callbacks(self):
         """
@@ -101,39 +228,217 @@ class BaseContextBroker(BaseModule):
         Receive the attribute callback from the AgentLib and
         update the attribute in the ContextBroker.
         """
+        if self._writer is not None:
+            self._writer.submit(self._process_update, variable=variable, name=name, key=name)
+            return
+        self._process_update(variable=variable, name=name)
+
+    def _process_update(
+            self,
+            variable: AgentVariable,
+            name: str
+    ):
+        """
+        Update the attribute in the ContextBroker, either directly
+        or by adding it to the next batch update.
+        """
         time_start_update = self.env.time
-        time_delay = time_start_update - variable.timestamp
-        if time_delay > self.config.skip_update_after_x_seconds:
-            self.logger.error("The update of '%s' is %s seconds out of sync, skipping the update",
-                              name, time_delay)
+        # Shed stale updates before any network I/O
+        if self._is_stale(name=name, timestamp=variable.timestamp):
+            return
 
-        entity_id, attr_name = name.split("/")
-        try:
-            entity = self._httpc.get_entity(entity_id=entity_id)
-            attribute = entity.get_attribute(attribute_name=attr_name)
-        except KeyError as err:
-            logger.error("Entity-attribute combination %s not found, can't update it."
-                         "Error-message: %s", name, err)
+        update = self._get_updated_attribute(variable=variable, name=name)
+        if update is None:
+            return
+        entity_id, entity_type, attribute = update
+
+        if self.config.update_mode == "batch":
+            self._add_to_batch(
+                entity_id=entity_id, entity_type=entity_type,
+                attribute=attribute, timestamp=variable.timestamp
+            )
             return
 
+        try:
+            self._httpc.update_entity_attribute(
+                entity_id=entity_id,
+                entity_type=entity_type,
+                attr=attribute,
+                override_metadata=True
+            )
+        except requests.exceptions.RequestException as err:
+            self._count_updates(failed=1)
+            if self._invalidate_on_schema_error(err=err, entity_ids=[entity_id]):
+                self.logger.error("Could not update %s, invalidated cached schema. "
+                                  "Error-message: %s", name, err)
+                return
+            raise
+        self._count_updates(sent=1)
+        self.logger.info(
+            "Successfully updated entity attribute %s of entity '%s' (type '%s') "
+            "for variable %s. Took %s seconds",
+            attribute.model_dump_json(),
+            entity_id,
+            entity_type,
+            variable.alias,
+            self.env.time - time_start_update
+        )
+
+    def _get_updated_attribute(
+            self,
+            variable: AgentVariable,
+            name: str
+    ) -> Optional[Tuple[str, str, NamedContextAttribute]]:
+        """
+        Return the entity id, entity type and the attribute holding
+        the value and timestamp of the given variable, or None if
+        the entity-attribute combination does not exist.
+        """
+        entity_id, attr_name = name.split("/")
+        schema = self._schema_cache.get_attribute(entity_id=entity_id, attr_name=attr_name)
+        if schema is None:
+            try:
+                entity = self._httpc.get_entity(entity_id=entity_id)
+                self._schema_cache.add_entity(entity)
+                schema = entity.type, entity.get_attribute(attribute_name=attr_name)
+            except KeyError as err:
+                logger.error("Entity-attribute combination %s not found, can't update it."
+                             "Error-message: %s", name, err)
+                return None
+        entity_type, attribute = schema
+
         attribute.value = variable.value
         attribute = utils.update_attribute_time_instant(
             attribute=attribute, time_format=self.config.time_format, timestamp=variable.timestamp
         )
-        self._httpc.update_entity_attribute(
-            entity_id=entity_id,
-            entity_type=entity.type,
-            attr=attribute,
-            override_metadata=True
-        )
+        return entity_id, entity_type, attribute
+
+    def _invalidate_on_schema_error(
+            self,
+            err: requests.exceptions.RequestException,
+            entity_ids: List[str]
+    ) -> bool:
+        """
+        If the error indicates that the entity or attribute changed
+        in the context broker (404/422), invalidate the cached schema
+        so that it is fetched again on the next update.
+        Returns True if the schema was invalidated.
+        """
+        if err.response is None or err.response.status_code not in (404, 422):
+            return False
+        for entity_id in entity_ids:
+            self._schema_cache.invalidate(entity_id=entity_id)
+        return True
+
+    def _is_stale(self, name: str, timestamp: float) -> bool:
+        """
+        Check if the update is older than skip_update_after_x_seconds.
+        Stale updates are counted as shed.
+        """
+        time_delay = self.env.time - timestamp
+        if time_delay <= self.config.skip_update_after_x_seconds:
+            return False
+        self._count_updates(shed=1)
+        self.logger.error("The update of '%s' is %s seconds out of sync, skipping the update",
+                          name, time_delay)
+        return True
+
+    def _count_updates(self, sent: int = 0, shed: int = 0, failed: int = 0):
+        """Increase the update counters in a thread-safe way"""
+        with self._update_statistics_lock:
+            self._update_statistics["sent"] += sent
+            self._update_statistics["shed"] += shed
+            self._update_statistics["failed"] += failed
+
+    def get_update_statistics(self) -> Dict[str, int]:
+        """
+        Return the number of attribute updates which were sent to the
+        ContextBroker, shed because they were older than
+        skip_update_after_x_seconds, or failed.
+        A rising number of shed updates indicates that FIWARE
+        is falling behind.
+        """
+        with self._update_statistics_lock:
+            return dict(self._update_statistics)
+
+    def _add_to_batch(
+            self,
+            entity_id: str,
+            entity_type: str,
+            attribute: NamedContextAttribute,
+            timestamp: float
+    ):
+        """
+        Buffer the attribute for the next batch update. Newer values
+        of the same entity_id/attr_name replace older ones.
+        """
+        with self._batch_lock:
+            self._batch[(entity_id, attribute.name)] = (entity_type, attribute, timestamp)
+            batch_full = len(self._batch) >= self.config.batch_max_size
+        if batch_full:
+            self.flush_batch()
+
+    def flush_batch(self):
+        """
+        Send all buffered attribute updates as a single
+        NGSI-v2 batch update to the ContextBroker.
+        """
+        with self._batch_lock:
+            batch, self._batch = self._batch, {}
+        if not batch:
+            return
+        entities: Dict[Tuple[str, str], ContextEntity] = {}
+        n_attributes = 0
+        for (entity_id, attr_name), (entity_type, attribute, timestamp) in batch.items():
+            if self._is_stale(name=f"{entity_id}/{attr_name}", timestamp=timestamp):
+                continue
+            n_attributes += 1
+            key = (entity_id, entity_type)
+            if key not in entities:
+                entities[key] = ContextEntity(id=entity_id, type=entity_type)
+            entities[key].add_attributes([attribute])
+        if not entities:
+            return
+        time_start_update = self.env.time
+        try:
+            self._httpc.update(
+                entities=list(entities.values()),
+                action_type=self.config.batch_action_type,
+                # Same metadata handling as update_entity_attribute in single mode
+                override_metadata=True
+            )
+        except requests.exceptions.RequestException as err:
+            self._count_updates(failed=n_attributes)
+            self._invalidate_on_schema_error(
+                err=err, entity_ids=[entity_id for entity_id, _ in entities]
+            )
+            self.logger.error("Batch update of %s attributes in %s entities failed. "
+                              "Error-message: %s", n_attributes, len(entities), err)
+            return
+        self._count_updates(sent=n_attributes)
         self.logger.info(
-            "Successfully updated entity attribute %s to %s for variable %s. Took %s seconds",
-            attribute.model_dump_json(),
-            entity.model_dump_json(include={'service', 'service_path', 'id', 'type'}),
-            variable.alias,
-            self.env.time - time_start_update
+            "Successfully updated %s attributes in %s entities with one batch update. "
+            "Took %s seconds",
+            n_attributes, len(entities), self.env.time - time_start_update
         )
 
+    def _batch_flush_process(self):
+        """Flush the buffered updates every batch_flush_interval"""
+        while True:
+            yield self.env.timeout(self.config.batch_flush_interval)
+            if self._writer is not None:
+                self._writer.submit(self.flush_batch, key="flush_batch")
+            else:
+                self.flush_batch()
+
+    def terminate(self):
+        """Send the pending and buffered updates before terminating"""
+        if self._writer is not None:
+            self._writer.stop(drain=True)
+        if self.config.update_mode == "batch":
+            self.flush_batch()
+        super().terminate()
+
 
 def get_unique_entities(entity_attrs: List[AgentVariable]) -> Dict[str, List[Tuple[str, AgentVariable]]]:
     """
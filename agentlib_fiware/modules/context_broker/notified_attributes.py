@@ -1,6 +1,8 @@
 import logging
+import threading
 
-from typing import List
+from pathlib import Path
+from typing import Iterable, List, Literal, Optional, Set, Tuple
 
 from pydantic import (
     Field,
@@ -11,7 +13,6 @@ from pydantic import (
 from agentlib import AgentVariables, Agent
 from filip.custom_types import AnyMqttUrl
 from filip.models.ngsi_v2.subscriptions import \
-    EntityPattern, \
     Message, \
     Mqtt, \
     Notification, \
@@ -22,11 +23,17 @@ from agentlib.modules.communicator.mqtt import \
     BaseMqttClient, \
     BaseMQTTClientConfig
 from agentlib_fiware.modules.context_broker import base, scheduled_attributes
+from agentlib_fiware.modules.mqtt_receiver import AsyncReceiveConfig, AsyncReceiverMixin
+from agentlib_fiware.utils import notifications, subscriptions
+from agentlib_fiware.utils.subscription_registry import SubscriptionRegistry
+from agentlib_fiware.utils.subscriptions import SubscriptionGrouping
 
 logger = logging.getLogger(__name__)
 
 
-class NotifiedAttributesContextBrokerConfig(base.BaseContextBrokerConfig, BaseMQTTClientConfig):
+class NotifiedAttributesContextBrokerConfig(
+        base.BaseContextBrokerConfig, BaseMQTTClientConfig, AsyncReceiveConfig
+):
     read_entity_attributes: AgentVariables = Field(
         title="Specify which attributes to listen to.",
         default=[],
@@ -39,6 +46,85 @@ class NotifiedAttributesContextBrokerConfig(base.BaseContextBrokerConfig, BaseMQ
         title="MQTT Broker",
         description="Host if the MQTT Broker for IoT Agent communication"
     )
+    subscription_grouping: SubscriptionGrouping = Field(
+        default=SubscriptionGrouping.ENTITY,
+        title="Subscription grouping",
+        description="How to combine the entities into subscriptions. 'entity' "
+                    "creates one subscription per entity, 'grouped' lists several "
+                    "entities in one subscription and 'id_pattern' combines entities "
+                    "of the same type into one idPattern. Fewer subscriptions reduce "
+                    "the load of the ContextBroker on each entity update."
+    )
+    max_entities_per_subscription: int = Field(
+        default=100,
+        gt=0,
+        title="Maximal number of entities per subscription",
+        description="Only used if subscription_grouping is not 'entity'."
+    )
+    notification_attrs: Optional[List[str]] = Field(
+        default=None,
+        title="Notified attributes",
+        description="If given, the notifications only include these attributes. "
+                    "If not given, only the attributes read by the module are included."
+    )
+    notification_attrs_format: Literal["normalized", "keyValues"] = Field(
+        default="normalized",
+        title="Format of the notified attributes",
+        description="'keyValues' notifies only the values of the attributes, which "
+                    "reduces the message size. As no metadata is included, the "
+                    "current environment time is used as timestamp."
+    )
+    notification_metadata: Optional[List[str]] = Field(
+        default=None,
+        title="Notified metadata",
+        description="If given, only these metadata are included in the "
+                    "notifications, e.g. ['TimeInstant']."
+    )
+    only_changed_attrs: bool = Field(
+        default=False,
+        title="Only notify changed attributes",
+        description="If True, the notifications only include the attributes "
+                    "which changed."
+    )
+    throttling: Optional[int] = Field(
+        default=None,
+        ge=0,
+        title="Throttling",
+        description="Minimal time in seconds between two notifications "
+                    "of one subscription."
+    )
+    subscription_state_file: Optional[Path] = Field(
+        default=None,
+        title="Subscription state file",
+        description="If given, the ids of the created subscriptions are stored in "
+                    "this file and reused after a restart, as long as the "
+                    "subscriptions did not change. The subscriptions are then not "
+                    "deleted on terminate."
+    )
+    subscription_lease_duration: Optional[float] = Field(
+        default=None,
+        gt=0,
+        title="Subscription lease duration",
+        description="If given, the subscriptions expire after this time in seconds "
+                    "and are renewed in the background while the module runs. "
+                    "Thus, subscriptions of crashed agents stop sending notifications. "
+                    "As the ContextBroker keeps expired subscriptions, the expired "
+                    "ones with the description of this module are deleted on start."
+    )
+    delete_orphaned_subscriptions: bool = Field(
+        default=False,
+        title="Delete orphaned subscriptions",
+        description="If True, all other subscriptions with the description of "
+                    "this module, e.g. left by a crash, are deleted on start."
+    )
+    notification_decoding: Literal["strict", "fast"] = Field(
+        default="strict",
+        title="Notification decoding",
+        description="'strict' validates each notification with the filip models. "
+                    "'fast' parses the raw JSON (using orjson, if installed) and "
+                    "only extracts the needed values, which is much cheaper for "
+                    "high notification rates."
+    )
 
     @field_validator("read_entity_attributes")
     @classmethod
@@ -46,7 +132,7 @@ class NotifiedAttributesContextBrokerConfig(base.BaseContextBrokerConfig, BaseMQ
         return cls.check_entity_attrs(entity_attrs=entity_attrs, info=info)
 
 
-class NotifiedAttributesContextBroker(base.BaseContextBroker, BaseMqttClient):
+class NotifiedAttributesContextBroker(AsyncReceiverMixin, base.BaseContextBroker, BaseMqttClient):
     """
     This communicator enables the communication between
     modules of the AgentLib (i.e. Services) and the
@@ -60,9 +146,32 @@ class NotifiedAttributesContextBroker(base.BaseContextBroker, BaseMqttClient):
     config: NotifiedAttributesContextBrokerConfig
 
     def __init__(self, config: dict, agent: Agent):
+        # Notified (entity_id, attr_name) combinations, which are newer than
+        # the initial snapshot. None once the snapshot is sent.
+        self._notified_attributes: Optional[Set[Tuple[str, str]]] = set()
+        self._snapshot_lock = threading.Lock()
+        # The MQTT client is connected in super().__init__ and may receive
+        # notifications of persisted subscriptions before they are registered
+        self.subscription_ids: List[str] = []
+        self._unique_entities = {}
         super().__init__(config=config, agent=agent)
         self._unique_entities = base.get_unique_entities(self.config.read_entity_attributes)
-        self.subscription_ids: List[str] = []
+        self._start_receiver()
+        self._subscription_registry = SubscriptionRegistry(
+            http_client=self._httpc,
+            key=str(self.source),
+            description=f"{self.source}",
+            state_file=self.config.subscription_state_file,
+            lease_duration=self.config.subscription_lease_duration,
+            delete_orphans=self.config.delete_orphaned_subscriptions
+        )
+        # Get the current values once in bulk, used for the subscriptions
+        # and as initial values in process
+        self._initial_entities = scheduled_attributes.query_entity_attributes(
+            module=self,
+            unique_entities=self._unique_entities,
+            http_client=self._httpc
+        )
         self.create_subscription()
 
     @property
@@ -92,50 +201,107 @@ class NotifiedAttributesContextBroker(base.BaseContextBroker, BaseMqttClient):
         some entity changes.
         """
         topic = self.get_topic()
-        for entity_id, attrs in self._unique_entities.items():
-            entity = self._httpc.get_entity(entity_id=entity_id)
-            entity_pattern = EntityPattern(**entity.model_dump())
+        grouping = self.config.subscription_grouping
+        # Use the entity types to subscribe to the exact entities
+        entities = [
+            (entity_id, getattr(self._initial_entities.get(entity_id), "type", None))
+            for entity_id in self._unique_entities
+        ]
+        subs = []
+        for idx, group in enumerate(subscriptions.group_entities(
+                entities=entities,
+                grouping=grouping,
+                max_entities_per_subscription=self.config.max_entities_per_subscription
+        )):
+            if grouping == SubscriptionGrouping.ENTITY:
+                sub_topic = topic + "/" + group[0][0]
+            else:
+                sub_topic = topic + "/group_" + str(idx)
+            # Condition on the union of the attributes of all entities
+            attrs = sorted({
+                attr_tuple[0]
+                for entity_id, _ in group
+                for attr_tuple in self._unique_entities[entity_id]
+            })
             # Post new subscription
             sub = Subscription(
                 description=f"{self.source}",
                 subject=Subject(
-                    entities=[entity_pattern],
-                    condition={"attrs": [attr_tuple[0] for attr_tuple in attrs]}
+                    entities=subscriptions.get_entity_patterns(
+                        entities=group, grouping=grouping
+                    ),
+                    condition={"attrs": attrs}
                 ),
                 notification=Notification(
                     mqtt=Mqtt(url=self.config.mqtt_url,
-                              topic=topic + "/" + entity.id)
-                )
+                              topic=sub_topic),
+                    attrs=self.config.notification_attrs or attrs,
+                    attrsFormat=self.config.notification_attrs_format,
+                    metadata=self.config.notification_metadata,
+                    onlyChangedAttrs=self.config.only_changed_attrs
+                ),
+                throttling=self.config.throttling
             )
             self.logger.info("Posting subscription to topic '%s' with sub'=%s'",
-                             topic, sub.model_dump_json())
-            self.subscription_ids.append(
-                self._httpc.post_subscription(
-                    subscription=sub, update=True)
-            )
+                             sub_topic, sub.model_dump_json())
+            subs.append(sub)
+        self.subscription_ids = self._subscription_registry.register(subs)
 
     def process(self):
-        # Get current value
-        scheduled_attributes.get_entity_attributes(
-            module=self,
-            entity_attributes=self.config.read_entity_attributes,
-            http_client=self._httpc
-        )
+        # Send the current values fetched on start, except for the
+        # attributes already set by newer notifications
+        with self._snapshot_lock:
+            notified_attributes = self._notified_attributes
+            scheduled_attributes.send_entity_attributes(
+                module=self,
+                unique_entities={
+                    entity_id: [
+                        (attr_name, variable) for attr_name, variable in attributes_variables
+                        if (entity_id, attr_name) not in notified_attributes
+                    ]
+                    for entity_id, attributes_variables in self._unique_entities.items()
+                },
+                entities=self._initial_entities
+            )
+            self._notified_attributes = None
+            self._initial_entities = {}
         yield self.env.event()
 
+    def _mark_notified(self, entity_id: str, attr_names: Iterable[str]):
+        """Exclude the notified attributes from the pending initial snapshot"""
+        if self._notified_attributes is None:
+            return
+        with self._snapshot_lock:
+            if self._notified_attributes is not None:
+                self._notified_attributes.update(
+                    (entity_id, attr_name) for attr_name in attr_names
+                )
+
     def _message_callback(self, client, userdata, msg):
         """
         Receive a message from the mqtt broker and send it,
         as long as it matches entities attributes, to the
         data_broker.
         """
-        payload = Message.model_validate_json(msg.payload.decode())
+        # The filip models only support normalized notifications
+        if (
+                self.config.notification_decoding == "fast" or
+                self.config.notification_attrs_format == "keyValues"
+        ):
+            self._process_notification_fast(payload=msg.payload)
+        else:
+            self._process_notification(payload=msg.payload)
+
+    def _process_notification(self, payload: bytes):
+        """Decode the notification using the filip models"""
+        payload = Message.model_validate_json(payload.decode())
         if payload.subscriptionId not in self.subscription_ids:
             self.logger.debug("Received unregistered subscription! %s not in %s",
                               payload.subscriptionId,
                               self.subscription_ids)
             return
         for entity in payload.data:
+            self._mark_notified(entity.id, entity.get_attribute_names())
             for attr_name, variable in self._unique_entities[entity.id]:
                 scheduled_attributes.process_entity_attribute_and_send_to_databroker(
                     module=self,
@@ -143,3 +309,36 @@ class NotifiedAttributesContextBroker(base.BaseContextBroker, BaseMqttClient):
                     variable=variable,
                     attr_name=attr_name
                 )
+
+    def _process_notification_fast(self, payload: bytes):
+        """
+        Decode the notification into plain dicts and only
+        extract the values, without building filip models.
+        """
+        key_values = self.config.notification_attrs_format == "keyValues"
+        subscription_id, data = notifications.decode_notification(payload)
+        if subscription_id not in self.subscription_ids:
+            self.logger.debug("Received unregistered subscription! %s not in %s",
+                              subscription_id,
+                              self.subscription_ids)
+            return
+        for item in data:
+            self._mark_notified(item.get("id"), item)
+            for attr_name, variable in self._unique_entities.get(item.get("id"), []):
+                scheduled_attributes.process_raw_attribute_and_send_to_databroker(
+                    module=self,
+                    entity_id=item["id"],
+                    attributes=item,
+                    attr_name=attr_name,
+                    variable=variable,
+                    key_values=key_values
+                )
+
+    def terminate(self):
+        """Disconnect the subscriptions, unless they are persisted"""
+        self._subscription_registry.stop(
+            delete=self.config.subscription_state_file is None
+        )
+        super().terminate()
+        # Process the pending messages after disconnecting
+        self._stop_receiver()
@@ -1,17 +1,21 @@
 import logging
+from typing import Dict, List, Optional, Tuple
 
 from pydantic import (
     Field,
     field_validator,
     ValidationInfo
 )
-from filip.models.ngsi_v2.context import ContextEntity
+from filip.models.ngsi_v2.context import ContextEntity, NamedContextAttribute
 from filip.clients.ngsi_v2 import ContextBrokerClient
 
-from agentlib import AgentVariables, AgentVariable
+from agentlib import Agent, AgentVariables, AgentVariable
 
 import agentlib_fiware.utils
+import agentlib_fiware.utils.notifications
 from agentlib_fiware.modules.context_broker import base
+from agentlib_fiware.utils.change_detection import ChangeDetector
+from agentlib_fiware.utils.query import query_entities
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +35,21 @@ class ScheduledAttributesContextBrokerConfig(base.BaseContextBrokerConfig):
                     "The name is an entity_name/attr_name combination to listen to."
     )
 
+    forward_only_changes: bool = Field(
+        default=False,
+        title="Forward only changes",
+        description="If True, a polled attribute is only sent into the data_broker "
+                    "if its value or its modification date (dateModified or "
+                    "TimeInstant) changed since it was last sent."
+    )
+    heartbeat_cycles: Optional[int] = Field(
+        default=None,
+        gt=0,
+        title="Heartbeat cycles",
+        description="If forward_only_changes=True, still send each attribute "
+                    "at least every heartbeat_cycles polling cycles."
+    )
+
     @field_validator("read_entity_attributes")
     @classmethod
     def check_read_entity_attrs(cls, entity_attrs, info: ValidationInfo):
@@ -40,12 +59,23 @@ class ScheduledAttributesContextBrokerConfig(base.BaseContextBrokerConfig):
 class ScheduledAttributesContextBroker(base.BaseContextBroker):
     config: ScheduledAttributesContextBrokerConfig
 
+    def __init__(self, config: dict, agent: Agent):
+        super().__init__(config=config, agent=agent)
+        self._change_detector: Optional[ChangeDetector] = None
+        if self.config.forward_only_changes:
+            self._change_detector = ChangeDetector(
+                heartbeat_cycles=self.config.heartbeat_cycles
+            )
+
     def process(self):
         while True:
+            if self._change_detector is not None:
+                self._change_detector.next_cycle()
             get_entity_attributes(
                 module=self,
                 entity_attributes=self.config.read_entity_attributes,
-                http_client=self._httpc
+                http_client=self._httpc,
+                change_detector=self._change_detector
             )
             yield self.env.timeout(self.config.read_interval)
 
@@ -53,38 +83,178 @@ class ScheduledAttributesContextBroker(base.BaseContextBroker):
 def get_entity_attributes(
         module: base.BaseContextBroker,
         entity_attributes: list,
-        http_client: ContextBrokerClient
+        http_client: ContextBrokerClient,
+        change_detector: ChangeDetector = None
 ):
+    """
+    Get the given entity attributes from the ContextBroker and send
+    them into the data_broker. All entities are requested with
+    paginated op/query requests which only include the needed attributes,
+    using the query_chunk_size and query_max_workers of the module config.
+    If a change_detector is given, unchanged attributes are not sent.
+    """
     unique_entities = base.get_unique_entities(entity_attributes)
+    if not unique_entities:
+        return
+    entities = query_entity_attributes(
+        module=module,
+        unique_entities=unique_entities,
+        http_client=http_client,
+        # Include the modification date for the change detection
+        metadata=None if change_detector is None else ["*", "dateModified"]
+    )
+    send_entity_attributes(
+        module=module,
+        unique_entities=unique_entities,
+        entities=entities,
+        change_detector=change_detector
+    )
+
+
+def query_entity_attributes(
+        module: base.BaseContextBroker,
+        unique_entities: Dict[str, List[Tuple[str, AgentVariable]]],
+        http_client: ContextBrokerClient,
+        metadata: Optional[List[str]] = None
+) -> Dict[str, ContextEntity]:
+    """
+    Get the entities with only the needed attributes from the ContextBroker,
+    using the query_chunk_size and query_max_workers of the module config.
+
+    Returns:
+        Dict[str, ContextEntity]: The existing entities by id
+    """
+    entities = query_entities(
+        http_client=http_client,
+        entity_ids=list(unique_entities),
+        attrs=sorted({attr_name for attributes_variables in unique_entities.values()
+                      for attr_name, _ in attributes_variables}),
+        metadata=metadata,
+        chunk_size=module.config.query_chunk_size,
+        max_workers=module.config.query_max_workers
+    )
+    return {entity.id: entity for entity in entities}
+
+
+def send_entity_attributes(
+        module: base.BaseContextBroker,
+        unique_entities: Dict[str, List[Tuple[str, AgentVariable]]],
+        entities: Dict[str, ContextEntity],
+        change_detector: ChangeDetector = None
+):
+    """
+    Send the attributes of the given entities into the data_broker.
+    If a change_detector is given, unchanged attributes are not sent.
+    """
+    # Collect all attributes to send, to convert their times in one batch
+    variables_attributes = []
     for entity_id, attributes_variables in unique_entities.items():
-        entity = http_client.get_entity(entity_id=entity_id)
+        entity = entities.get(entity_id)
+        if entity is None:
+            module.logger.error("Entity '%s' not in fiware header '%s'",
+                                entity_id, module.config.fiware_header)
+            continue
         for attr_name, variable in attributes_variables:
-            process_entity_attribute_and_send_to_databroker(
-                module=module, entity=entity, attr_name=attr_name, variable=variable
+            attr = get_attribute_to_send(
+                module=module, entity=entity, attr_name=attr_name, variable=variable,
+                change_detector=change_detector
             )
+            if attr is not None:
+                variables_attributes.append((variable, attr))
+    times_unix = agentlib_fiware.utils.extract_times_from_time_instants(
+        time_instants=[_get_time_instant(attr) for _, attr in variables_attributes],
+        env=module.env,
+        time_format=module.config.time_format
+    )
+    for (variable, attr), time_unix in zip(variables_attributes, times_unix):
+        _send_to_databroker(module=module, variable=variable, value=attr.value, time_unix=time_unix)
 
 
-def process_entity_attribute_and_send_to_databroker(
+def get_attribute_to_send(
         module: base.BaseContextBroker,
         entity: ContextEntity,
         attr_name: str,
-        variable: AgentVariable
-):
+        variable: AgentVariable,
+        change_detector: ChangeDetector = None
+) -> Optional[NamedContextAttribute]:
+    """
+    Return the attribute of the entity, or None if it does not exist
+    or if the change_detector detects no change.
+    """
     try:
         attr = entity.get_attribute(attr_name)
     except KeyError as err:
         module.logger.error("Attribute '%s' not in entity '%s'. Error: %s",
                             attr_name, entity.id, err)
+        return None
+    if change_detector is not None:
+        marker = attr.metadata.get("dateModified", attr.metadata.get("TimeInstant"))
+        if not change_detector.should_forward(
+                key=variable.name,
+                value=attr.value,
+                marker=None if marker is None else marker.value
+        ):
+            return None
+    return attr
+
+
+def process_entity_attribute_and_send_to_databroker(
+        module: base.BaseContextBroker,
+        entity: ContextEntity,
+        attr_name: str,
+        variable: AgentVariable,
+        change_detector: ChangeDetector = None
+):
+    attr = get_attribute_to_send(
+        module=module, entity=entity, attr_name=attr_name, variable=variable,
+        change_detector=change_detector
+    )
+    if attr is None:
         return
     time_unix = agentlib_fiware.utils.extract_time_from_attribute(
         attribute=attr, env=module.env, time_format=module.config.time_format
     )
+    _send_to_databroker(module=module, variable=variable, value=attr.value, time_unix=time_unix)
+
+
+def _get_time_instant(attr: NamedContextAttribute) -> Optional[str]:
+    time_instant = attr.metadata.get("TimeInstant")
+    return None if time_instant is None else time_instant.value
+
+
+def _send_to_databroker(module: base.BaseContextBroker, variable: AgentVariable, value, time_unix: float):
     module.set(
         name=variable.name,
-        value=attr.value,
+        value=value,
         timestamp=time_unix
     )
     module.logger.debug(
         "Send variable '%s=%s' at time '%s' into data_broker",
-        variable.alias, attr.value, time_unix
+        variable.alias, value, time_unix
+    )
+
+
+def process_raw_attribute_and_send_to_databroker(
+        module: base.BaseContextBroker,
+        entity_id: str,
+        attributes: dict,
+        attr_name: str,
+        variable: AgentVariable,
+        key_values: bool = False
+):
+    """
+    Same as process_entity_attribute_and_send_to_databroker, but for
+    the plain dict of a notification decoded with
+    agentlib_fiware.utils.notifications.decode_notification.
+    Set key_values=True for notifications in keyValues format.
+    """
+    if attr_name not in attributes or not (key_values or isinstance(attributes[attr_name], dict)):
+        module.logger.debug("Attribute '%s' not in notification of entity '%s'.",
+                            attr_name, entity_id)
+        return
+    value, time_instant = agentlib_fiware.utils.notifications.\
+        get_attribute_value_and_time_instant(attributes[attr_name], key_values=key_values)
+    time_unix = agentlib_fiware.utils.extract_time_from_time_instant(
+        time_instant=time_instant, env=module.env, time_format=module.config.time_format
     )
+    _send_to_databroker(module=module, variable=variable, value=value, time_unix=time_unix)
@@ -3,8 +3,9 @@ Custom module to only change the value being send
 by the service_to_cb module.
 """
 import logging
+from typing import List, Optional
 
-from filip.clients.ngsi_v2 import ContextBrokerClient
+from filip.models.ngsi_v2.base import EntityPattern
 
 from pydantic import (
     Field,
@@ -12,9 +13,13 @@ from pydantic import (
     ValidationInfo
 )
 
-from agentlib import AgentVariables
+from agentlib import Agent, AgentVariable, AgentVariables
 
 from agentlib_fiware.modules.context_broker import base
+from agentlib_fiware.utils import sessions
+from agentlib_fiware.utils.change_detection import ChangeDetector
+from agentlib_fiware.utils.entity_cache import get_entity_schema_cache
+from agentlib_fiware.utils.query import iter_query_entities, query_entities
 
 logger = logging.getLogger(__name__)
 
@@ -26,44 +31,172 @@ class ScheduledEntitiesContextBrokerConfig(base.BaseContextBrokerConfig):
         description="List of AgentVariables. "
                     "The name is a entity_id to listen to."
     )
+    read_entity_patterns: List[EntityPattern] = Field(
+        default=[],
+        title="Entity patterns to listen to",
+        description="List of NGSI-v2 entity patterns, e.g. "
+                    "{'idPattern': '^Room.*', 'type': 'Room'}. "
+                    "All matching entities are sent as a list "
+                    "using the matched_entities variable."
+    )
+    matched_entities: AgentVariable = Field(
+        default=AgentVariable(
+            name="matched_entities",
+            type="list",
+            description="List of all entities matching read_entity_patterns"
+        ),
+        title="Variable for the entities matching read_entity_patterns"
+    )
     read_interval: float = Field(
         default=5,
         title="Read Interval",
         description="Interval in which the service "
     )
+    forward_only_changes: bool = Field(
+        default=False,
+        title="Forward only changes",
+        description="If True, a polled entity is only sent into the data_broker "
+                    "if any of its attributes or metadata changed since it was last sent."
+    )
+    heartbeat_cycles: Optional[int] = Field(
+        default=None,
+        gt=0,
+        title="Heartbeat cycles",
+        description="If forward_only_changes=True, still send each entity "
+                    "at least every heartbeat_cycles polling cycles."
+    )
 
     @field_validator("read_entities")
     @classmethod
     def check_entities(cls, entities, info: ValidationInfo):
-        with ContextBrokerClient(
+        if not entities:
+            return entities
+        with sessions.get_context_broker_client(
                 url=info.data["cb_url"],
                 fiware_header=info.data["fiware_header"]
         ) as httpc:
-            # Check if the data even exists.
-            for entity_var in entities:
-                httpc.get_entity(entity_id=entity_var.name)
-
+            found_entities = query_entities(
+                http_client=httpc,
+                entity_ids=list({entity_var.name for entity_var in entities}),
+                chunk_size=info.data["query_chunk_size"],
+                max_workers=info.data["query_max_workers"]
+            )
+        # Record the schema to avoid fetching the entities again for updates
+        schema_cache = get_entity_schema_cache(
+            cb_url=info.data["cb_url"],
+            fiware_header=info.data["fiware_header"]
+        )
+        for entity in found_entities:
+            schema_cache.add_entity(entity)
+        # Check if the data even exists and report all missing entities at once.
+        found_ids = {entity.id for entity in found_entities}
+        missing = [entity_var.name for entity_var in entities
+                   if entity_var.name not in found_ids]
+        if missing:
+            raise ValueError(
+                f"The following entities do not exist in the "
+                f"ContextBroker: {', '.join(missing)}"
+            )
         return entities
 
 
 class ScheduledEntitiesContextBroker(base.BaseContextBroker):
     config: ScheduledEntitiesContextBrokerConfig
 
+    def __init__(self, config: dict, agent: Agent):
+        super().__init__(config=config, agent=agent)
+        self._change_detector: Optional[ChangeDetector] = None
+        if self.config.forward_only_changes:
+            self._change_detector = ChangeDetector(
+                heartbeat_cycles=self.config.heartbeat_cycles
+            )
+
     def process(self):
         while True:
-            for entity_variable in self.config.read_entities:
-                try:
-                    entity = self._httpc.get_entity(entity_id=entity_variable.name)
-                except KeyError:
-                    self.logger.error("Entity '%s' not in fiware header '%s'",
-                                      entity_variable.name, self.config.fiware_header)
-                    return
-                self.set(
-                    name=entity_variable.name,
-                    value=entity
-                )
-                self.logger.info(
-                    "Send entity '%s' with alias %s into data_broker",
-                    entity.id, entity_variable.alias
-                )
+            if self._change_detector is not None:
+                self._change_detector.next_cycle()
+            self._poll_entities()
+            self._poll_entity_patterns()
             yield self.env.timeout(self.config.read_interval)
+
+    def _poll_entities(self):
+        """
+        Get all read_entities with bulk op/query requests and send them
+        into the data_broker. Missing entities or failed requests are
+        logged without affecting the other entities.
+        """
+        if not self.config.read_entities:
+            return
+        entities = {}
+        for chunk in iter_query_entities(
+                http_client=self._httpc,
+                entity_ids=list({entity_var.name for entity_var in self.config.read_entities}),
+                chunk_size=self.config.query_chunk_size,
+                max_workers=self.config.query_max_workers,
+                on_error=self._log_query_error
+        ):
+            for entity in chunk:
+                entities[entity.id] = entity
+        for entity_variable in self.config.read_entities:
+            entity = entities.get(entity_variable.name)
+            if entity is None:
+                self.logger.error("Entity '%s' not in fiware header '%s'",
+                                  entity_variable.name, self.config.fiware_header)
+                continue
+            if (
+                    self._change_detector is not None and
+                    not self._change_detector.should_forward(
+                        key=entity_variable.name,
+                        value=entity.model_dump()
+                    )
+            ):
+                continue
+            self.set(
+                name=entity_variable.name,
+                value=entity
+            )
+            self.logger.info(
+                "Send entity '%s' with alias %s into data_broker",
+                entity.id, entity_variable.alias
+            )
+
+    def _poll_entity_patterns(self):
+        """
+        Get all entities matching read_entity_patterns with paginated
+        op/query requests and send them as one list into the data_broker.
+        """
+        if not self.config.read_entity_patterns:
+            return
+        entities = {}
+        for chunk in iter_query_entities(
+                http_client=self._httpc,
+                entity_patterns=self.config.read_entity_patterns,
+                chunk_size=self.config.query_chunk_size,
+                max_workers=self.config.query_max_workers,
+                on_error=self._log_query_error
+        ):
+            for entity in chunk:
+                # Patterns may overlap
+                entities[(entity.id, entity.type)] = entity
+        entities = list(entities.values())
+        if (
+                self._change_detector is not None and
+                not self._change_detector.should_forward(
+                    key=self.config.matched_entities.name,
+                    value=[entity.model_dump() for entity in entities]
+                )
+        ):
+            return
+        self.set(
+            name=self.config.matched_entities.name,
+            value=entities
+        )
+        self.logger.info(
+            "Send %s entities matching the read_entity_patterns into data_broker",
+            len(entities)
+        )
+
+    def _log_query_error(self, err: Exception, chunk: List[EntityPattern]):
+        self.logger.error("Could not get %s entities from the ContextBroker, "
+                          "e.g. '%s'. Error: %s",
+                          len(chunk), chunk[0].model_dump_json(exclude_none=True), err)
@@ -1,5 +1,8 @@
+import logging
 import warnings
 from abc import abstractmethod
+from types import MappingProxyType
+from typing import Callable, Iterable, Optional, Tuple
 
 from filip.clients.mqtt import IoTAMQTTClient
 from filip.models import FiwareHeader
@@ -11,10 +14,15 @@ from pydantic import ConfigDict, Field, PrivateAttr
 from agentlib.modules.communicator.mqtt import \
     AgentVariable, \
     BaseMqttClient, \
-    BaseMQTTClientConfig
+    BaseMQTTClientConfig, \
+    Agent
 
+from agentlib_fiware.modules.mqtt_receiver import AsyncReceiveConfig, AsyncReceiverMixin
 
-class BaseIoTACommunicatorConfig(BaseMQTTClientConfig):
+logger = logging.getLogger(__name__)
+
+
+class BaseIoTACommunicatorConfig(BaseMQTTClientConfig, AsyncReceiveConfig):
     model_config = ConfigDict(extra="forbid")
 
     mqtt_url: AnyMqttUrl = Field(
@@ -98,9 +106,73 @@ class BaseIoTACommunicatorConfig(BaseMQTTClientConfig):
         raise NotImplementedError
 
 
-class BaseIoTACommunicator(BaseMqttClient):
+class AliasRoutingTable:
+    """
+    Frozen lookup tables between (device/entity id, attribute name)
+    combinations and their alias, computed once instead of for
+    every message.
+
+    Args:
+        get_alias callable: get_alias(id, attr_name) returning the alias,
+            used to build the table and for unknown combinations
+        keys iterable: All known (id, attr_name) combinations
+    """
+
+    def __init__(
+            self,
+            get_alias: Callable[[str, str], str],
+            keys: Iterable[Tuple[str, str]]
+    ):
+        self._get_alias = get_alias
+        aliases = {}
+        keys_by_alias = {}
+        for key in keys:
+            alias = get_alias(*key)
+            if keys_by_alias.get(alias, key) != key:
+                logger.warning("Alias '%s' is used for %s and %s. Check your alias_routing.",
+                               alias, keys_by_alias[alias], key)
+            aliases[key] = alias
+            keys_by_alias.setdefault(alias, key)
+        self.aliases = MappingProxyType(aliases)
+        self.keys_by_alias = MappingProxyType(keys_by_alias)
+
+    def get_alias(self, id_: str, name: str) -> str:
+        """Return the alias of the attribute, computing it for unknown combinations."""
+        alias = self.aliases.get((id_, name))
+        if alias is None:
+            return self._get_alias(id_, name)
+        return alias
+
+    def get_key(self, alias: str) -> Optional[Tuple[str, str]]:
+        """Return the (id, attr_name) of the given alias or None if unknown."""
+        return self.keys_by_alias.get(alias)
+
+
+class BaseIoTACommunicator(AsyncReceiverMixin, BaseMqttClient):
     config: BaseIoTACommunicatorConfig
     mqttc_type = IoTAMQTTClient
+    _alias_table: Optional[AliasRoutingTable] = None
+
+    def __init__(self, config: dict, agent: Agent):
+        super().__init__(config=config, agent=agent)
+        self._start_receiver()
+
+    @property
+    def alias_table(self) -> AliasRoutingTable:
+        """The routing table of the aliases, built on first use."""
+        if self._alias_table is None:
+            self._alias_table = self.build_alias_table()
+        return self._alias_table
+
+    def build_alias_table(self) -> AliasRoutingTable:
+        """
+        Overwrite this method to build the routing table
+        for all known devices or entities.
+        """
+        return AliasRoutingTable(
+            get_alias=lambda id_, name: self.config.get_alias_for_attribute_name(name, id_),
+            keys=[]
+        )
 
     @property
     def url(self) -> AnyMqttUrl:
@@ -109,3 +181,8 @@ class BaseIoTACommunicator(BaseMqttClient):
     def process(self):
         """The IoTa modules are only callback driven"""
         yield self.env.event()
+
+    def terminate(self):
+        """Process the pending messages after disconnecting"""
+        super().terminate()
+        self._stop_receiver()
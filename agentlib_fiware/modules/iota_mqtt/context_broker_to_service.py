@@ -2,9 +2,11 @@
 
 """
 import logging
-from typing import List, Union, Optional
+import threading
+from typing import Dict, Iterator, List, Literal, Set, Tuple, Union, Optional
 from pathlib import Path
 
+import requests
 from filip.clients.ngsi_v2 import ContextBrokerClient
 from filip.models.ngsi_v2.context import ContextEntity, NamedCommand
 from filip.models.ngsi_v2.subscriptions import \
@@ -24,10 +26,16 @@ from pydantic import (
 from agentlib import Agent, AgentVariable
 
 from agentlib_fiware.modules.iota_mqtt.base import (
+    AliasRoutingTable,
     BaseIoTACommunicatorConfig,
     BaseIoTACommunicator
 )
 from agentlib_fiware import utils
+from agentlib_fiware.utils import notifications, sessions, subscriptions
+from agentlib_fiware.utils.subscription_registry import SubscriptionRegistry
+from agentlib_fiware.utils.subscriptions import SubscriptionGrouping
+from agentlib_fiware.utils.query import iter_query_entities
+from agentlib_fiware.utils.workers import BackgroundWorker, OverflowPolicy
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +45,27 @@ class ContextBrokerCommunicatorConfig(BaseIoTACommunicatorConfig):
         title="Context Broker",
         description="Url of the FIWARE's Context Broker"
     )
+    query_chunk_size: int = Field(
+        default=100,
+        gt=0,
+        title="Query chunk size",
+        description="Maximal number of entities requested with one "
+                    "NGSI-v2 op/query when syncing the entities."
+    )
+    query_max_workers: int = Field(
+        default=4,
+        gt=0,
+        title="Maximal number of concurrent op/query requests"
+    )
+    defer_entity_sync: bool = Field(
+        default=False,
+        title="Defer entity synchronisation",
+        description="If True, the attributes of the entities are not synced with "
+                    "the ContextBroker during validation but in a background "
+                    "thread after the module started. Commands found during the "
+                    "sync are registered as they arrive. If alias_routing is not "
+                    "given, it is selected based on the attributes in the config only."
+    )
     entities: Union[List[ContextEntity], Union[Path, str]] = Field(
         title="Context Entities",
         description="List of Context Entities in the Context Broker that the "
@@ -62,6 +91,108 @@ class ContextBrokerCommunicatorConfig(BaseIoTACommunicatorConfig):
         title="The format to convert fiware "
               "datetime into unix time"
     )
+    subscription_grouping: SubscriptionGrouping = Field(
+        default=SubscriptionGrouping.ENTITY,
+        title="Subscription grouping",
+        description="How to combine the entities into subscriptions. 'entity' "
+                    "creates one subscription per entity, 'grouped' lists several "
+                    "entities in one subscription and 'id_pattern' combines entities "
+                    "of the same type into one idPattern. Fewer subscriptions reduce "
+                    "the load of the ContextBroker on each entity update."
+    )
+    max_entities_per_subscription: int = Field(
+        default=100,
+        gt=0,
+        title="Maximal number of entities per subscription",
+        description="Only used if subscription_grouping is not 'entity'."
+    )
+    notification_attrs: Optional[List[str]] = Field(
+        default=None,
+        title="Notified attributes",
+        description="If given, the notifications only include these attributes."
+    )
+    notification_attrs_format: Literal["normalized", "keyValues"] = Field(
+        default="normalized",
+        title="Format of the notified attributes",
+        description="'keyValues' notifies only the values of the attributes, which "
+                    "reduces the message size. As no metadata is included, the "
+                    "current environment time is used as timestamp."
+    )
+    notification_metadata: Optional[List[str]] = Field(
+        default=None,
+        title="Notified metadata",
+        description="If given, only these metadata are included in the "
+                    "notifications, e.g. ['TimeInstant']."
+    )
+    only_changed_attrs: bool = Field(
+        default=False,
+        title="Only notify changed attributes",
+        description="If True, the notifications only include the attributes "
+                    "which changed."
+    )
+    throttling: Optional[int] = Field(
+        default=None,
+        ge=0,
+        title="Throttling",
+        description="Minimal time in seconds between two notifications "
+                    "of one subscription."
+    )
+    subscription_state_file: Optional[Path] = Field(
+        default=None,
+        title="Subscription state file",
+        description="If given, the ids of the created subscriptions are stored in "
+                    "this file and reused after a restart, as long as the "
+                    "subscriptions did not change. The subscriptions are then not "
+                    "deleted on terminate."
+    )
+    subscription_lease_duration: Optional[float] = Field(
+        default=None,
+        gt=0,
+        title="Subscription lease duration",
+        description="If given, the subscriptions expire after this time in seconds "
+                    "and are renewed in the background while the module runs. "
+                    "Thus, subscriptions of crashed agents stop sending notifications. "
+                    "As the ContextBroker keeps expired subscriptions, the expired "
+                    "ones with the description of this module are deleted on start."
+    )
+    delete_orphaned_subscriptions: bool = Field(
+        default=False,
+        title="Delete orphaned subscriptions",
+        description="If True, all other subscriptions with the description of "
+                    "this module, e.g. left by a crash, are deleted on start."
+    )
+    notification_decoding: Literal["strict", "fast"] = Field(
+        default="strict",
+        title="Notification decoding",
+        description="'strict' validates each notification with the filip models. "
+                    "'fast' parses the raw JSON (using orjson, if installed) and "
+                    "only extracts the needed values, which is much cheaper for "
+                    "high notification rates."
+    )
+    async_commands: bool = Field(
+        default=False,
+        title="Asynchronous commands",
+        description="If True, commands are posted to the ContextBroker "
+                    "by background threads instead of inside the data_broker "
+                    "callback, so a slow ContextBroker does not block other modules."
+    )
+    async_workers: int = Field(
+        default=1,
+        gt=0,
+        title="Number of background threads for async_commands"
+    )
+    async_queue_size: int = Field(
+        default=1000,
+        gt=0,
+        title="Maximal number of pending commands for async_commands"
+    )
+    async_overflow_policy: OverflowPolicy = Field(
+        default=OverflowPolicy.BLOCK,
+        title="Overflow policy for async_commands",
+        description="'drop_oldest' discards the oldest pending command, "
+                    "'block' waits for a free slot and 'coalesce' replaces "
+                    "a pending command of the same entity and name."
+    )
 
     @field_validator("subtopics")
     @classmethod
@@ -86,18 +217,26 @@ class ContextBrokerCommunicatorConfig(BaseIoTACommunicatorConfig):
         if isinstance(entities, (Path, str)):
             entities = utils.parse_file_as(List[ContextEntity], entities)
 
-        with ContextBrokerClient(
+        if info.data["defer_entity_sync"]:
+            return entities
+        with sessions.get_context_broker_client(
                 url=info.data["cb_url"],
                 fiware_header=info.data["fiware_header"]
         ) as httpc:
             # sync with context broker
-            for entity in entities:
-                entity.add_attributes(
-                    httpc.get_entity_attributes(
-                        entity_id=entity.id,
-                        entity_type=entity.type)
-                )
-
+            synced = set(sync_entity_attributes(
+                entities=entities,
+                http_client=httpc,
+                chunk_size=info.data["query_chunk_size"],
+                max_workers=info.data["query_max_workers"]
+            ))
+        missing = [f"{entity.id} ({entity.type})" for entity in entities
+                   if (entity.id, entity.type) not in synced]
+        if missing:
+            raise ValueError(
+                f"The following entities do not exist in the "
+                f"ContextBroker: {', '.join(missing)}"
+            )
         return entities
 
     @field_validator("alias_routing")
@@ -183,18 +322,87 @@ class ContextBrokerCommunicator(BaseIoTACommunicator):
     mqttc_type = PahoMQTTClient
 
     def __init__(self, config: dict, agent: Agent):
+        # The MQTT client is connected in super().__init__ and may receive
+        # notifications of persisted subscriptions before they are registered
+        self.subscription_ids: List[str] = []
+        self.entities_map = {}
         super().__init__(config=config, agent=agent)
         # Create entities map
-        self.entities_map = {}
         for entity in self.config.entities:
             self.entities_map[(entity.id, entity.type)] = entity
 
-        self._httpc = ContextBrokerClient(
+        self._httpc = sessions.get_context_broker_client(
             url=self.config.cb_url,
             fiware_header=self.config.fiware_header
         )
-        self.subscription_ids: List[str] = []
+        self._writer: Optional[BackgroundWorker] = None
+        if self.config.async_commands:
+            self._writer = BackgroundWorker(
+                name=f"{self.agent.id}/{self.id}_writer",
+                num_workers=self.config.async_workers,
+                max_queue_size=self.config.async_queue_size,
+                overflow_policy=self.config.async_overflow_policy
+            )
+        self._subscription_registry = SubscriptionRegistry(
+            http_client=self._httpc,
+            key=str(self.source),
+            description=f"{self.source}",
+            state_file=self.config.subscription_state_file,
+            lease_duration=self.config.subscription_lease_duration,
+            delete_orphans=self.config.delete_orphaned_subscriptions
+        )
         self.create_subscription()
+        if self.config.defer_entity_sync:
+            threading.Thread(
+                target=self._sync_entities,
+                name=f"{self.agent.id}/{self.id}_entity_sync",
+                daemon=True
+            ).start()
+
+    def _sync_entities(self):
+        """
+        Sync the attributes of the entities with the ContextBroker
+        and register the callbacks of commands as they arrive.
+        Used if defer_entity_sync=True.
+        """
+        synced = set()
+        try:
+            for entity_key in sync_entity_attributes(
+                    entities=self.config.entities,
+                    http_client=self._httpc,
+                    chunk_size=self.config.query_chunk_size,
+                    max_workers=self.config.query_max_workers
+            ):
+                synced.add(entity_key)
+                self._register_command_callbacks(entity=self.entities_map[entity_key])
+        except requests.exceptions.RequestException as err:
+            self.logger.error("Could not sync entities with the ContextBroker: %s", err)
+            return
+        # Include the synced attributes in the routing table
+        self._alias_table = self.build_alias_table()
+        missing = set(self.entities_map).difference(synced)
+        if missing:
+            self.logger.error("The following entities do not exist in the ContextBroker: %s",
+                              sorted(missing))
+        self.logger.info("Synced %s entities with the ContextBroker", len(synced))
+
+    def build_alias_table(self) -> AliasRoutingTable:
+        return AliasRoutingTable(
+            get_alias=lambda entity_id, name: self.config.get_alias_for_attribute_name(
+                name=name, entity_name=entity_id
+            ),
+            keys=[
+                (entity.id, attr_name)
+                for entity in self.config.entities
+                for attr_name in entity.get_attribute_names()
+            ]
+        )
+
+    def get_writer_metrics(self) -> Dict[str, float]:
+        """Return the queue metrics of the async writer, if active."""
+        if self._writer is None:
+            return {}
+        return self._writer.get_metrics()
 
     def get_all_topics(self):
         return [self.config.get_topic() + "/#"]
@@ -208,23 +416,31 @@ class ContextBrokerCommunicator(BaseIoTACommunicator):
         """
         topic = self.config.get_topic()
 
-        for entity in self.config.entities:
-            entity_pattern = EntityPattern(**entity.model_dump())
+        subs = []
+        for group in subscriptions.group_entities(
+                entities=[(entity.id, entity.type) for entity in self.config.entities],
+                grouping=self.config.subscription_grouping,
+                max_entities_per_subscription=self.config.max_entities_per_subscription
+        ):
             sub = Subscription(
                 description=f"{self.source}",
                 subject=Subject(
-                    entities=[entity_pattern]
+                    entities=subscriptions.get_entity_patterns(
+                        entities=group, grouping=self.config.subscription_grouping
+                    )
                 ),
                 notification=Notification(
                     mqtt=Mqtt(url=self.config.mqtt_url,
-                              topic=topic)
-                )
-            )
-            self.subscription_ids.append(
-                self._httpc.post_subscription(
-                    subscription=sub,
-                    update=True)
+                              topic=topic),
+                    attrs=self.config.notification_attrs,
+                    attrsFormat=self.config.notification_attrs_format,
+                    metadata=self.config.notification_metadata,
+                    onlyChangedAttrs=self.config.only_changed_attrs
+                ),
+                throttling=self.config.throttling
             )
+            subs.append(sub)
+        self.subscription_ids = self._subscription_registry.register(subs)
 
     def _message_callback(self, client, userdata, msg):
         """
@@ -232,7 +448,18 @@ class ContextBrokerCommunicator(BaseIoTACommunicator):
         as long as it matches entities attributes, to the
         data_broker.
         """
-        payload = Message.model_validate_json(msg.payload.decode())
+        # The filip models only support normalized notifications
+        if (
+                self.config.notification_decoding == "fast" or
+                self.config.notification_attrs_format == "keyValues"
+        ):
+            self._process_notification_fast(payload=msg.payload)
+        else:
+            self._process_notification(payload=msg.payload)
+
+    def _process_notification(self, payload: bytes):
+        """Decode the notification using the filip models"""
+        payload = Message.model_validate_json(payload.decode())
         if payload.subscriptionId not in self.subscription_ids:
             self.logger.debug("Received unregistered subscription! %s not in %s",
                               payload.subscriptionId,
@@ -252,47 +479,111 @@ class ContextBrokerCommunicator(BaseIoTACommunicator):
             for attr in props:
                 if attr in cmds or attr.name == "TimeInstant":
                     continue
-                alias = self.config.get_alias_for_attribute_name(
-                    name=attr.name,
-                    entity_name=entity.id
-                )
                 time_unix = utils.extract_time_from_attribute(
                     attribute=attr, time_format=self.config.time_format, env=self.env
                 )
-                self.agent.data_broker.send_variable(
-                    AgentVariable(
-                        name=alias,
-                        value=attr.value,
-                        source=self.source,
-                        timestamp=time_unix
-                    )
+                self._send_attribute(
+                    entity_id=entity.id, attr_name=attr.name,
+                    value=attr.value, time_unix=time_unix
+                )
+
+    def _process_notification_fast(self, payload: bytes):
+        """
+        Decode the notification into plain dicts and only
+        extract the values, without building filip models.
+        """
+        key_values = self.config.notification_attrs_format == "keyValues"
+        subscription_id, data = notifications.decode_notification(payload)
+        if subscription_id not in self.subscription_ids:
+            self.logger.debug("Received unregistered subscription! %s not in %s",
+                              subscription_id,
+                              self.subscription_ids)
+            return
+        for item in data:
+            entity = self.entities_map.get((item.get("id"), item.get("type")))
+            if entity is None:
+                self.logger.error("Received item for (%s, %s) does not match any entity.",
+                                  item.get("id"), item.get("type"))
+                return
+            if key_values:
+                # Without types, the commands are only known by their names
+                skipped_names = self._get_non_property_attribute_names(entity)
+                attr_names = [name for name in item if name not in skipped_names]
+            else:
+                # Same properties as the filip models of the strict path
+                attr_names = notifications.get_property_names(item)
+            for attr_name in attr_names:
+                if attr_name in ("id", "type", "TimeInstant"):
+                    continue
+                attr = item[attr_name]
+                value, time_instant = notifications.get_attribute_value_and_time_instant(
+                    attr, key_values=key_values
+                )
+                time_unix = utils.extract_time_from_time_instant(
+                    time_instant=time_instant, time_format=self.config.time_format, env=self.env
                 )
-                self.logger.debug(
-                    "Send variable '%s=%s' at time '%s' into data_broker",
-                    alias, attr.value, time_unix
+                self._send_attribute(
+                    entity_id=entity.id, attr_name=attr_name,
+                    value=value, time_unix=time_unix
                 )
 
+    @staticmethod
+    def _get_non_property_attribute_names(entity: ContextEntity) -> Set[str]:
+        """
+        Return the names of the commands, relationships and
+        command status and info attributes of the entity.
+        """
+        property_names = {attr.name for attr in entity.get_properties()}
+        return {
+            attr.name for attr in entity.get_attributes()
+            if attr.name not in property_names
+        }
+
+    def _send_attribute(self, entity_id: str, attr_name: str, value, time_unix: float):
+        """Send the notified attribute value into the data_broker"""
+        alias = self.alias_table.get_alias(entity_id, attr_name)
+        self.agent.data_broker.send_variable(
+            AgentVariable(
+                name=alias,
+                value=value,
+                source=self.source,
+                timestamp=time_unix
+            )
+        )
+        self.logger.debug(
+            "Send variable '%s=%s' at time '%s' into data_broker",
+            alias, value, time_unix
+        )
+
     def register_callbacks(self):
         """
         Registers the callbacks for data stream from other agents.
         """
+        self._registered_commands: Set[Tuple[str, str, str]] = set()
         for entity in self.config.entities:
-            for cmd in entity.get_commands():
-                alias = self.config.get_alias_for_attribute_name(
-                    name=cmd.name,
-                    entity_name=entity.id
-                )
-                self.agent.data_broker.register_callback(
-                    alias=alias,
-                    callback=self._cmd_callback,
-                    # Set kwargs to later access without needing
-                    # to loop over devices and attributes again
-                    name=cmd.name,
-                    entity=entity
-                )
-                self.logger.debug("Registered callback for alias '%s', "
-                                  "command '%s' of entity '%s'",
-                                  alias, cmd.name, entity.id)
+            self._register_command_callbacks(entity=entity)
+
+    def _register_command_callbacks(self, entity: ContextEntity):
+        """
+        Registers the callbacks for all commands of the entity,
+        skipping the already registered ones.
+        """
+        for cmd in entity.get_commands():
+            if (entity.id, entity.type, cmd.name) in self._registered_commands:
+                continue
+            self._registered_commands.add((entity.id, entity.type, cmd.name))
+            alias = self.alias_table.get_alias(entity.id, cmd.name)
+            self.agent.data_broker.register_callback(
+                alias=alias,
+                callback=self._cmd_callback,
+                # Set kwargs to later access without needing
+                # to loop over devices and attributes again
+                name=cmd.name,
+                entity=entity
+            )
+            self.logger.debug("Registered callback for alias '%s', "
+                              "command '%s' of entity '%s'",
+                              alias, cmd.name, entity.id)
 
     def _cmd_callback(
             self,
@@ -304,6 +595,21 @@ class ContextBrokerCommunicator(BaseIoTACommunicator):
         Receive the command callback from the AgentLib and
         send it to the ContextBroker.
         """
+        if self._writer is not None:
+            self._writer.submit(
+                self._post_command, variable=variable, name=name, entity=entity,
+                key=(entity.id, name)
+            )
+            return
+        self._post_command(variable=variable, name=name, entity=entity)
+
+    def _post_command(
+            self,
+            variable: AgentVariable,
+            name: str,
+            entity: ContextEntity
+    ):
+        """Post the command to the ContextBroker."""
         cmd = NamedCommand(name=name, value=variable.value)
         self._httpc.post_command(entity_id=entity.id,
                                  entity_type=entity.type,
@@ -316,7 +622,40 @@ class ContextBrokerCommunicator(BaseIoTACommunicator):
         )
 
     def terminate(self):
-        """Disconnect subscription ids"""
-        for sud_id in self.subscription_ids:
-            self._httpc.delete_subscription(subscription_id=sud_id)
+        """Send pending commands and disconnect subscription ids"""
+        if self._writer is not None:
+            self._writer.stop(drain=True)
+        # Keep persisted subscriptions for the next start
+        self._subscription_registry.stop(
+            delete=self.config.subscription_state_file is None
+        )
         super().terminate()
+
+
+def sync_entity_attributes(
+        entities: List[ContextEntity],
+        http_client: ContextBrokerClient,
+        chunk_size: int = 100,
+        max_workers: int = 1
+) -> Iterator[Tuple[str, str]]:
+    """
+    Add the attributes stored in the ContextBroker to the given entities.
+    The entities are requested in bulk using op/query.
+
+    Yields:
+        Tuple[str, str]: (id, type) of each entity, as soon as
+            its attributes are synced
+    """
+    entities_map = {(entity.id, entity.type): entity for entity in entities}
+    for chunk in iter_query_entities(
+            http_client=http_client,
+            entity_patterns=[EntityPattern(id=entity.id, type=entity.type) for entity in entities],
+            chunk_size=chunk_size,
+            max_workers=max_workers
+    ):
+        for cb_entity in chunk:
+            entity = entities_map.get((cb_entity.id, cb_entity.type))
+            if entity is None:
+                continue
+            entity.add_attributes(cb_entity.get_attributes(response_format="dict"))
+            yield cb_entity.id, cb_entity.type
@@ -1,8 +1,12 @@
+import json
 import logging
-from typing import List, Union, Optional
+import threading
+from functools import cached_property
+from typing import Any, Dict, List, Literal, Union, Optional
 from pathlib import Path
 
 from filip.clients.mqtt import IoTAMQTTClient
+from filip.models.mqtt import IoTAMQTTMessageType
 from filip.models.ngsi_v2.iot import \
     Device, \
     ServiceGroup, \
@@ -22,6 +26,7 @@ from agentlib.modules.communicator.mqtt import \
     AgentVariable
 
 from agentlib_fiware.modules.iota_mqtt.base import (
+    AliasRoutingTable,
     BaseIoTACommunicatorConfig,
     BaseIoTACommunicator
 )
@@ -45,6 +50,39 @@ class IoTAMQTTConfig(BaseIoTACommunicatorConfig):
     payload_protocol: PayloadProtocol = Field(
         default=PayloadProtocol.IOTA_JSON
     )
+    command_subscription: Literal["device", "wildcard"] = Field(
+        default="device",
+        title="Command subscription",
+        description="'device' subscribes to the command topic of each device. "
+                    "'wildcard' subscribes to '/{apikey}/+/cmd' once per apikey "
+                    "and routes the commands by their device_id, which starts "
+                    "much faster for many devices. Commands of devices which "
+                    "are not configured are ignored."
+    )
+    publish_mode: Literal["single", "batch"] = Field(
+        default="single",
+        title="Publish mode",
+        description="'single' publishes one message for each attribute change. "
+                    "'batch' merges the changes of each device and publishes "
+                    "them as one multi-attribute message every "
+                    "publish_batch_interval or as soon as publish_batch_max_size "
+                    "attributes of a device are buffered. "
+                    "Only the latest value of each attribute is sent."
+    )
+    publish_batch_interval: float = Field(
+        default=1,
+        gt=0,
+        title="Publish batch interval",
+        description="Interval in seconds in which buffered changes are published "
+                    "if publish_mode='batch'. This is the maximal delay of a change."
+    )
+    publish_batch_max_size: int = Field(
+        default=100,
+        gt=0,
+        title="Maximal publish batch size",
+        description="Number of buffered attributes of one device "
+                    "which triggers an immediate publish."
+    )
     service_groups: List[ServiceGroup] = Field(
         title="FIWARE IoT device groups",
         description="List of FIWARE IoT device group configurations"
@@ -151,20 +189,65 @@ class DeviceIoTAMQTTCommunicator(BaseIoTACommunicator):
     mqttc_type = IoTAMQTTClient
 
     def __init__(self, config: dict, agent: Agent):
+        # Required by _message_callback, which may already be called
+        # once the base class connected and started the network loop
+        self._devices: Dict[str, Device] = self._get_devices_by_id(config)
         super().__init__(config=config, agent=agent)
         # Register devices and service groups in the own mqtt client
         for group in self.config.service_groups:
             self._mqttc.add_service_group(group)
-        for device in self.config.devices:
-            self._mqttc.add_device(device)
+        if self.config.command_subscription == "device":
+            for device in self.config.devices:
+                self._mqttc.add_device(device)
+        # device_id -> object_id -> value
+        self._publish_batch: Dict[str, Dict[str, Any]] = {}
+        self._publish_batch_lock = threading.Lock()
+        if self.config.publish_mode == "batch":
+            self.env.process(self._publish_batch_process())
+
+    @staticmethod
+    def _get_devices_by_id(config: Union[IoTAMQTTConfig, dict, str]) -> Dict[str, Device]:
+        """Return the devices of the not yet validated config by their id"""
+        if isinstance(config, str):
+            config = json.loads(config)
+        if isinstance(config, IoTAMQTTConfig):
+            devices = config.devices
+        else:
+            devices = IoTAMQTTConfig.parse_device_list(config.get("devices", []))
+        return {
+            device.device_id: device
+            for device in (Device.model_validate(device) for device in devices)
+        }
+
+    def build_alias_table(self) -> AliasRoutingTable:
+        return AliasRoutingTable(
+            get_alias=lambda device_id, name: self.config.get_alias_for_attribute_name(
+                name=name, device_id=device_id
+            ),
+            keys=[
+                (device.device_id, attr.name)
+                for device in self.config.devices
+                for attr in device.attributes + device.commands
+            ]
+        )
 
     def get_all_topics(self):
-        subtopics = self.config.subtopics
-        for device in self.config.devices:
-            topic = f"{device.apikey}/{device.device_id}/cmd"
-            if topic not in subtopics:
-                subtopics.append(topic)
-        return subtopics
+        return self._all_topics
+
+    @cached_property
+    def _all_topics(self) -> List[str]:
+        """The subtopics and the command topics, without duplicates"""
+        if self.config.command_subscription == "wildcard":
+            command_topics = [
+                f"/{apikey}/+/cmd"
+                for apikey in dict.fromkeys(device.apikey for device in self.config.devices)
+            ]
+        else:
+            command_topics = [
+                f"/{device.apikey}/{device.device_id}/cmd"
+                for device in self.config.devices
+            ]
+        return list(dict.fromkeys(self.config.subtopics + command_topics))
 
     def register_callbacks(self):
         """
@@ -172,10 +255,7 @@ class DeviceIoTAMQTTCommunicator(BaseIoTACommunicator):
         """
         for device in self.config.devices:
             for attr in device.attributes:
-                alias = self.config.get_alias_for_attribute_name(
-                    name=attr.name,
-                    device_id=device.device_id
-                )
+                alias = self.alias_table.get_alias(device.device_id, attr.name)
                 self.agent.data_broker.register_callback(
                     source=None, alias=alias,
                     callback=self._fiware_callback,
@@ -197,11 +277,85 @@ class DeviceIoTAMQTTCommunicator(BaseIoTACommunicator):
         """
         Publish the given output to IoTA-Agent
         """
+        if self.config.publish_mode == "batch":
+            self._add_to_publish_batch(
+                device_id=device_id, object_id=attribute.object_id, value=variable.value
+            )
+            return
         self.logger.debug("Publishing attribute %s with value %s to mqtt.",
                           attribute.name, variable.value)
         payload = {attribute.object_id: variable.value}
-        self._mqttc.publish(device_id=device_id,
-                            payload=payload)
+        self._publish(device_id=device_id, payload=payload)
+
+    def _add_to_publish_batch(self, device_id: str, object_id: str, value: Any):
+        """
+        Buffer the value for the next publish of the device.
+        Newer values of the same attribute replace older ones.
+        """
+        with self._publish_batch_lock:
+            payload = self._publish_batch.setdefault(device_id, {})
+            payload[object_id] = value
+            batch_full = len(payload) >= self.config.publish_batch_max_size
+        if batch_full:
+            self.flush_publish_batch(device_id=device_id)
+
+    def flush_publish_batch(self, device_id: Optional[str] = None):
+        """
+        Publish the buffered changes of the given device, or of all
+        devices if None, with one message per device.
+        """
+        with self._publish_batch_lock:
+            if device_id is None:
+                batch, self._publish_batch = self._publish_batch, {}
+            elif device_id in self._publish_batch:
+                batch = {device_id: self._publish_batch.pop(device_id)}
+            else:
+                return
+        for _device_id, payload in batch.items():
+            self.logger.debug("Publishing %s attributes of device %s to mqtt.",
+                              len(payload), _device_id)
+            self._publish(device_id=_device_id, payload=payload)
+
+    def _publish(
+            self,
+            device_id: str,
+            payload: Dict[str, Any],
+            command_name: Optional[str] = None
+    ):
+        """
+        Publish the measurements of the device, or the acknowledgement
+        of the command if command_name is given.
+        """
+        if self.config.command_subscription == "device":
+            self._mqttc.publish(device_id=device_id,
+                                command_name=command_name,
+                                payload=payload)
+            return
+        # The devices are not registered in the mqtt client in this case
+        device = self._devices[device_id]
+        encoder = self._mqttc.get_encoder(device.protocol)
+        msg_type = IoTAMQTTMessageType.MULTI if command_name is None else IoTAMQTTMessageType.CMDEXE
+        self._mqttc.publish(
+            topic="/".join((
+                encoder.prefix,
+                device.apikey,
+                device_id,
+                "attrs" if command_name is None else "cmdexe"
+            )),
+            payload=encoder.encode_msg(device_id=device_id, payload=payload, msg_type=msg_type)
+        )
+
+    def _publish_batch_process(self):
+        """Publish the buffered changes every publish_batch_interval"""
+        while True:
+            yield self.env.timeout(self.config.publish_batch_interval)
+            self.flush_publish_batch()
+
+    def terminate(self):
+        """Publish the buffered changes before disconnecting"""
+        if self.config.publish_mode == "batch":
+            self.flush_publish_batch()
+        super().terminate()
 
     def _message_callback(self, client, userdata, msg):
         """
@@ -212,11 +366,11 @@ class DeviceIoTAMQTTCommunicator(BaseIoTACommunicator):
         """
         _, device_id, payload = self._mqttc.get_encoder(
             self.config.payload_protocol).decode_message(msg=msg)
+        if device_id not in self._devices:
+            self.logger.debug("Ignoring command for unknown device '%s'", device_id)
+            return
         cmd_name, value = payload.popitem()
-        alias = self.config.get_alias_for_attribute_name(
-            name=cmd_name,
-            device_id=device_id
-        )
+        alias = self.alias_table.get_alias(device_id, cmd_name)
         variable = AgentVariable(
             name=alias,
             value=value,
@@ -228,6 +382,6 @@ class DeviceIoTAMQTTCommunicator(BaseIoTACommunicator):
                           alias, value)
         self.agent.data_broker.send_variable(variable)
 
-        client.publish(device_id=device_id,
-                       command_name=cmd_name,
-                       payload={cmd_name: value})
+        self._publish(device_id=device_id,
+                      command_name=cmd_name,
+                      payload={cmd_name: value})
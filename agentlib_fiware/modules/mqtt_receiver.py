@@ -0,0 +1,74 @@
+"""
+Asynchronous processing of received MQTT messages, shared by all
+modules receiving messages from FIWARE via MQTT.
+"""
+from typing import Dict, Optional
+
+from pydantic import BaseModel, Field
+
+from agentlib_fiware.utils.workers import BackgroundWorker, OverflowPolicy
+
+
+class AsyncReceiveConfig(BaseModel):
+    """Config options of the AsyncReceiverMixin"""
+    async_receive: bool = Field(
+        default=False,
+        title="Receive messages asynchronously",
+        description="If True, received MQTT messages are put into a bounded queue "
+                    "and processed by a dispatcher thread. Thus, slow callbacks "
+                    "in the data_broker do not block the MQTT network loop."
+    )
+    receive_queue_size: int = Field(
+        default=1000,
+        gt=0,
+        title="Maximal number of pending messages for async_receive"
+    )
+    receive_batch_size: int = Field(
+        default=100,
+        gt=0,
+        title="Maximal number of messages the dispatcher takes from the queue at once"
+    )
+    receive_overflow_policy: OverflowPolicy = Field(
+        default=OverflowPolicy.BLOCK,
+        title="Overflow policy for async_receive",
+        description="'block' makes the MQTT network loop wait for a free slot, "
+                    "'drop_oldest' and 'coalesce' discard the oldest pending message."
+    )
+
+
+class AsyncReceiverMixin:
+    """
+    Processes the messages of the module's MQTT client in a
+    dispatcher thread if async_receive is set in the config,
+    see AsyncReceiveConfig.
+    Call _start_receiver once the MQTT client exists and
+    _stop_receiver after disconnecting.
+    """
+    _receiver: Optional[BackgroundWorker] = None
+
+    def _start_receiver(self):
+        """Route the received messages through the queue, if async_receive is set"""
+        if not self.config.async_receive:
+            return
+        self._receiver = BackgroundWorker(
+            name=f"{self.agent.id}/{self.id}_receiver",
+            max_queue_size=self.config.receive_queue_size,
+            overflow_policy=self.config.receive_overflow_policy,
+            max_batch_size=self.config.receive_batch_size
+        )
+        self._mqttc.on_message = self._enqueue_message
+
+    def _enqueue_message(self, client, userdata, msg):
+        """Queue the received message for the dispatcher thread"""
+        self._receiver.submit(self._message_callback, client, userdata, msg)
+
+    def get_receiver_metrics(self) -> Dict[str, float]:
+        """Return the queue metrics of the async receiver, if active."""
+        if self._receiver is None:
+            return {}
+        return self._receiver.get_metrics()
+
+    def _stop_receiver(self):
+        """Process the pending messages"""
+        if self._receiver is not None:
+            self._receiver.stop(drain=True)
@@ -1,5 +1,12 @@
+import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+import pandas as pd
 from pydantic import Field
-from agentlib import AgentVariable, BaseModule, BaseModuleConfig
+from agentlib import Agent, AgentVariable, BaseModule, BaseModuleConfig
+
+from agentlib_fiware.utils.timeseries_cache import TimeSeriesCache
 
 
 class BaseTimeSeriesAcquisitionConfig(BaseModuleConfig):
@@ -11,7 +18,98 @@ class BaseTimeSeriesAcquisitionConfig(BaseModuleConfig):
     interval: float = Field(
         default=86400 * 30
     )
+    time_period: Optional[float] = Field(
+        default=None,
+        description="Length of the extracted time window in seconds. "
+                    "If None, the interval is used."
+    )
+    incremental: bool = Field(
+        default=False,
+        description="If True, the current time window is kept in memory and "
+                    "only the data since the last extraction is requested. "
+                    "Samples older than the time window are removed."
+    )
+    cache_dir: Optional[Path] = Field(
+        default=None,
+        description="If given, the extracted data is cached in this directory "
+                    "and only ranges not cached yet are requested."
+    )
+    cache_max_size: Optional[int] = Field(
+        default=None,
+        description="Maximal size of the cache in bytes. The least recently "
+                    "used days are deleted if exceeded."
+    )
+    cache_settle_time: float = Field(
+        default=300,
+        description="Ranges newer than this time in seconds are requested "
+                    "again, as data may still arrive for them."
+    )
 
 
 class BaseTimeSeriesAcquisition(BaseModule):
     config_type = BaseTimeSeriesAcquisitionConfig
+
+    def __init__(self, config: dict, agent: Agent):
+        super().__init__(config=config, agent=agent)
+        self._window: Optional[pd.DataFrame] = None
+        self._window_to_date: Optional[datetime.datetime] = None
+        self._cache: Optional[TimeSeriesCache] = None
+        if self.config.cache_dir is not None:
+            self._cache = TimeSeriesCache(
+                cache_dir=self.config.cache_dir,
+                max_size=self.config.cache_max_size,
+                settle_time=self.config.cache_settle_time
+            )
+
+    @property
+    def time_period(self) -> float:
+        """Length of the extracted time window in seconds"""
+        if self.config.time_period is None:
+            return self.config.interval
+        return self.config.time_period
+
+    def get_window(
+            self,
+            to_date: datetime.datetime,
+            get_data: Callable[[float, datetime.datetime], pd.DataFrame]
+    ) -> pd.DataFrame:
+        """
+        Return the data of the time window ending at to_date.
+        get_data(interval, to_date) extracts the data of the given interval
+        in seconds until to_date. In incremental mode, only the data since the
+        last call is extracted and appended to the window kept in memory.
+        """
+        time_period = self.time_period
+        if (
+                not self.config.incremental or
+                self._window is None or
+                self._window.empty or
+                to_date <= self._window_to_date or
+                (to_date - self._window_to_date).total_seconds() >= time_period
+        ):
+            window = get_data(time_period, to_date)
+        else:
+            new_data = get_data((to_date - self._window_to_date).total_seconds(), to_date)
+            window = self._append_to_window(new_data, from_date=to_date - datetime.timedelta(
+                seconds=time_period))
+        if self.config.incremental:
+            self._window = window
+            self._window_to_date = to_date
+        return window
+
+    def _append_to_window(self, new_data: pd.DataFrame, from_date: datetime.datetime):
+        window = self._window
+        if not new_data.empty:
+            # Forward fill the new samples from the last known values only,
+            # instead of the whole window
+            new_data = pd.concat([window.iloc[-1:], new_data]).ffill().iloc[1:]
+            # Both dates are inclusive, so the last sample may be returned again
+            window = pd.concat([window[window.index < new_data.index[0]], new_data])
+            if not new_data.index.is_monotonic_increasing:
+                window = window.sort_index()
+            window = window[~window.index.duplicated(keep="last")]
+        from_date = pd.Timestamp(from_date)
+        if window.index.tz is not None and from_date.tz is None:
+            from_date = from_date.tz_localize(window.index.tz)
+        # Binary search on the sorted index to evict old samples
+        return window.iloc[window.index.searchsorted(from_date, side="left"):]
@@ -1,19 +1,23 @@
 import logging
 import datetime
-from typing import Union, Optional, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple, Union, Optional, List
 import math
 import requests
 
 from pydantic import Field, AnyUrl
 import pandas as pd
+from agentlib import Agent
 
 from filip.models.base import FiwareHeader
 from filip.utils.validators import AnyHttpUrl
 from filip.models.base import FiwareHeader
-from filip.clients.ngsi_v2.quantumleap import QuantumLeapClient
 
 
 from agentlib_fiware.modules.time_series.base import BaseTimeSeriesAcquisition, BaseTimeSeriesAcquisitionConfig
+from agentlib_fiware.utils import get_fiware_header_key, sessions
+from agentlib_fiware.utils.timeseries_cache import TimeSeriesCache, get_source_key
 
 
 
@@ -34,11 +38,22 @@ class QuantumLeapDataAcquisitionConfig(BaseTimeSeriesAcquisitionConfig):
         description="For development: Constant time until the data is to be extracted.",
         default=None
     )
+    max_workers: int = Field(
+        default=4,
+        gt=0,
+        description="Maximal number of concurrent requests to QuantumLeap"
+    )
 
 
 class QuantumLeapDataAcquisition(BaseTimeSeriesAcquisition):
     config: QuantumLeapDataAcquisitionConfig
 
+    def __init__(self, config: dict, agent: Agent):
+        super().__init__(config=config, agent=agent)
+        # Observed records per second of each entity/attribute,
+        # used to split the next extraction into time slices
+        self._sample_density: Dict[str, float] = {}
+
     def register_callbacks(self):
         pass
 
@@ -52,12 +67,18 @@ class QuantumLeapDataAcquisition(BaseTimeSeriesAcquisition):
                 to_date = self.config.constant_to_date
             else:
                 to_date = datetime.datetime.now()
-            tsd = get_data_from_ql(
-                interval=self.config.interval,
+            tsd = self.get_window(
                 to_date=to_date,
-                fiware_header=self.config.fiware_header,
-                entity_name_attributes=self.config.entity_name_attributes,
-                ql_url=self.config.ql_url
+                get_data=lambda interval, _to_date: get_data_from_ql(
+                    interval=interval,
+                    to_date=_to_date,
+                    fiware_header=self.config.fiware_header,
+                    entity_name_attributes=self.config.entity_name_attributes,
+                    ql_url=self.config.ql_url,
+                    max_workers=self.config.max_workers,
+                    sample_density=self._sample_density,
+                    cache=self._cache
+                )
             )
 
             tsd_json = tsd.to_json(orient="split")
@@ -69,13 +90,121 @@ class QuantumLeapDataAcquisition(BaseTimeSeriesAcquisition):
             yield self.env.timeout(self.config.interval)
 
 
+# Maximal number of records QuantumLeap returns per request
+MAX_RECORDS_PER_REQUEST = 10000
+
+
+class QLRequest(NamedTuple):
+    """Request of the values of one entity attribute in one time interval"""
+    entity_name_attr: str
+    from_date: datetime.datetime
+    to_date: datetime.datetime
+
+
+class QLResult(NamedTuple):
+    """
+    Result of a QLRequest with the number of records, the number of
+    pages needed to get them and the duration of all pages in seconds.
+    data is None if there are no records or if the request failed.
+    """
+    request: QLRequest
+    data: Optional[pd.DataFrame]
+    n_records: int
+    n_pages: int
+    duration: float
+    failed: bool = False
+
+
+def fetch_ql_requests(
+        ql_requests: List[QLRequest],
+        fiware_header: Union[FiwareHeader, dict],
+        ql_url: Union[AnyHttpUrl, str],
+        max_workers: int = 4,
+        page_size: int = MAX_RECORDS_PER_REQUEST
+) -> List[QLResult]:
+    """
+    Execute the requests concurrently with at most max_workers threads,
+    all using one pooled QuantumLeapClient.
+    Each request is paginated with limit/offset, page_size records at
+    a time, until all records of its interval are retrieved.
+    The results are returned in the order of the requests. Failed
+    requests are logged and have no data.
+    """
+    ql_client = sessions.get_quantumleap_client(url=ql_url, fiware_header=fiware_header)
+
+    def _fetch(ql_request: QLRequest) -> QLResult:
+        entity_name, attr_name = ql_request.entity_name_attr.split("/")
+        time_start = time.perf_counter()
+        pages = []
+        n_records = 0
+        failed = False
+        while True:
+            try:
+                entity_tsd = ql_client.get_entity_attr_values_by_id(
+                    entity_id=entity_name,
+                    attr_name=attr_name,
+                    from_date=str(ql_request.from_date),
+                    to_date=str(ql_request.to_date),
+                    limit=page_size,
+                    offset=n_records
+                )
+            except requests.exceptions.RequestException as err:
+                response = getattr(err, "response", None)
+                if response is not None and response.status_code == 404:
+                    # QuantumLeap answers 404 if there are no (more) records
+                    break
+                logger.error("Could not retrieve data for entity/attr='%s' in interval %s-%s",
+                             ql_request.entity_name_attr, ql_request.from_date, ql_request.to_date)
+                pages = []
+                failed = True
+                break
+            page = entity_tsd.to_pandas()
+            pages.append(page.rename(columns={entity_name: ql_request.entity_name_attr}))
+            n_records += len(page.index)
+            if len(page.index) < page_size:
+                break
+        duration = time.perf_counter() - time_start
+        logger.debug("Request for entity/attr='%s' in interval %s-%s returned %s records "
+                     "in %s pages and took %.3f seconds",
+                     ql_request.entity_name_attr, ql_request.from_date,
+                     ql_request.to_date, n_records, len(pages), duration)
+        if not pages:
+            return QLResult(request=ql_request, data=None, n_records=0,
+                            n_pages=0, duration=duration, failed=failed)
+        return QLResult(
+            request=ql_request,
+            data=pages[0] if len(pages) == 1 else pd.concat(pages),
+            n_records=n_records,
+            n_pages=len(pages),
+            duration=duration
+        )
+
+    time_start = time.perf_counter()
+    if max_workers <= 1 or len(ql_requests) <= 1:
+        results = [_fetch(ql_request) for ql_request in ql_requests]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(ql_requests))) as executor:
+            results = list(executor.map(_fetch, ql_requests))
+    if results:
+        logger.info("Executed %s QuantumLeap requests with %s pages in %.3f seconds "
+                    "(mean %.3f, max %.3f seconds per request)",
+                    len(results), sum(result.n_pages for result in results),
+                    time.perf_counter() - time_start,
+                    sum(result.duration for result in results) / len(results),
+                    max(result.duration for result in results))
+    return results
+
+
 def get_data_from_ql(
         entity_name_attributes: list,
         interval: float,
         to_date: datetime.datetime,
         fiware_header: Union[FiwareHeader, dict],
         ql_url: Union[AnyHttpUrl, str],
-        chunk_size: int = 10000
+        chunk_size: int = MAX_RECORDS_PER_REQUEST,
+        max_workers: int = 4,
+        sample_density: Optional[Dict[str, float]] = None,
+        cache: Optional[TimeSeriesCache] = None
 ):
     """
     Gets data (sim and meas) from the CrateDB. First checks if the all the needed
@@ -94,74 +223,101 @@ def get_data_from_ql(
     :param (AnyHttpUrl, str) ql_url:
         The URL to QuantumLeap
     :param int chunk_size:
-        Chunk size to extract the data with. Maximum and default is 10000.
+        Number of records to extract per request. Maximum and default is 10000.
+    :param int max_workers:
+        Maximal number of concurrent requests to QuantumLeap.
+    :param dict sample_density:
+        Observed records per second of each entity/attribute. If given, the
+        interval of dense attributes is split into time slices of about
+        chunk_size records, which are requested concurrently. The dict is
+        updated with the density observed in this extraction.
+    :param TimeSeriesCache cache:
+        If given, only the ranges not cached yet are requested and
+        the data is returned from the cache.
 
     :return:
     """
-    _max_chunk_size = 10000
-    if chunk_size > _max_chunk_size:
+    if chunk_size > MAX_RECORDS_PER_REQUEST:
         logger.error("Maximal allowed chunk size is %s. Using the maximum.",
-                     _max_chunk_size)
-        chunk_size = _max_chunk_size
-
-    # calculate number of necessary loops (Fiware can just extract 10.000 data at a time)
-    loops = interval / chunk_size
-    loops = math.ceil(loops)
+                     MAX_RECORDS_PER_REQUEST)
+        chunk_size = MAX_RECORDS_PER_REQUEST
 
     from_date = to_date - datetime.timedelta(seconds=interval)
 
-    tsd_data = None
+    source_key = None if cache is None else get_source_key(
+        "quantumleap", ql_url, *get_fiware_header_key(fiware_header)
+    )
 
-    for j in range(loops):
-        j += 1
-        if j == loops:
-            _interval_to_get = interval % chunk_size
+    # Create the entity/attribute x time-slice requests for all ranges
+    # not cached yet. Slices which turn out to hold more than chunk_size
+    # records are paginated.
+    ql_requests = []
+    for entity_name_attr in entity_name_attributes:
+        if cache is None:
+            ranges = [(from_date, to_date)]
         else:
-            _interval_to_get = chunk_size
-        to_date = from_date + datetime.timedelta(seconds=_interval_to_get)
-
-        i = 0
-        logger.debug("Extracting data from %s to %s", from_date, to_date)
-        # extract measured and simulated data
-        tsd_data_short = None
-
-        for entity_name_attr in entity_name_attributes:
-            entity_name, attr_name = entity_name_attr.split("/")
-            with QuantumLeapClient(url=ql_url,
-                                   fiware_header=fiware_header) as ql_client:
-                try:
-                    entity_tsd = ql_client.get_entity_attr_values_by_id(
-                            entity_id=entity_name,
-                            attr_name=attr_name,
-                            from_date=str(from_date),
-                            to_date=str(to_date)
-                        )
-                    i += 1
-                    entity_tsd_df = entity_tsd.to_pandas()
-                    entity_tsd_df = entity_tsd_df.rename(columns={entity_name: entity_name_attr})
-                    if i == 1:
-                        tsd_data_short = entity_tsd_df
-                    else:
-                        tsd_data_short = tsd_data_short.join(entity_tsd_df, how="outer")
-                except requests.exceptions.HTTPError:
-                    logger.error("Could not retrieve data for entity/attr='%s' in interval %s-%s",
-                                 entity_name_attr, from_date, to_date)
-
-        if tsd_data_short is not None:
-            if tsd_data is None:
-                tsd_data = tsd_data_short
-            else:
-                tsd_data = tsd_data.append(tsd_data_short)
-
-        from_date = to_date
+            ranges = cache.get_missing_ranges(source_key, entity_name_attr, from_date, to_date)
+        density = (sample_density or {}).get(entity_name_attr, 0)
+        for range_from_date, range_to_date in ranges:
+            range_interval = (range_to_date - range_from_date).total_seconds()
+            # Aim below chunk_size, to mostly need one page per slice
+            n_slices = max(1, math.ceil(density * range_interval / (0.8 * chunk_size)))
+            slice_duration = (range_to_date - range_from_date) / n_slices
+            for idx in range(n_slices):
+                ql_requests.append(QLRequest(
+                    entity_name_attr=entity_name_attr,
+                    from_date=range_from_date + idx * slice_duration,
+                    to_date=range_to_date if idx == n_slices - 1 else
+                    range_from_date + (idx + 1) * slice_duration
+                ))
+
+    results = fetch_ql_requests(
+        ql_requests=ql_requests,
+        fiware_header=fiware_header,
+        ql_url=ql_url,
+        max_workers=max_workers,
+        page_size=chunk_size
+    )
 
-    if tsd_data is None:
+    attrs_data = []
+    for entity_name_attr in entity_name_attributes:
+        attr_results = [
+            result for result in results
+            if result.request.entity_name_attr == entity_name_attr and not result.failed
+        ]
+        requested_interval = sum(
+            (result.request.to_date - result.request.from_date).total_seconds()
+            for result in attr_results
+        )
+        if sample_density is not None and requested_interval > 0:
+            sample_density[entity_name_attr] = sum(
+                result.n_records for result in attr_results
+            ) / requested_interval
+        attr_data = [result.data for result in attr_results if result.data is not None]
+        if attr_data:
+            attr_data = pd.concat(attr_data) if len(attr_data) > 1 else attr_data[0]
+            # Adjacent slices share their boundary, as both dates are inclusive
+            attr_data = attr_data[~attr_data.index.duplicated(keep="first")]
+            # removing multi-column
+            attr_data = attr_data.droplevel(2, axis=1).droplevel(1, axis=1)
+        else:
+            attr_data = None
+        if cache is not None:
+            # Failed requests are not marked as cached, but empty ones are
+            cache.store(source_key, entity_name_attr, data=attr_data, ranges=[
+                (result.request.from_date, result.request.to_date)
+                for result in attr_results
+            ])
+            attr_data = cache.load(source_key, entity_name_attr, from_date, to_date)
+        if attr_data is not None and not attr_data.empty:
+            attrs_data.append(attr_data)
+
+    if not attrs_data:
         # No data found
         return pd.DataFrame({})
 
-    # removing multi-column
-    tsd_data = tsd_data.droplevel(2, axis=1).droplevel(1, axis=1)
-    tsd_data = tsd_data.fillna(method="ffill")
+    # Align all attributes at once on the union of their sorted time indices
+    tsd_data = pd.concat(attrs_data, axis=1, join="outer", sort=True).ffill()
 
     tsd_data.index.name = None
     return tsd_data
@@ -1,22 +1,36 @@
 import json
-from datetime import datetime
 from pathlib import Path
-from typing import Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
+from filip.models.base import FiwareHeader
 from filip.models.ngsi_v2.base import NamedMetadata
 from filip.models.ngsi_v2.context import ContextAttribute
 from pydantic import TypeAdapter
 
 from agentlib import Environment
 
+from agentlib_fiware.utils.timestamps import time_instant_to_unix, time_instants_to_unix, \
+    unix_to_time_instant
+
 
 def extract_time_from_attribute(attribute: ContextAttribute, env: Environment, time_format: str):
+    time_instant = attribute.metadata.get("TimeInstant")
+    return extract_time_from_time_instant(
+        time_instant=None if time_instant is None else time_instant.value,
+        env=env,
+        time_format=time_format
+    )
+
+
+def extract_time_from_time_instant(time_instant: Optional[str], env: Environment, time_format: str):
+    """
+    Same as extract_time_from_attribute, but for the raw value of
+    the TimeInstant metadata, which may be None if not present.
+    """
     # Extract time information:
-    if env.config.rt and env.config.factor == 1 and "TimeInstant" in attribute.metadata:
-        time_unix = (datetime.strptime(
-            attribute.metadata['TimeInstant'].value,
-            time_format
-        ) - datetime(1970, 1, 1)).total_seconds()
+    if env.config.rt and env.config.factor == 1 and time_instant is not None:
+        time_unix = time_instant_to_unix(time_instant, time_format)
     else:
         # This case means we simulate faster than real time.
         # In this case, using the time from FIWARE makes no sense
@@ -26,16 +40,53 @@ def extract_time_from_attribute(attribute: ContextAttribute, env: Environment, t
     return time_unix
 
 
+def extract_times_from_time_instants(
+        time_instants: Sequence[Optional[str]],
+        env: Environment,
+        time_format: str
+) -> List[float]:
+    """
+    Same as extract_time_from_time_instant, but converts a
+    whole batch of raw TimeInstant values at once.
+    """
+    if not (env.config.rt and env.config.factor == 1):
+        return [env.time] * len(time_instants)
+    return [
+        env.time if np.isnan(time_unix) else float(time_unix)
+        for time_unix in time_instants_to_unix(time_instants, time_format)
+    ]
+
+
 def update_attribute_time_instant(attribute: ContextAttribute, timestamp: float, time_format: str):
-    if "TimeInstant" in attribute.metadata:
+    time_instant = attribute.metadata.get("TimeInstant")
+    if time_instant is None:
+        return attribute
+    value = unix_to_time_instant(timestamp, time_format)
+    if isinstance(time_instant, dict):
         attribute.metadata["TimeInstant"] = NamedMetadata(
             name="TimeInstant",
             type="DateTime",
-            value=datetime.fromtimestamp(timestamp).strftime(time_format)
+            value=value
         )
+    else:
+        # Update in place instead of validating new metadata
+        time_instant.type = "DateTime"
+        time_instant.value = value
     return attribute
 
 
 def parse_file_as(type_: type, filepath: Union[Path, str]):
     with open(filepath, "r") as file:
         return TypeAdapter(type_).validate_json(json.load(file))
+
+
+def get_fiware_header_key(fiware_header: Union[FiwareHeader, Dict, None]) -> Tuple[str, str]:
+    """
+    Return a hashable (service, service_path) tuple for the given
+    fiware_header. Used to key process-wide objects per tenant.
+    """
+    if fiware_header is None:
+        fiware_header = FiwareHeader()
+    elif isinstance(fiware_header, dict):
+        fiware_header = FiwareHeader(**fiware_header)
+    return fiware_header.service, fiware_header.service_path
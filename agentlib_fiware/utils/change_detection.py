@@ -0,0 +1,44 @@
+"""
+Detection of unchanged values in polled data, to avoid
+sending unchanged values into the data_broker.
+"""
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class ChangeDetector:
+    """
+    Remembers the last forwarded value and modification marker
+    (e.g. dateModified or TimeInstant) for each key.
+
+    Args:
+        heartbeat_cycles int: If given, a value is forwarded at least
+            every heartbeat_cycles cycles, even if it did not change.
+    """
+
+    def __init__(self, heartbeat_cycles: Optional[int] = None):
+        self.heartbeat_cycles = heartbeat_cycles
+        self._cycle = 0
+        # key -> (value, marker, cycle of the last forwarding)
+        self._last_seen: Dict[Hashable, Tuple[Any, Any, int]] = {}
+
+    def next_cycle(self):
+        """Call once at the start of each polling cycle."""
+        self._cycle += 1
+
+    def should_forward(self, key: Hashable, value: Any, marker: Any = None) -> bool:
+        """
+        Return True if the value or marker changed since the last
+        forwarding of the key, or if a heartbeat is due.
+        The value is then remembered as forwarded.
+        """
+        last_seen = self._last_seen.get(key)
+        if last_seen is not None:
+            last_value, last_marker, last_cycle = last_seen
+            heartbeat_due = (
+                self.heartbeat_cycles is not None and
+                self._cycle - last_cycle >= self.heartbeat_cycles
+            )
+            if last_value == value and last_marker == marker and not heartbeat_due:
+                return False
+        self._last_seen[key] = (value, marker, self._cycle)
+        return True
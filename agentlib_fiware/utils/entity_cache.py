@@ -0,0 +1,71 @@
+"""
+Cache for the entity types and attribute shapes of the context broker.
+"""
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+from filip.models.base import FiwareHeader
+from filip.models.ngsi_v2.context import ContextEntity, NamedContextAttribute
+
+from agentlib_fiware.utils import get_fiware_header_key
+
+
+class EntitySchemaCache:
+    """
+    Stores the type of each entity and the type and metadata of its
+    attributes, so that attribute updates do not need to fetch the
+    entity from the context broker first.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entity_types: Dict[str, str] = {}
+        self._attributes: Dict[Tuple[str, str], NamedContextAttribute] = {}
+
+    def add_entity(self, entity: ContextEntity):
+        """Store the schema of the given entity, overwriting old entries."""
+        with self._lock:
+            self._entity_types[entity.id] = entity.type
+            for attr in entity.get_attributes():
+                self._attributes[(entity.id, attr.name)] = attr
+
+    def get_attribute(
+            self,
+            entity_id: str,
+            attr_name: str
+    ) -> Optional[Tuple[str, NamedContextAttribute]]:
+        """
+        Return the entity type and a copy of the cached attribute,
+        or None if the combination is unknown.
+        """
+        with self._lock:
+            attr = self._attributes.get((entity_id, attr_name))
+            if attr is None:
+                return None
+            return self._entity_types[entity_id], attr.model_copy(deep=True)
+
+    def invalidate(self, entity_id: str):
+        """Remove the entity and all its attributes from the cache."""
+        with self._lock:
+            self._entity_types.pop(entity_id, None)
+            for key in [key for key in self._attributes if key[0] == entity_id]:
+                del self._attributes[key]
+
+
+_CACHES: Dict[Tuple[str, str, str], EntitySchemaCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_entity_schema_cache(
+        cb_url: str,
+        fiware_header: Union[FiwareHeader, Dict, None]
+) -> EntitySchemaCache:
+    """
+    Return the process-wide cache for the given context broker and tenant.
+    Config validators and modules use this to share fetched schemas.
+    """
+    key = (str(cb_url), *get_fiware_header_key(fiware_header))
+    with _CACHES_LOCK:
+        if key not in _CACHES:
+            _CACHES[key] = EntitySchemaCache()
+        return _CACHES[key]
@@ -131,8 +131,6 @@ class HttpsClient:
         :param config:
         :return:
         """
-        data_frame_sorted = pd.DataFrame()
-
         if config['params']['all_topics']:
             topic_list = df['topic'].unique()
         else:
@@ -142,19 +140,17 @@ class HttpsClient:
         df["_time"] = pd.to_datetime(df["_time"], utc=True).dt.tz_convert(self.timezone)
         df.set_index("_time", inplace=True)
 
-        grouped = df.groupby(["topic"], as_index=False)
+        grouped = df.groupby("topic")
 
+        topic_series = []
         for topic in topic_list:
-            temp_df = grouped.get_group(topic)['value'].to_frame()
-            temp_df.rename(columns={'value': topic}, inplace=True)
-            dti = temp_df.index.round(freq="100ms")
-            temp_df.set_axis(dti, axis=0)
-            if topic == topic_list[0]:
-                data_frame_sorted = temp_df
-            else:
-                data_frame_sorted = data_frame_sorted.join(temp_df, how='outer')
+            topic_values = grouped.get_group(topic)['value'].rename(topic)
+            topic_series.append(topic_values[~topic_values.index.duplicated(keep="first")])
 
-        return data_frame_sorted
+        if not topic_series:
+            return pd.DataFrame()
+        # Align all topics at once on the union of their sorted time indices
+        return pd.concat(topic_series, axis=1, join="outer", sort=True)
 
     def convert_datetime_str_format(self, time):
         time_str = pytz.timezone(self.timezone).localize(datetime.datetime.strptime(time, '%Y-%m-%d %H:%M:%S'))
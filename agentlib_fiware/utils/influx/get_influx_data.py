@@ -3,11 +3,14 @@ import numpy as np
 import pandas as pd
 import logging
 import datetime
+import pytz
 from ebcpy import TimeSeriesData
-from typing import Union
+from typing import Optional
 from filip.models.base import FiwareHeader
 
+from agentlib_fiware.utils import get_fiware_header_key
 from agentlib_fiware.utils.influx.client import HttpsClient
+from agentlib_fiware.utils.timeseries_cache import TimeSeriesCache, get_source_key
 
 logger = logging.getLogger(__name__)
 
@@ -21,20 +24,17 @@ def get_data_from_influx(
         organization: str,
         bucket: str,
         influx_url: str,
+        cache: Optional[TimeSeriesCache] = None
 ):
 
+    timezone = 'CET'
     client = HttpsClient(org=organization,
                          token=token,
                          url=influx_url,
-                         timezone='CET')
-
-    date_format = '%Y-%m-%d %H:%M:%S'
+                         timezone=timezone)
 
     from_date = to_date - datetime.timedelta(seconds=interval)
 
-    from_date_str = datetime.datetime.strftime(from_date, date_format)
-    to_date_str = datetime.datetime.strftime(to_date, date_format)
-
     topics = list()
     for entity_name_attribute in entity_name_attributes:
         split_entity = entity_name_attribute.split("/")
@@ -52,12 +52,69 @@ def get_data_from_influx(
                            },
                 "topics": topics
             }
-    try:
-        ts_data = client.get_timeseries(config=config, start_time=from_date_str, end_time=to_date_str)
-    except Exception as err:
-        print(f"Could not get data: {err}")
-        return pd.DataFrame()
+
+    if cache is None:
+        ts_data = _get_timeseries(client=client, config=config, from_date=from_date, to_date=to_date)
+        if ts_data is None:
+            return pd.DataFrame()
+    else:
+        # The dates are interpreted in the timezone of the client
+        tz_info = pytz.timezone(timezone)
+        if from_date.tzinfo is None:
+            from_date = tz_info.localize(from_date)
+        if to_date.tzinfo is None:
+            to_date = tz_info.localize(to_date)
+        source_key = get_source_key("influx", influx_url, organization, bucket,
+                                    *get_fiware_header_key(fiware_header))
+        # Each attribute is cached separately, while all attributes
+        # missing the same range are queried at once
+        topics_by_range = {}
+        for entity_name_attribute, topic in zip(entity_name_attributes, topics):
+            for missing_range in cache.get_missing_ranges(
+                    source_key, entity_name_attribute, from_date, to_date):
+                topics_by_range.setdefault(missing_range, []).append((entity_name_attribute, topic))
+        for (range_from_date, range_to_date), range_topics in topics_by_range.items():
+            range_data = _get_timeseries(
+                client=client,
+                config={**config, "topics": [topic for _, topic in range_topics]},
+                from_date=range_from_date.astimezone(tz_info),
+                to_date=range_to_date.astimezone(tz_info)
+            )
+            if range_data is None:
+                continue
+            for entity_name_attribute, topic in range_topics:
+                # Column name created by HttpsClient.transform_dataframe_fiware
+                column = "/".join(topic)
+                cache.store(
+                    source_key, entity_name_attribute,
+                    data=range_data[[column]] if column in range_data.columns else None,
+                    ranges=[(range_from_date, range_to_date)]
+                )
+        attrs_data = [
+            cache.load(source_key, entity_name_attribute, from_date, to_date)
+            for entity_name_attribute in entity_name_attributes
+        ]
+        attrs_data = [attr_data for attr_data in attrs_data if not attr_data.empty]
+        if not attrs_data:
+            return pd.DataFrame()
+        ts_data = pd.concat(attrs_data, axis=1, join="outer", sort=True)
 
     ts_data = ts_data.dropna()
     ts_data = ts_data.astype(np.float64)
     return TimeSeriesData(ts_data)
+
+
+def _get_timeseries(
+        client: HttpsClient,
+        config: dict,
+        from_date: datetime.datetime,
+        to_date: datetime.datetime
+) -> Optional[pd.DataFrame]:
+    date_format = '%Y-%m-%d %H:%M:%S'
+    from_date_str = datetime.datetime.strftime(from_date, date_format)
+    to_date_str = datetime.datetime.strftime(to_date, date_format)
+    try:
+        return client.get_timeseries(config=config, start_time=from_date_str, end_time=to_date_str)
+    except Exception as err:  # pylint: disable=broad-except
+        logger.error("Could not get data for %s-%s: %s", from_date_str, to_date_str, err)
+        return None
@@ -0,0 +1,88 @@
+"""
+Lightweight decoding of NGSI-v2 notifications. Instead of building
+the full filip models, the raw payload is parsed into plain dicts.
+If installed, the faster orjson parser is used.
+"""
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+def decode_notification(payload: Union[bytes, str]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """
+    Parse a notification payload.
+
+    Returns:
+        str: The subscriptionId, or None if missing
+        list: The notified entities as raw dicts
+    """
+    message = _loads(payload)
+    return message.get("subscriptionId"), message.get("data", [])
+
+
+def get_attribute_value_and_time_instant(
+        attribute: Any,
+        key_values: bool = False
+) -> Tuple[Any, Optional[str]]:
+    """
+    Return the value and the raw TimeInstant metadata value
+    (None if not present) of a raw normalized attribute.
+    If key_values is True, the attribute is the value of a keyValues
+    notification, which has no metadata.
+    """
+    if key_values:
+        return attribute, None
+    time_instant = attribute.get("metadata", {}).get("TimeInstant")
+    if time_instant is not None:
+        time_instant = time_instant.get("value")
+    return attribute.get("value"), time_instant
+
+
+def get_command_attribute_names(attributes: Dict[str, Any]) -> Set[str]:
+    """
+    Return the names of the commands and their status and info attributes
+    in the raw normalized attributes of an entity. As in filip's
+    ContextEntity.get_commands, a command is only detected if the
+    <name>_status (commandStatus) and <name>_info (commandResult)
+    attributes are present as well.
+    """
+    names = set()
+    for status_name, status in attributes.items():
+        if (
+                not isinstance(status, dict) or
+                status.get("type") != "commandStatus" or
+                not status_name.endswith("_status")
+        ):
+            continue
+        command_name = status_name[:-len("_status")]
+        info = attributes.get(f"{command_name}_info")
+        if (
+                isinstance(info, dict) and
+                info.get("type") == "commandResult" and
+                command_name in attributes
+        ):
+            names.update((command_name, status_name, f"{command_name}_info"))
+    return names
+
+
+def get_property_names(attributes: Dict[str, Any]) -> List[str]:
+    """
+    Return the names of the properties in the raw normalized attributes
+    of an entity, as filip's ContextEntity.get_properties: All attributes
+    except relationships and detected commands, see
+    get_command_attribute_names.
+    """
+    command_names = get_command_attribute_names(attributes)
+    return [
+        name for name, attr in attributes.items()
+        if name not in ("id", "type") and
+        name not in command_names and
+        isinstance(attr, dict) and
+        attr.get("type") != "Relationship"
+    ]
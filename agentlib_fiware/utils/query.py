@@ -0,0 +1,109 @@
+"""
+Bulk retrieval of entities from the context broker via NGSI-v2 op/query.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional
+
+import requests
+
+from filip.clients.ngsi_v2 import ContextBrokerClient
+from filip.models.ngsi_v2.base import EntityPattern
+from filip.models.ngsi_v2.context import ContextEntity, Query
+
+logger = logging.getLogger(__name__)
+
+
+def _chunks(items: list, chunk_size: int) -> Iterator[list]:
+    for idx in range(0, len(items), chunk_size):
+        yield items[idx:idx + chunk_size]
+
+
+def iter_query_entities(
+        http_client: ContextBrokerClient,
+        entity_ids: List[str] = None,
+        entity_patterns: List[EntityPattern] = None,
+        attrs: Optional[List[str]] = None,
+        metadata: Optional[List[str]] = None,
+        chunk_size: int = 100,
+        max_workers: int = 1,
+        on_error: Callable[[requests.exceptions.RequestException, List[EntityPattern]], None] = None
+) -> Iterator[List[ContextEntity]]:
+    """
+    Get all entities matching the given ids or patterns.
+    The entities are split into chunks of chunk_size, each requested
+    with one op/query. Large results are paginated by the client.
+    The result of each chunk is yielded as soon as it is available,
+    in the order of the chunks.
+
+    Args:
+        http_client ContextBrokerClient: Client used for the requests
+        entity_ids list: Ids of the entities to get
+        entity_patterns list: EntityPatterns to get, e.g. using idPattern or type
+        attrs list: If given, only these attributes are included in the response
+        metadata list: If given, only these metadata are included in the response,
+            e.g. ["*", "dateModified"] to add the modification date
+        chunk_size int: Maximal number of ids/patterns per op/query request
+        max_workers int: Maximal number of concurrent requests
+        on_error callable: If given, a failed request of a chunk is passed to
+            on_error(error, chunk) and the chunk is skipped instead of
+            aborting all other chunks.
+
+    Yields:
+        List[ContextEntity]: The matching entities of one chunk.
+            Missing entities are not included.
+    """
+    patterns = list(entity_patterns or [])
+    patterns.extend(EntityPattern(id=entity_id) for entity_id in entity_ids or [])
+    if not patterns:
+        return
+
+    def _query(chunk: List[EntityPattern]) -> List[ContextEntity]:
+        try:
+            return http_client.query(query=Query(
+                entities=chunk, attrs=attrs or None, metadata=metadata or None
+            ))
+        except requests.exceptions.RequestException as err:
+            if on_error is None:
+                raise
+            on_error(err, chunk)
+            return []
+
+    chunks = list(_chunks(patterns, chunk_size))
+    logger.debug("Querying %s entity patterns in %s chunks", len(patterns), len(chunks))
+    if max_workers <= 1 or len(chunks) == 1:
+        for chunk in chunks:
+            yield _query(chunk)
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        yield from executor.map(_query, chunks)
+
+
+def query_entities(
+        http_client: ContextBrokerClient,
+        entity_ids: List[str] = None,
+        entity_patterns: List[EntityPattern] = None,
+        attrs: Optional[List[str]] = None,
+        metadata: Optional[List[str]] = None,
+        chunk_size: int = 100,
+        max_workers: int = 1,
+        on_error: Callable[[requests.exceptions.RequestException, List[EntityPattern]], None] = None
+) -> List[ContextEntity]:
+    """
+    Get all entities matching the given ids or patterns as one list.
+    See iter_query_entities for the arguments.
+    """
+    return [
+        entity
+        for chunk in iter_query_entities(
+            http_client=http_client,
+            entity_ids=entity_ids,
+            entity_patterns=entity_patterns,
+            attrs=attrs,
+            metadata=metadata,
+            chunk_size=chunk_size,
+            max_workers=max_workers,
+            on_error=on_error
+        )
+        for entity in chunk
+    ]
@@ -0,0 +1,112 @@
+"""
+Process-wide pool of HTTP sessions and clients shared by all
+FIWARE modules and config validators, so that connections
+(TCP/TLS setup) are reused instead of being opened per request.
+"""
+import threading
+from typing import Dict, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from filip.clients.ngsi_v2 import ContextBrokerClient
+from filip.clients.ngsi_v2.quantumleap import QuantumLeapClient
+from filip.models.base import FiwareHeader
+
+from agentlib_fiware.utils import get_fiware_header_key
+
+_LOCK = threading.Lock()
+_SESSIONS: Dict[Tuple[str, str, str], requests.Session] = {}
+_CLIENTS: Dict[Tuple[type, str, str, str], object] = {}
+_POOL_SETTINGS = {
+    "pool_connections": 10,
+    "pool_maxsize": 10,
+}
+
+
+def configure_session_pool(pool_connections: int = None, pool_maxsize: int = None):
+    """
+    Configure the connection pools of sessions created afterwards.
+
+    Args:
+        pool_connections int: Number of hosts to keep connection pools for
+        pool_maxsize int: Maximal number of connections kept per host.
+            Should be at least the number of threads sending
+            requests to the same host.
+    """
+    with _LOCK:
+        if pool_connections is not None:
+            _POOL_SETTINGS["pool_connections"] = pool_connections
+        if pool_maxsize is not None:
+            _POOL_SETTINGS["pool_maxsize"] = pool_maxsize
+
+
+def _get_key(url: str, fiware_header: Union[FiwareHeader, Dict, None]) -> Tuple[str, str, str]:
+    parts = urlsplit(str(url))
+    return (f"{parts.scheme}://{parts.netloc}", *get_fiware_header_key(fiware_header))
+
+
+def get_session(
+        url: str,
+        fiware_header: Union[FiwareHeader, Dict, None] = None
+) -> requests.Session:
+    """
+    Return the shared keep-alive session for the given host and fiware_header.
+    The fiware_header is part of the key, as the clients store it in
+    the session headers.
+    """
+    key = _get_key(url=url, fiware_header=fiware_header)
+    with _LOCK:
+        if key not in _SESSIONS:
+            session = requests.Session()
+            adapter = HTTPAdapter(**_POOL_SETTINGS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _SESSIONS[key] = session
+        return _SESSIONS[key]
+
+
+def _get_client(client_type: type, url: str, fiware_header: Union[FiwareHeader, Dict, None]):
+    key = (client_type, str(url), *get_fiware_header_key(fiware_header))
+    with _LOCK:
+        client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+    client = client_type(
+        url=str(url),
+        fiware_header=fiware_header,
+        session=get_session(url=url, fiware_header=fiware_header)
+    )
+    with _LOCK:
+        return _CLIENTS.setdefault(key, client)
+
+
+def get_context_broker_client(
+        url: str,
+        fiware_header: Union[FiwareHeader, Dict, None] = None
+) -> ContextBrokerClient:
+    """
+    Return the shared ContextBrokerClient for the given url and fiware_header.
+    Leaving a `with` block of the client does not close the pooled session.
+    """
+    return _get_client(client_type=ContextBrokerClient, url=url, fiware_header=fiware_header)
+
+
+def get_quantumleap_client(
+        url: str,
+        fiware_header: Union[FiwareHeader, Dict, None] = None
+) -> QuantumLeapClient:
+    """
+    Return the shared QuantumLeapClient for the given url and fiware_header.
+    Leaving a `with` block of the client does not close the pooled session.
+    """
+    return _get_client(client_type=QuantumLeapClient, url=url, fiware_header=fiware_header)
+
+
+def close_sessions():
+    """Close all pooled sessions, e.g. at the end of a process."""
+    with _LOCK:
+        for session in _SESSIONS.values():
+            session.close()
+        _SESSIONS.clear()
+        _CLIENTS.clear()
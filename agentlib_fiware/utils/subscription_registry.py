@@ -0,0 +1,240 @@
+"""
+Registry of the subscriptions of a module, to reuse them across restarts
+and to keep the ContextBroker free of orphaned subscriptions.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import requests
+from filip.clients.ngsi_v2 import ContextBrokerClient
+from filip.models.ngsi_v2.base import Status
+from filip.models.ngsi_v2.subscriptions import Subscription
+
+from agentlib_fiware.utils import get_fiware_header_key
+
+logger = logging.getLogger(__name__)
+
+_STATE_FILE_LOCK = threading.Lock()
+
+
+class SubscriptionRegistry:
+    """
+    Creates the subscriptions of one module and optionally:
+    - stores their ids in a local state file, keyed by the module key
+      and a hash of the subscriptions. On restart, the stored subscriptions
+      are reused if the hash matches and they still exist.
+    - uses `expires` leases, which are renewed in a background thread.
+      Subscriptions of crashed modules thus expire on their own. As the
+      ContextBroker keeps expired subscriptions, the expired ones with the
+      same description are deleted on register.
+    - deletes orphaned subscriptions with the same description.
+
+    Args:
+        http_client ContextBrokerClient: Client used for the requests
+        key str: Unique key of the module, e.g. agent_id/module_id
+        description str: Description of all subscriptions of the module
+        state_file Path: If given, the subscription ids are stored in this file
+        lease_duration float: If given, the subscriptions expire after
+            lease_duration seconds unless renewed
+        delete_orphans bool: If True, all other subscriptions with the
+            same description are deleted
+    """
+
+    def __init__(
+            self,
+            http_client: ContextBrokerClient,
+            key: str,
+            description: str,
+            state_file: Optional[Union[Path, str]] = None,
+            lease_duration: Optional[float] = None,
+            delete_orphans: bool = False
+    ):
+        self.http_client = http_client
+        self.key = key
+        self.description = description
+        self.state_file = None if state_file is None else Path(state_file)
+        self.lease_duration = lease_duration
+        self.delete_orphans = delete_orphans
+        self.subscription_ids: List[str] = []
+        self._subscriptions: List[Subscription] = []
+        self._stop_renewal = threading.Event()
+        self._renewal_thread: Optional[threading.Thread] = None
+
+    def register(self, subscriptions: List[Subscription]) -> List[str]:
+        """
+        Create the given subscriptions or reuse the stored ones.
+        Returns the ids of the subscriptions in the given order.
+        """
+        for subscription in subscriptions:
+            subscription.description = self.description
+            subscription.expires = self._get_expires()
+        config_hash = self._get_config_hash(subscriptions)
+        existing_ids = None
+        expired_ids = set()
+        if self.state_file is not None or self.delete_orphans or self.lease_duration is not None:
+            existing_ids = set()
+            for sub in self.http_client.get_subscription_list():
+                if sub.description != self.description:
+                    continue
+                if self._is_expired(sub):
+                    expired_ids.add(sub.id)
+                else:
+                    existing_ids.add(sub.id)
+        stored = self._load_state()
+        if (
+                stored is not None and
+                stored["config_hash"] == config_hash and
+                existing_ids is not None and
+                existing_ids.issuperset(stored["subscription_ids"])
+        ):
+            subscription_ids = list(stored["subscription_ids"])
+            logger.info("Reusing %s stored subscriptions of %s",
+                        len(subscription_ids), self.key)
+            self._subscriptions = self._with_ids(subscriptions, subscription_ids)
+            self._renew()
+        else:
+            if stored is not None:
+                # Outdated subscriptions of a former run
+                self._delete_subscriptions(existing_ids.intersection(stored["subscription_ids"]))
+            subscription_ids = [
+                self.http_client.post_subscription(subscription=subscription, update=True)
+                for subscription in subscriptions
+            ]
+            self._subscriptions = self._with_ids(subscriptions, subscription_ids)
+        self.subscription_ids = subscription_ids
+        self._save_state(config_hash=config_hash)
+        # Leases of crashed modules, never renewed again
+        self._delete_subscriptions(expired_ids)
+        if self.delete_orphans:
+            self._delete_subscriptions(
+                existing_ids.difference(subscription_ids, stored["subscription_ids"] if stored else [])
+            )
+        if self.lease_duration is not None:
+            self._start_renewal()
+        return subscription_ids
+
+    def stop(self, delete: bool = True):
+        """
+        Stop the renewal of the leases.
+        If delete is True, the subscriptions and the stored state are deleted.
+        """
+        self._stop_renewal.set()
+        if self._renewal_thread is not None:
+            self._renewal_thread.join()
+        if not delete:
+            return
+        self._delete_subscriptions(self.subscription_ids)
+        self.subscription_ids = []
+        self._subscriptions = []
+        self._save_state(config_hash=None)
+
+    def _get_expires(self) -> Optional[datetime]:
+        if self.lease_duration is None:
+            return None
+        # Naive UTC time, as expected by the ContextBroker
+        return (
+                datetime.now(timezone.utc) + timedelta(seconds=self.lease_duration)
+        ).replace(tzinfo=None)
+
+    @staticmethod
+    def _is_expired(subscription: Subscription) -> bool:
+        if subscription.status == Status.EXPIRED:
+            return True
+        if subscription.expires is None:
+            return False
+        expires = subscription.expires
+        if expires.tzinfo is None:
+            expires = expires.replace(tzinfo=timezone.utc)
+        return expires < datetime.now(timezone.utc)
+
+    def _get_config_hash(self, subscriptions: List[Subscription]) -> str:
+        content = json.dumps({
+            "url": str(self.http_client.base_url),
+            "fiware_header": get_fiware_header_key(self.http_client.fiware_headers),
+            "subscriptions": [
+                subscription.model_dump(mode="json", exclude={"id", "expires"}, exclude_none=True)
+                for subscription in subscriptions
+            ]
+        }, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @staticmethod
+    def _with_ids(subscriptions: List[Subscription], subscription_ids: List[str]):
+        return [
+            subscription.model_copy(update={"id": subscription_id})
+            for subscription, subscription_id in zip(subscriptions, subscription_ids)
+        ]
+
+    def _renew(self):
+        expires = self._get_expires()
+        if expires is None:
+            return
+        for subscription in self._subscriptions:
+            subscription.expires = expires
+            try:
+                self.http_client.update_subscription(subscription)
+            except requests.exceptions.RequestException as err:
+                logger.error("Could not renew subscription %s: %s", subscription.id, err)
+
+    def _start_renewal(self):
+        if self._renewal_thread is not None:
+            return
+
+        def renew_leases():
+            # Renew early enough to tolerate a failed renewal
+            while not self._stop_renewal.wait(self.lease_duration / 3):
+                self._renew()
+
+        self._renewal_thread = threading.Thread(
+            target=renew_leases, name=f"{self.key}_subscription_leases", daemon=True
+        )
+        self._renewal_thread.start()
+
+    def _delete_subscriptions(self, subscription_ids):
+        for subscription_id in subscription_ids:
+            try:
+                self.http_client.delete_subscription(subscription_id=subscription_id)
+            except requests.exceptions.RequestException as err:
+                logger.error("Could not delete subscription %s: %s", subscription_id, err)
+            else:
+                logger.debug("Deleted subscription %s of %s", subscription_id, self.key)
+
+    def _read_state_file(self) -> Dict[str, Dict]:
+        if not self.state_file.exists():
+            return {}
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError) as err:
+            logger.error("Could not read subscription state file %s: %s", self.state_file, err)
+            return {}
+
+    def _load_state(self) -> Optional[Dict]:
+        if self.state_file is None:
+            return None
+        with _STATE_FILE_LOCK:
+            return self._read_state_file().get(self.key)
+
+    def _save_state(self, config_hash: Optional[str]):
+        if self.state_file is None:
+            return
+        with _STATE_FILE_LOCK:
+            state = self._read_state_file()
+            if config_hash is None:
+                state.pop(self.key, None)
+            else:
+                state[self.key] = {
+                    "config_hash": config_hash,
+                    "subscription_ids": self.subscription_ids
+                }
+            # Write atomically to never leave a broken file
+            tmp_file = self.state_file.with_name(self.state_file.name + ".tmp")
+            with open(tmp_file, "w", encoding="utf-8") as file:
+                json.dump(state, file, indent=2)
+            os.replace(tmp_file, self.state_file)
@@ -0,0 +1,80 @@
+"""
+Grouping of entities into a small number of subscriptions, as the
+ContextBroker has to evaluate every subscription on each entity update.
+"""
+from enum import Enum
+from itertools import groupby
+from typing import List, Optional, Sequence, Tuple
+
+from filip.models.ngsi_v2.base import EntityPattern
+
+# Characters with a special meaning in POSIX extended regular expressions
+_REGEX_SPECIAL_CHARACTERS = frozenset(".^$*+?()[]{}|\\")
+
+
+class SubscriptionGrouping(str, Enum):
+    """
+    How to combine entities into subscriptions:
+    - entity: One subscription per entity.
+    - grouped: Up to max_entities_per_subscription entities
+      are listed as entity patterns of one subscription.
+    - id_pattern: Entities of the same type are combined into one
+      idPattern matching exactly their ids, with up to
+      max_entities_per_subscription entities per subscription.
+    """
+    ENTITY = "entity"
+    GROUPED = "grouped"
+    ID_PATTERN = "id_pattern"
+
+
+def _escape(entity_id: str) -> str:
+    return "".join(
+        "\\" + char if char in _REGEX_SPECIAL_CHARACTERS else char
+        for char in entity_id
+    )
+
+
+def group_entities(
+        entities: Sequence[Tuple[str, Optional[str]]],
+        grouping: SubscriptionGrouping,
+        max_entities_per_subscription: int
+) -> List[List[Tuple[str, Optional[str]]]]:
+    """
+    Split the (id, type) tuples of the entities into
+    the groups to create one subscription for each.
+    """
+    grouping = SubscriptionGrouping(grouping)
+    if grouping == SubscriptionGrouping.ENTITY:
+        return [[entity] for entity in entities]
+    if grouping == SubscriptionGrouping.ID_PATTERN:
+        # Each idPattern can only match one type
+        entities = sorted(entities, key=lambda entity: entity[1] or "")
+        entity_groups = [
+            list(group) for _, group in groupby(entities, key=lambda entity: entity[1])
+        ]
+    else:
+        entity_groups = [list(entities)]
+    return [
+        group[idx:idx + max_entities_per_subscription]
+        for group in entity_groups
+        for idx in range(0, len(group), max_entities_per_subscription)
+    ]
+
+
+def get_entity_patterns(
+        entities: Sequence[Tuple[str, Optional[str]]],
+        grouping: SubscriptionGrouping
+) -> List[EntityPattern]:
+    """
+    Return the entity patterns for the subject of the subscription
+    of one group created with group_entities.
+    """
+    if SubscriptionGrouping(grouping) == SubscriptionGrouping.ID_PATTERN:
+        return [EntityPattern(
+            idPattern="^(" + "|".join(_escape(entity_id) for entity_id, _ in entities) + ")$",
+            type=entities[0][1]
+        )]
+    return [
+        EntityPattern(id=entity_id, type=entity_type)
+        for entity_id, entity_type in entities
+    ]
@@ -0,0 +1,272 @@
+"""
+Local on-disk cache of extracted time series, to avoid requesting the
+same historic ranges from the server again. The data is partitioned by
+source, series and day. If pyarrow is installed, the partitions are
+stored as Feather files and read memory-mapped, otherwise as pickle files.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+from urllib.parse import quote
+
+import pandas as pd
+
+try:
+    from pyarrow import feather
+except ImportError:
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+_DAY = 86400
+_TIME_COLUMN = "__time__"
+_COVERAGE_FILE = "coverage.json"
+_MAX_DIR_NAME_LENGTH = 100
+
+Interval = Tuple[float, float]
+
+
+def to_unix(date: Union[datetime.datetime, pd.Timestamp]) -> float:
+    """Convert the date into unix time. Dates without timezone are interpreted as UTC."""
+    timestamp = pd.Timestamp(date)
+    if timestamp.tz is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.timestamp()
+
+
+def _from_unix(timestamp: float, like: datetime.datetime) -> datetime.datetime:
+    """Convert the unix time into a datetime with the same timezone as like"""
+    date = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+    if like.tzinfo is None:
+        return date.replace(tzinfo=None)
+    return date.astimezone(like.tzinfo)
+
+
+def get_source_key(*parts) -> str:
+    """
+    Return a short key of a data source, e.g. of its url and fiware header.
+    """
+    return hashlib.sha256(json.dumps([str(part) for part in parts]).encode()).hexdigest()[:16]
+
+
+def merge_intervals(intervals: Sequence[Interval]) -> List[Interval]:
+    """Merge overlapping or adjacent intervals"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(start: float, end: float, intervals: Sequence[Interval]) -> List[Interval]:
+    """Return the parts of [start, end] not covered by the merged intervals"""
+    missing = []
+    for covered_start, covered_end in intervals:
+        if covered_end <= start:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+class TimeSeriesCache:
+    """
+    Stores time series by source and series key, e.g. an entity/attribute.
+    The covered time ranges of each series are stored as well, so that
+    only the missing ranges have to be requested from the server, even
+    if they contain no samples.
+
+    Args:
+        cache_dir Path: Directory of the cache
+        max_size int: If given, the least recently used day partitions
+            are deleted if the cache exceeds max_size bytes
+        settle_time float: Ranges newer than settle_time seconds are not
+            marked as covered, as data may still arrive for them
+    """
+
+    def __init__(
+            self,
+            cache_dir: Union[Path, str],
+            max_size: Optional[int] = None,
+            settle_time: float = 300
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.settle_time = settle_time
+        self._suffix = ".feather" if feather is not None else ".pkl"
+        self._lock = threading.RLock()
+
+    def get_missing_ranges(
+            self,
+            source_key: str,
+            series_key: str,
+            from_date: datetime.datetime,
+            to_date: datetime.datetime
+    ) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+        """
+        Return the ranges between from_date and to_date which are not
+        cached yet, with the same timezone as from_date.
+        """
+        with self._lock:
+            coverage = self._load_coverage(self._series_dir(source_key, series_key))
+        return [
+            (_from_unix(start, like=from_date), _from_unix(end, like=from_date))
+            for start, end in subtract_intervals(to_unix(from_date), to_unix(to_date), coverage)
+        ]
+
+    def store(
+            self,
+            source_key: str,
+            series_key: str,
+            data: Optional[pd.DataFrame],
+            ranges: Sequence[Tuple[datetime.datetime, datetime.datetime]]
+    ):
+        """
+        Store the data, indexed by time, and mark the ranges it was
+        requested for as covered.
+        """
+        series_dir = self._series_dir(source_key, series_key)
+        settled = time.time() - self.settle_time
+        with self._lock:
+            series_dir.mkdir(parents=True, exist_ok=True)
+            if data is not None and not data.empty:
+                for day, day_data in data.groupby(self._get_days(data.index)):
+                    self._write_partition(series_dir / f"{day}{self._suffix}", day_data)
+            coverage = self._load_coverage(series_dir)
+            coverage.extend(
+                (to_unix(start), min(to_unix(end), settled)) for start, end in ranges
+                if to_unix(start) < settled
+            )
+            self._save_coverage(series_dir, merge_intervals(coverage))
+            if self.max_size is not None:
+                self.evict()
+
+    def load(
+            self,
+            source_key: str,
+            series_key: str,
+            from_date: datetime.datetime,
+            to_date: datetime.datetime
+    ) -> pd.DataFrame:
+        """Return the cached data between from_date and to_date (inclusive)"""
+        series_dir = self._series_dir(source_key, series_key)
+        start_day = int(to_unix(from_date) // _DAY)
+        end_day = int(to_unix(to_date) // _DAY)
+        partitions = []
+        with self._lock:
+            for day in range(start_day, end_day + 1):
+                path = series_dir / f"{self._format_day(day)}{self._suffix}"
+                if path.exists():
+                    partitions.append(self._read_partition(path))
+        if not partitions:
+            return pd.DataFrame()
+        data = pd.concat(partitions) if len(partitions) > 1 else partitions[0]
+        start = self._like_index(from_date, data.index)
+        end = self._like_index(to_date, data.index)
+        return data.iloc[
+            data.index.searchsorted(start, side="left"):data.index.searchsorted(end, side="right")
+        ]
+
+    def evict(self):
+        """Delete the least recently used day partitions until the cache fits max_size"""
+        with self._lock:
+            partitions = [
+                (path.stat().st_mtime, path.stat().st_size, path)
+                for path in self.cache_dir.glob(f"*/*/*{self._suffix}")
+            ]
+            size = sum(partition[1] for partition in partitions)
+            for _, file_size, path in sorted(partitions):
+                if size <= self.max_size:
+                    break
+                # The day has to be requested again once it is evicted
+                day = int(to_unix(pd.Timestamp(path.stem)) // _DAY)
+                self._save_coverage(path.parent, self._without_day(path.parent, day))
+                path.unlink()
+                size -= file_size
+                logger.debug("Evicted cached partition %s", path)
+
+    def _without_day(self, series_dir: Path, day: int) -> List[Interval]:
+        coverage = []
+        for start, end in self._load_coverage(series_dir):
+            coverage.extend(subtract_intervals(start, end, [(day * _DAY, (day + 1) * _DAY)]))
+        return coverage
+
+    def _series_dir(self, source_key: str, series_key: str) -> Path:
+        dir_name = quote(series_key, safe="")
+        if len(dir_name) > _MAX_DIR_NAME_LENGTH:
+            dir_name = hashlib.sha256(series_key.encode()).hexdigest()
+        return self.cache_dir / source_key / dir_name
+
+    @staticmethod
+    def _format_day(day: int) -> str:
+        return datetime.datetime.fromtimestamp(day * _DAY, tz=datetime.timezone.utc).strftime("%Y-%m-%d")
+
+    @staticmethod
+    def _get_days(index: pd.DatetimeIndex) -> pd.Index:
+        if index.tz is None:
+            index = index.tz_localize("UTC")
+        return index.tz_convert("UTC").strftime("%Y-%m-%d")
+
+    @staticmethod
+    def _like_index(date: datetime.datetime, index: pd.DatetimeIndex) -> pd.Timestamp:
+        timestamp = pd.Timestamp(date)
+        if index.tz is not None and timestamp.tz is None:
+            return timestamp.tz_localize("UTC").tz_convert(index.tz)
+        if index.tz is None and timestamp.tz is not None:
+            return timestamp.tz_convert("UTC").tz_localize(None)
+        return timestamp
+
+    def _write_partition(self, path: Path, data: pd.DataFrame):
+        if path.exists():
+            data = pd.concat([self._read_partition(path), data])
+            data = data[~data.index.duplicated(keep="last")].sort_index()
+        # Write atomically to never leave a broken partition
+        tmp_file = path.with_name(path.name + ".tmp")
+        if feather is not None:
+            feather.write_feather(
+                data.rename_axis(_TIME_COLUMN).reset_index(), tmp_file, compression="uncompressed"
+            )
+        else:
+            data.to_pickle(tmp_file)
+        os.replace(tmp_file, path)
+
+    def _read_partition(self, path: Path) -> pd.DataFrame:
+        # Mark the partition as recently used for the eviction
+        os.utime(path)
+        if feather is not None:
+            data = feather.read_table(path, memory_map=True).to_pandas()
+            return data.set_index(_TIME_COLUMN).rename_axis(None)
+        return pd.read_pickle(path)
+
+    @staticmethod
+    def _load_coverage(series_dir: Path) -> List[Interval]:
+        path = series_dir / _COVERAGE_FILE
+        if not path.exists():
+            return []
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return [tuple(interval) for interval in json.load(file)]
+        except (OSError, ValueError) as err:
+            logger.error("Could not read cache coverage %s: %s", path, err)
+            return []
+
+    @staticmethod
+    def _save_coverage(series_dir: Path, coverage: List[Interval]):
+        path = series_dir / _COVERAGE_FILE
+        tmp_file = path.with_name(path.name + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as file:
+            json.dump(coverage, file)
+        os.replace(tmp_file, path)
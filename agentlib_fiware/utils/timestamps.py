@@ -0,0 +1,75 @@
+"""
+Fast conversion between FIWARE time strings (e.g. of the TimeInstant
+metadata) and unix timestamps. Repeated instants are cached, as
+several attributes and messages usually share the same time.
+"""
+import functools
+from datetime import datetime, timezone
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+ISO_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_CACHE_SIZE = 1024
+
+
+def _from_iso_format(time_string: str) -> Optional[datetime]:
+    if time_string.endswith("Z"):
+        time_string = time_string[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(time_string)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=_CACHE_SIZE)
+def time_instant_to_unix(time_instant: str, time_format: str = ISO_TIME_FORMAT) -> float:
+    """
+    Convert the time string into unix time.
+    ISO 8601 strings are parsed with the fast datetime.fromisoformat,
+    all others with the given time_format.
+    Times without timezone are interpreted as UTC.
+    """
+    time_datetime = _from_iso_format(time_instant)
+    if time_datetime is None:
+        time_datetime = datetime.strptime(time_instant, time_format)
+    if time_datetime.tzinfo is None:
+        time_datetime = time_datetime.replace(tzinfo=timezone.utc)
+    return (time_datetime - _EPOCH).total_seconds()
+
+
+def time_instants_to_unix(
+        time_instants: Sequence[Optional[str]],
+        time_format: str = ISO_TIME_FORMAT
+) -> np.ndarray:
+    """
+    Vectorised version of time_instant_to_unix for a batch of time strings.
+    Missing time strings (None) are returned as NaN.
+    """
+    if len(time_instants) == 0:
+        return np.empty(0)
+    try:
+        times = pd.to_datetime(
+            pd.Series(time_instants, dtype=object), format=time_format, utc=True
+        )
+    except (ValueError, TypeError):
+        # Mixed formats, convert each one
+        return np.array([
+            np.nan if time_instant is None else time_instant_to_unix(time_instant, time_format)
+            for time_instant in time_instants
+        ], dtype=float)
+    return ((times - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=float)
+
+
+@functools.lru_cache(maxsize=_CACHE_SIZE)
+def unix_to_time_instant(timestamp: float, time_format: str = ISO_TIME_FORMAT) -> str:
+    """
+    Convert the unix time into a time string of the given format,
+    using the local time as datetime.fromtimestamp.
+    """
+    time_datetime = datetime.fromtimestamp(timestamp)
+    if time_format == ISO_TIME_FORMAT:
+        return time_datetime.isoformat(timespec="microseconds") + "Z"
+    return time_datetime.strftime(time_format)
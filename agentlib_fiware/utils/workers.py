@@ -0,0 +1,206 @@
+"""
+Bounded work queues processed by background threads.
+Used to keep blocking network I/O out of the callbacks
+of the AgentLib's data_broker and the MQTT network loop.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy(str, Enum):
+    """
+    What to do if a task is submitted to a full queue:
+    - drop_oldest: Discard the oldest pending task.
+    - block: Wait until a worker takes a task from the queue.
+    - coalesce: Replace a pending task with the same key.
+      If no such task exists, discard the oldest pending task.
+    """
+    DROP_OLDEST = "drop_oldest"
+    BLOCK = "block"
+    COALESCE = "coalesce"
+
+
+class BackgroundWorker:
+    """
+    Executes submitted tasks in a pool of daemon threads.
+    Tasks with the same key are never executed concurrently and keep
+    the order of their submission, e.g. to not reorder updates of
+    the same attribute with several workers.
+
+    Args:
+        name str: Name used for the threads and logging
+        num_workers int: Number of worker threads
+        max_queue_size int: Maximal number of pending tasks
+        overflow_policy OverflowPolicy: See OverflowPolicy
+        max_batch_size int: Maximal number of tasks a worker takes
+            from the queue at once, to reduce the locking overhead
+            for many small tasks
+    """
+
+    def __init__(
+            self,
+            name: str,
+            num_workers: int = 1,
+            max_queue_size: int = 1000,
+            overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+            max_batch_size: int = 1
+    ):
+        self.name = name
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.max_batch_size = max_batch_size
+        # Pending tasks with the time of their submission and their key
+        self._queue: "OrderedDict[Hashable, Tuple[Callable[[], Any], float, Hashable]]" = \
+            OrderedDict()
+        # Number of taken but not yet finished tasks of each key
+        self._active_keys: Dict[Hashable, int] = {}
+        self._condition = threading.Condition()
+        self._counter = itertools.count()
+        self._running = True
+        self._metrics = {
+            "submitted": 0,
+            "executed": 0,
+            "failed": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "max_queue_depth": 0,
+            "max_latency": 0.0,
+        }
+        # Sum of the latencies between submission and execution
+        self._latency_sum = 0.0
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._work, name=f"{name}_{idx}", daemon=True)
+            for idx in range(num_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of pending tasks"""
+        return len(self._queue)
+
+    def get_metrics(self) -> Dict[str, float]:
+        """
+        Return a snapshot of the queue metrics.
+        The latencies between submission and execution are in seconds.
+        """
+        with self._condition:
+            started = self._metrics["executed"] + self._metrics["failed"]
+            return dict(
+                self._metrics,
+                queue_depth=len(self._queue),
+                mean_latency=self._latency_sum / started if started else 0.0
+            )
+
+    def submit(self, func: Callable, *args, key: Hashable = None, **kwargs) -> bool:
+        """
+        Queue func(*args, **kwargs) for execution in a worker thread.
+        The key is used to coalesce tasks if overflow_policy='coalesce'.
+        Returns False if the worker is stopped and the task is ignored.
+        """
+        def task():
+            return func(*args, **kwargs)
+
+        with self._condition:
+            if not self._running:
+                return False
+            self._metrics["submitted"] += 1
+            coalesce = self.overflow_policy == OverflowPolicy.COALESCE and key is not None
+            if coalesce and ("key", key) in self._queue:
+                # Keep the position in the queue, only replace the task
+                self._queue[("key", key)] = (task, self._queue[("key", key)][1], key)
+                self._metrics["coalesced"] += 1
+                return True
+            while len(self._queue) >= self.max_queue_size:
+                if self.overflow_policy == OverflowPolicy.BLOCK:
+                    self._condition.wait()
+                    continue
+                self._queue.popitem(last=False)
+                self._metrics["dropped"] += 1
+                logger.warning("Queue of %s is full, dropped oldest task.", self.name)
+            queue_key = ("key", key) if coalesce else ("task", next(self._counter))
+            self._queue[queue_key] = (task, time.monotonic(), key)
+            self._metrics["max_queue_depth"] = max(
+                self._metrics["max_queue_depth"], len(self._queue)
+            )
+            self._condition.notify_all()
+        return True
+
+    def stop(self, drain: bool = True, timeout: Optional[float] = None):
+        """
+        Stop accepting new tasks and join the worker threads.
+        If drain is True, pending tasks are executed first,
+        else they are discarded.
+        """
+        with self._condition:
+            self._running = False
+            if not drain:
+                self._metrics["dropped"] += len(self._queue)
+                self._queue.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=timeout)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                tasks = self._take_tasks()
+                while not tasks and (self._queue or self._running):
+                    self._condition.wait()
+                    tasks = self._take_tasks()
+                if not tasks:
+                    return
+                self._condition.notify_all()
+            for task, submitted_at, key in tasks:
+                self._execute(task=task, submitted_at=submitted_at, key=key)
+
+    def _take_tasks(self) -> List[Tuple[Callable[[], Any], float, Hashable]]:
+        """
+        Take up to max_batch_size of the oldest pending tasks, skipping
+        tasks whose key is executed by another worker.
+        Must be called with the condition acquired.
+        """
+        queue_keys = []
+        taken_keys = set()
+        for queue_key, (_, _, key) in self._queue.items():
+            if len(queue_keys) >= self.max_batch_size:
+                break
+            if key is not None and key in self._active_keys and key not in taken_keys:
+                continue
+            queue_keys.append(queue_key)
+            if key is not None:
+                taken_keys.add(key)
+        tasks = [self._queue.pop(queue_key) for queue_key in queue_keys]
+        for _, _, key in tasks:
+            if key is not None:
+                self._active_keys[key] = self._active_keys.get(key, 0) + 1
+        return tasks
+
+    def _execute(self, task: Callable[[], Any], submitted_at: float, key: Hashable = None):
+        latency = time.monotonic() - submitted_at
+        try:
+            task()
+        except Exception as err:  # pylint: disable=broad-except
+            logger.exception("Task in %s failed: %s", self.name, err)
+            metric = "failed"
+        else:
+            metric = "executed"
+        with self._condition:
+            self._metrics[metric] += 1
+            self._latency_sum += latency
+            self._metrics["max_latency"] = max(self._metrics["max_latency"], latency)
+            if key is not None:
+                self._active_keys[key] -= 1
+                if not self._active_keys[key]:
+                    del self._active_keys[key]
+                # Pending tasks of the key may be taken now
+                self._condition.notify_all()
@@ -0,0 +1,80 @@
+"""
+Helpers to test modules without connecting to an MQTT broker or FIWARE.
+"""
+import logging
+from unittest import mock
+
+
+def create_module(module_type, config, **attributes):
+    """
+    Create the module without running its __init__, with the given
+    validated config and a mocked agent.
+    Abstract methods of the installed agentlib version are stubbed.
+    Further attributes, e.g. clients, can be set with the keyword arguments.
+    """
+    module = object.__new__(_get_concrete_type(module_type))
+    _set_up_module(module, config)
+    for name, value in attributes.items():
+        setattr(module, name, value)
+    return module
+
+
+class InitInterrupted(Exception):
+    """Stops the __init__ of a module in receive_during_init"""
+
+
+def receive_during_init(module_type, parent_type, config, message):
+    """
+    Run the __init__ of the module, with the __init__ of parent_type,
+    which connects the MQTT client, replaced by the delivery of the
+    message to _message_callback. The rest of the module's __init__ is
+    not executed. Returns the partly initialised module.
+    """
+    modules = []
+
+    def parent_init(module, *args, **kwargs):
+        _set_up_module(module, config)
+        modules.append(module)
+        module._message_callback(None, None, message)
+        raise InitInterrupted
+
+    with mock.patch.object(parent_type, "__init__", parent_init):
+        try:
+            _get_concrete_type(module_type)(config={}, agent=mock.Mock())
+        except InitInterrupted:
+            pass
+    return modules[0]
+
+
+def _get_concrete_type(module_type):
+    """Stub the abstract methods of the installed agentlib version"""
+    return type(
+        module_type.__name__,
+        (module_type,),
+        {name: mock.Mock() for name in getattr(module_type, "__abstractmethods__", ())}
+    )
+
+
+def _set_up_module(module, config):
+    module._config = config
+    module._agent = mock.Mock()
+    module._agent.id = "agent"
+    module._agent.env.time = 0
+    module.logger = logging.getLogger(type(module).__name__)
+
+
+def create_context_broker_config(config_type, entities, **config):
+    """
+    Validate the config of a context broker module. The existence check
+    of the entity attributes is answered with the given entities.
+    """
+    from agentlib_fiware.modules.context_broker import base
+    with mock.patch.object(base, "query_entities", return_value=entities):
+        return config_type(
+            _agent_id="agent",
+            module_id="context_broker",
+            type="context_broker",
+            cb_url="http://localhost:1026",
+            fiware_header={"service": "test", "service_path": "/"},
+            **config
+        )
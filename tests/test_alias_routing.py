@@ -0,0 +1,34 @@
+import unittest
+
+from agentlib_fiware.modules.iota_mqtt.base import AliasRoutingTable
+
+
+def get_alias(id_, name):
+    return name
+
+
+class TestAliasRoutingTable(unittest.TestCase):
+
+    def test_lookup(self):
+        table = AliasRoutingTable(get_alias=get_alias, keys=[("room", "temperature")])
+        self.assertEqual(table.get_alias("room", "temperature"), "temperature")
+        self.assertEqual(table.get_key("temperature"), ("room", "temperature"))
+        self.assertIsNone(table.get_key("humidity"))
+        # Unknown combinations are computed, but not added
+        self.assertEqual(table.get_alias("room", "humidity"), "humidity")
+        self.assertNotIn(("room", "humidity"), table.aliases)
+        with self.assertRaises(TypeError):
+            table.aliases[("room", "humidity")] = "humidity"
+
+    def test_conflicting_aliases_keep_the_first_key(self):
+        with self.assertLogs("agentlib_fiware.modules.iota_mqtt.base", level="WARNING"):
+            table = AliasRoutingTable(
+                get_alias=get_alias,
+                keys=[("room_1", "temperature"), ("room_2", "temperature")]
+            )
+        self.assertEqual(table.get_key("temperature"), ("room_1", "temperature"))
+        self.assertEqual(table.get_alias("room_2", "temperature"), "temperature")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from agentlib_fiware.utils.change_detection import ChangeDetector
+
+
+class TestChangeDetector(unittest.TestCase):
+
+    def test_unchanged_values_are_not_forwarded(self):
+        detector = ChangeDetector()
+        self.assertTrue(detector.should_forward("a", 1, marker="t1"))
+        detector.next_cycle()
+        self.assertFalse(detector.should_forward("a", 1, marker="t1"))
+        # A new marker with the same value, e.g. a repeated measurement
+        self.assertTrue(detector.should_forward("a", 1, marker="t2"))
+        self.assertTrue(detector.should_forward("a", 2, marker="t2"))
+        self.assertTrue(detector.should_forward("b", 2, marker="t2"))
+
+    def test_heartbeat(self):
+        detector = ChangeDetector(heartbeat_cycles=2)
+        forwarded = []
+        for _ in range(5):
+            forwarded.append(detector.should_forward("a", 1))
+            detector.next_cycle()
+        self.assertEqual(forwarded, [True, False, True, False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import threading
+import unittest
+from unittest import mock
+
+import requests
+from agentlib import AgentVariable
+from filip.models.ngsi_v2.context import ContextEntity
+
+from agentlib_fiware.modules.context_broker.scheduled_attributes import (
+    ScheduledAttributesContextBroker,
+    ScheduledAttributesContextBrokerConfig
+)
+from agentlib_fiware.utils.entity_cache import EntitySchemaCache
+from tests.helpers import create_context_broker_config, create_module
+
+ENTITY_ID = "urn:ngsi-ld:Room:001"
+
+
+def get_entity() -> ContextEntity:
+    return ContextEntity(
+        id=ENTITY_ID,
+        type="Room",
+        temperature={"type": "Number", "value": 0},
+        humidity={"type": "Number", "value": 0}
+    )
+
+
+def create_context_broker(**kwargs) -> ScheduledAttributesContextBroker:
+    config = create_context_broker_config(
+        ScheduledAttributesContextBrokerConfig,
+        entities=[get_entity()],
+        update_entity_attributes=[
+            {"name": f"{ENTITY_ID}/temperature"},
+            {"name": f"{ENTITY_ID}/humidity"}
+        ],
+        **kwargs
+    )
+    schema_cache = EntitySchemaCache()
+    schema_cache.add_entity(get_entity())
+    return create_module(
+        ScheduledAttributesContextBroker,
+        config,
+        _httpc=mock.Mock(),
+        _schema_cache=schema_cache,
+        _batch={},
+        _batch_lock=threading.Lock(),
+        _update_statistics={"sent": 0, "shed": 0, "failed": 0},
+        _update_statistics_lock=threading.Lock(),
+        _writer=None
+    )
+
+
+def update(module, attr_name, value, timestamp=0):
+    module._process_update(
+        variable=AgentVariable(name=f"{ENTITY_ID}/{attr_name}", value=value, timestamp=timestamp),
+        name=f"{ENTITY_ID}/{attr_name}"
+    )
+
+
+class TestUpdateModes(unittest.TestCase):
+
+    def test_single_and_batch_mode_override_metadata(self):
+        single = create_context_broker(update_mode="single")
+        update(single, "temperature", 21)
+        self.assertTrue(single._httpc.update_entity_attribute.call_args.kwargs["override_metadata"])
+
+        batch = create_context_broker(update_mode="batch")
+        update(batch, "temperature", 21)
+        update(batch, "humidity", 50)
+        batch.flush_batch()
+        batch._httpc.update.assert_called_once()
+        self.assertTrue(batch._httpc.update.call_args.kwargs["override_metadata"])
+        (entity,) = batch._httpc.update.call_args.kwargs["entities"]
+        self.assertEqual(entity.get_attribute("temperature").value, 21)
+        self.assertEqual(entity.get_attribute("humidity").value, 50)
+
+    def test_batch_keeps_latest_value(self):
+        module = create_context_broker(update_mode="batch")
+        update(module, "temperature", 21)
+        update(module, "temperature", 22)
+        module.flush_batch()
+        (entity,) = module._httpc.update.call_args.kwargs["entities"]
+        self.assertEqual(entity.get_attribute("temperature").value, 22)
+        self.assertEqual(module.get_update_statistics()["sent"], 1)
+
+
+class TestSchemaCache(unittest.TestCase):
+
+    def test_cached_schema_needs_no_request(self):
+        module = create_context_broker(update_mode="single")
+        update(module, "temperature", 21)
+        update(module, "temperature", 22)
+        module._httpc.get_entity.assert_not_called()
+        self.assertEqual(module._httpc.update_entity_attribute.call_args.kwargs["entity_type"], "Room")
+
+    def test_unknown_entity_is_fetched_once(self):
+        module = create_context_broker(update_mode="single")
+        module._schema_cache = EntitySchemaCache()
+        module._httpc.get_entity.return_value = get_entity()
+        update(module, "temperature", 21)
+        update(module, "humidity", 50)
+        module._httpc.get_entity.assert_called_once_with(entity_id=ENTITY_ID)
+
+    def test_schema_errors_invalidate_the_cache(self):
+        module = create_context_broker(update_mode="single")
+        response = requests.Response()
+        response.status_code = 422
+        module._httpc.update_entity_attribute.side_effect = requests.exceptions.HTTPError(
+            "Unprocessable Entity", response=response
+        )
+        update(module, "temperature", 21)
+        self.assertIsNone(module._schema_cache.get_attribute(ENTITY_ID, "temperature"))
+        self.assertEqual(module.get_update_statistics()["failed"], 1)
+
+
+class TestStaleUpdates(unittest.TestCase):
+
+    def test_stale_updates_are_shed(self):
+        module = create_context_broker(update_mode="single", skip_update_after_x_seconds=10)
+        module._agent.env.time = 100
+        update(module, "temperature", 21, timestamp=80)
+        update(module, "temperature", 22, timestamp=95)
+        module._httpc.update_entity_attribute.assert_called_once()
+        self.assertEqual(module.get_update_statistics(), {"sent": 1, "shed": 1, "failed": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import json
+import unittest
+from unittest import mock
+
+from filip.clients.mqtt import IoTAMQTTClient
+from filip.models.mqtt import IoTAMQTTMessageType
+from paho.mqtt.client import MQTTMessage, topic_matches_sub
+
+from agentlib_fiware.modules.iota_mqtt.device_to_iotagent import (
+    DeviceIoTAMQTTCommunicator,
+    IoTAMQTTConfig
+)
+from tests.helpers import create_module
+
+DEVICE = {
+    "device_id": "device_1",
+    "entity_name": "urn:ngsi-ld:Room:001",
+    "entity_type": "Room",
+    "apikey": "apikey_1",
+    "protocol": "IoTA-JSON",
+    "transport": "MQTT",
+    "attributes": [{"name": "temperature", "type": "Number", "object_id": "t"}],
+    "commands": [{"name": "heater"}]
+}
+
+
+def get_config(**kwargs) -> dict:
+    return {
+        "module_id": "iota",
+        "type": "iota",
+        "mqtt_url": "mqtt://localhost:1883",
+        "fiware_header": {"service": "test", "service_path": "/"},
+        "service_groups": [],
+        "devices": [DEVICE],
+        **kwargs
+    }
+
+
+def create_communicator(**kwargs) -> DeviceIoTAMQTTCommunicator:
+    config = get_config(**kwargs)
+    module = create_module(
+        DeviceIoTAMQTTCommunicator,
+        IoTAMQTTConfig(_agent_id="agent", **config),
+        _mqttc=IoTAMQTTClient(),
+        _devices=DeviceIoTAMQTTCommunicator._get_devices_by_id(config)
+    )
+    module._mqttc.publish = mock.Mock()
+    return module
+
+
+def get_command_topic(device: dict) -> str:
+    """The topic on which the IoT Agent publishes commands, as created by filip"""
+    mqttc = IoTAMQTTClient()
+    mqttc.add_device(IoTAMQTTConfig(_agent_id="agent", **get_config()).devices[0])
+    return mqttc._IoTAMQTTClient__create_topic(
+        device=mqttc.get_device(device["device_id"]),
+        topic_type=IoTAMQTTMessageType.CMD
+    )
+
+
+class TestCommandSubscription(unittest.TestCase):
+
+    def test_topics_match_iot_agent_command_topic(self):
+        command_topic = get_command_topic(DEVICE)
+        for command_subscription in ("device", "wildcard"):
+            communicator = create_communicator(command_subscription=command_subscription)
+            self.assertTrue(any(
+                topic_matches_sub(topic, command_topic)
+                for topic in communicator.get_all_topics()
+            ), communicator.get_all_topics())
+
+    def test_wildcard_command_is_received_and_acknowledged(self):
+        communicator = create_communicator(command_subscription="wildcard")
+        command_topic = get_command_topic(DEVICE)
+        (subscription,) = communicator.get_all_topics()
+        msg = MQTTMessage(topic=command_topic.encode())
+        msg.payload = json.dumps({"heater": True}).encode()
+        self.assertTrue(topic_matches_sub(subscription, msg.topic))
+
+        communicator._message_callback(None, None, msg)
+
+        variable = communicator.agent.data_broker.send_variable.call_args.args[0]
+        self.assertEqual(variable.name, "heater")
+        self.assertEqual(variable.value, True)
+        communicator._mqttc.publish.assert_called_once_with(
+            topic="/json/apikey_1/device_1/cmdexe",
+            payload=json.dumps({"heater": True})
+        )
+
+    def test_wildcard_ignores_unknown_devices(self):
+        communicator = create_communicator(command_subscription="wildcard")
+        msg = MQTTMessage(topic=b"/apikey_1/other_device/cmd")
+        msg.payload = json.dumps({"heater": True}).encode()
+
+        communicator._message_callback(None, None, msg)
+
+        communicator.agent.data_broker.send_variable.assert_not_called()
+        communicator._mqttc.publish.assert_not_called()
+
+    def test_devices_are_available_before_validation(self):
+        devices = DeviceIoTAMQTTCommunicator._get_devices_by_id(json.dumps(get_config()))
+        self.assertEqual(list(devices), ["device_1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
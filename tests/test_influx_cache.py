@@ -0,0 +1,81 @@
+import datetime
+import tempfile
+import unittest
+from importlib.util import find_spec
+from unittest import mock
+
+import pandas as pd
+from filip.models.base import FiwareHeader
+
+from agentlib_fiware.utils.timeseries_cache import TimeSeriesCache
+
+FROM_DATE = datetime.datetime(2020, 1, 1)
+FIWARE_HEADER = FiwareHeader(service="test", service_path="/")
+
+
+class FakeHttpsClient:
+    """Returns one column per queried topic, as transform_dataframe_fiware"""
+
+    queries = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def get_timeseries(self, config, start_time, end_time):
+        self.queries.append((tuple(tuple(topic) for topic in config["topics"]), start_time, end_time))
+        index = pd.date_range(start_time, end_time, freq="600s", tz="CET")
+        return pd.DataFrame(
+            {"/".join(topic): range(len(index)) for topic in config["topics"]},
+            index=index
+        )
+
+
+@unittest.skipIf(
+    find_spec("ebcpy") is None or find_spec("influxdb_client") is None,
+    "ebcpy and influxdb_client are required for the influx extraction"
+)
+class TestInfluxCache(unittest.TestCase):
+
+    def setUp(self):
+        from agentlib_fiware.utils.influx import get_influx_data
+        self.get_influx_data = get_influx_data
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = TimeSeriesCache(self._tmp_dir.name, settle_time=0)
+        FakeHttpsClient.queries = []
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def get_data(self, entity_name_attributes):
+        with mock.patch.object(self.get_influx_data, "HttpsClient", FakeHttpsClient):
+            return self.get_influx_data.get_data_from_influx(
+                fiware_header=FIWARE_HEADER,
+                entity_name_attributes=entity_name_attributes,
+                interval=3600,
+                to_date=FROM_DATE + datetime.timedelta(hours=1),
+                token="token",
+                organization="org",
+                bucket="bucket",
+                influx_url="http://localhost:8086",
+                cache=self.cache
+            )
+
+    def test_attributes_are_cached_separately(self):
+        self.get_data(["room/temperature", "room/humidity"])
+        self.assertEqual(len(FakeHttpsClient.queries), 1)
+
+        # Reordered and removed attributes are served from the cache
+        data = self.get_data(["room/humidity"])
+        self.assertEqual(len(FakeHttpsClient.queries), 1)
+        self.assertEqual(list(data.columns.get_level_values(0)),
+                         ["/fiware_to_influx/test//room/humidity_value"])
+
+        # Only the new attribute is queried
+        self.get_data(["room/co2", "room/temperature"])
+        self.assertEqual(len(FakeHttpsClient.queries), 2)
+        self.assertEqual(FakeHttpsClient.queries[-1][0],
+                         (("/fiware_to_influx/test//room", "co2_value"),))
+
+
+if __name__ == "__main__":
+    unittest.main()
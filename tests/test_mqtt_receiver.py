@@ -0,0 +1,58 @@
+import threading
+import unittest
+from unittest import mock
+
+from agentlib_fiware.modules.context_broker.notified_attributes import NotifiedAttributesContextBrokerConfig
+from agentlib_fiware.modules.iota_mqtt.base import BaseIoTACommunicatorConfig
+from agentlib_fiware.modules.iota_mqtt.device_to_iotagent import DeviceIoTAMQTTCommunicator, IoTAMQTTConfig
+from agentlib_fiware.modules.mqtt_receiver import AsyncReceiveConfig
+from tests.helpers import create_module
+
+
+def create_communicator(**kwargs) -> DeviceIoTAMQTTCommunicator:
+    config = IoTAMQTTConfig(
+        _agent_id="agent",
+        module_id="iota",
+        type="iota",
+        mqtt_url="mqtt://localhost:1883",
+        fiware_header={"service": "test", "service_path": "/"},
+        service_groups=[],
+        devices=[],
+        **kwargs
+    )
+    return create_module(DeviceIoTAMQTTCommunicator, config, _mqttc=mock.Mock())
+
+
+class TestAsyncReceiver(unittest.TestCase):
+
+    def test_configs_share_the_receive_options(self):
+        for config_type in (BaseIoTACommunicatorConfig, NotifiedAttributesContextBrokerConfig):
+            with self.subTest(config_type=config_type.__name__):
+                for name, field in AsyncReceiveConfig.model_fields.items():
+                    self.assertIs(config_type.model_fields[name].annotation, field.annotation)
+                    self.assertEqual(config_type.model_fields[name].title, field.title)
+
+    def test_messages_are_processed_by_the_receiver(self):
+        threads = []
+        module = create_communicator(async_receive=True)
+        module._message_callback = lambda *args: threads.append((threading.current_thread(), args))
+        module._start_receiver()
+
+        self.assertEqual(module._mqttc.on_message, module._enqueue_message)
+        module._mqttc.on_message(None, None, "message")
+        module._stop_receiver()
+
+        ((thread, args),) = threads
+        self.assertIsNot(thread, threading.current_thread())
+        self.assertEqual(args, (None, None, "message"))
+        self.assertEqual(module.get_receiver_metrics()["executed"], 1)
+
+    def test_receiver_is_inactive_by_default(self):
+        module = create_communicator()
+        module._start_receiver()
+        module._stop_receiver()
+        self.assertEqual(module.get_receiver_metrics(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
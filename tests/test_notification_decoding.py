@@ -0,0 +1,101 @@
+import json
+import unittest
+from unittest import mock
+
+from filip.models.ngsi_v2.context import ContextEntity
+
+from agentlib_fiware.modules.context_broker import base
+from agentlib_fiware.modules.context_broker.notified_attributes import (
+    NotifiedAttributesContextBroker,
+    NotifiedAttributesContextBrokerConfig
+)
+from agentlib_fiware.modules.iota_mqtt.context_broker_to_service import (
+    ContextBrokerCommunicator,
+    ContextBrokerCommunicatorConfig
+)
+from tests.helpers import create_context_broker_config, create_module
+
+TIME_INSTANT = {"TimeInstant": {"type": "DateTime", "value": "2020-01-01T00:00:00.000Z"}}
+ENTITY = {
+    "id": "urn:ngsi-ld:Room:001",
+    "type": "Room",
+    "temperature": {"type": "Number", "value": 21, "metadata": TIME_INSTANT},
+    "refBuilding": {"type": "Relationship", "value": "urn:ngsi-ld:Building:001"},
+    # A command with its status and info
+    "heater": {"type": "command", "value": ""},
+    "heater_status": {"type": "commandStatus", "value": "OK", "metadata": TIME_INSTANT},
+    "heater_info": {"type": "commandResult", "value": "on", "metadata": TIME_INSTANT},
+    # Status and info without their command, e.g. due to notification_attrs
+    "valve_status": {"type": "commandStatus", "value": "PENDING", "metadata": TIME_INSTANT},
+    "valve_info": {"type": "commandResult", "value": "", "metadata": TIME_INSTANT}
+}
+PAYLOAD = json.dumps({"subscriptionId": "subscription_1", "data": [ENTITY]}).encode()
+
+
+def create_communicator(decoding: str) -> ContextBrokerCommunicator:
+    config = ContextBrokerCommunicatorConfig(
+        _agent_id="agent",
+        module_id="cb",
+        type="cb",
+        mqtt_url="mqtt://localhost:1883",
+        cb_url="http://localhost:1026",
+        fiware_header={"service": "test", "service_path": "/"},
+        defer_entity_sync=True,
+        entities=[ContextEntity(**ENTITY)],
+        notification_decoding=decoding
+    )
+    module = create_module(ContextBrokerCommunicator, config)
+    module.entities_map = {(entity.id, entity.type): entity for entity in config.entities}
+    module.subscription_ids = ["subscription_1"]
+    return module
+
+
+def create_context_broker(decoding: str) -> NotifiedAttributesContextBroker:
+    config = create_context_broker_config(
+        NotifiedAttributesContextBrokerConfig,
+        entities=[ContextEntity(**ENTITY)],
+        mqtt_url="mqtt://localhost:1883",
+        read_entity_attributes=[
+            {"name": f"{ENTITY['id']}/{name}"} for name in ENTITY if name not in ("id", "type")
+        ],
+        notification_decoding=decoding
+    )
+    module = create_module(NotifiedAttributesContextBroker, config)
+    module._agent.env.config.rt = False
+    module._notified_attributes = None
+    module._unique_entities = base.get_unique_entities(config.read_entity_attributes)
+    module.subscription_ids = ["subscription_1"]
+    module.set = mock.Mock()
+    return module
+
+
+class TestDecodingModes(unittest.TestCase):
+
+    def test_communicator_modes_send_the_same_values(self):
+        sent = {}
+        for decoding in ("strict", "fast"):
+            module = create_communicator(decoding)
+            module._message_callback(None, None, mock.Mock(payload=PAYLOAD))
+            sent[decoding] = sorted(
+                (call.args[0].name, call.args[0].value, call.args[0].timestamp)
+                for call in module._agent.data_broker.send_variable.call_args_list
+            )
+        self.assertEqual(sent["fast"], sent["strict"])
+        self.assertEqual([name for name, _value, _timestamp in sent["strict"]],
+                         ["temperature", "valve_info", "valve_status"])
+
+    def test_context_broker_modes_send_the_same_values(self):
+        sent = {}
+        for decoding in ("strict", "fast"):
+            module = create_context_broker(decoding)
+            module._message_callback(None, None, mock.Mock(payload=PAYLOAD))
+            sent[decoding] = [
+                (call.kwargs["name"], call.kwargs["value"], call.kwargs["timestamp"])
+                for call in module.set.call_args_list
+            ]
+        self.assertEqual(sent["fast"], sent["strict"])
+        self.assertEqual(len(sent["strict"]), len(ENTITY) - 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import unittest
+from unittest import mock
+
+from filip.models.ngsi_v2.context import ContextEntity
+
+from agentlib_fiware.modules.context_broker import base
+from agentlib_fiware.modules.context_broker.notified_attributes import (
+    NotifiedAttributesContextBroker,
+    NotifiedAttributesContextBrokerConfig
+)
+from tests.helpers import create_context_broker_config, create_module
+
+TIME_INSTANT = {"TimeInstant": {"type": "DateTime", "value": "2020-01-01T00:00:00.000Z"}}
+
+
+def get_entity(temperature, humidity) -> ContextEntity:
+    return ContextEntity(
+        id="urn:ngsi-ld:Room:001",
+        type="Room",
+        temperature={"type": "Number", "value": temperature, "metadata": TIME_INSTANT},
+        humidity={"type": "Number", "value": humidity, "metadata": TIME_INSTANT}
+    )
+
+
+def create_context_broker(**kwargs) -> NotifiedAttributesContextBroker:
+    config = create_context_broker_config(
+        NotifiedAttributesContextBrokerConfig,
+        entities=[get_entity(0, 0)],
+        mqtt_url="mqtt://localhost:1883",
+        read_entity_attributes=[
+            {"name": "urn:ngsi-ld:Room:001/temperature"},
+            {"name": "urn:ngsi-ld:Room:001/humidity"}
+        ],
+        **kwargs
+    )
+    module = create_module(NotifiedAttributesContextBroker, config)
+    module._agent.env.config.rt = False
+    module._notified_attributes = set()
+    module._snapshot_lock = mock.MagicMock()
+    module._unique_entities = base.get_unique_entities(config.read_entity_attributes)
+    module.subscription_ids = ["subscription_1"]
+    module.set = mock.Mock()
+    return module
+
+
+def get_notification(entity: ContextEntity) -> mock.Mock:
+    return mock.Mock(payload=json.dumps({
+        "subscriptionId": "subscription_1",
+        "data": [entity.model_dump(mode="json", exclude_none=True)]
+    }).encode())
+
+
+def get_sent_values(module) -> list:
+    return [(call.kwargs["name"], call.kwargs["value"]) for call in module.set.call_args_list]
+
+
+class TestInitialSnapshot(unittest.TestCase):
+
+    def test_snapshot_does_not_overwrite_newer_notifications(self):
+        for decoding in ("strict", "fast"):
+            with self.subTest(notification_decoding=decoding):
+                module = create_context_broker(notification_decoding=decoding)
+                module._initial_entities = {"urn:ngsi-ld:Room:001": get_entity(20, 50)}
+
+                # Notification between the query of the snapshot and process
+                module._message_callback(None, None, get_notification(get_entity(21, 51)))
+                next(module.process())
+
+                self.assertEqual(get_sent_values(module), [
+                    ("urn:ngsi-ld:Room:001/temperature", 21),
+                    ("urn:ngsi-ld:Room:001/humidity", 51)
+                ])
+
+    def test_snapshot_is_sent_without_notifications(self):
+        module = create_context_broker()
+        module._initial_entities = {"urn:ngsi-ld:Room:001": get_entity(20, 50)}
+
+        next(module.process())
+        module._message_callback(None, None, get_notification(get_entity(21, 51)))
+
+        self.assertEqual(get_sent_values(module), [
+            ("urn:ngsi-ld:Room:001/temperature", 20),
+            ("urn:ngsi-ld:Room:001/humidity", 50),
+            ("urn:ngsi-ld:Room:001/temperature", 21),
+            ("urn:ngsi-ld:Room:001/humidity", 51)
+        ])
+        self.assertIsNone(module._notified_attributes)
+
+
+if __name__ == "__main__":
+    unittest.main()
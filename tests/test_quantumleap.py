@@ -0,0 +1,162 @@
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import requests
+
+from agentlib_fiware.modules.time_series import quantumleap
+from agentlib_fiware.utils.timeseries_cache import TimeSeriesCache
+
+FROM_DATE = datetime.datetime(2020, 1, 1)
+
+
+class FakeTimeSeries:
+
+    def __init__(self, entity_id, attr_name, index, values):
+        self.entity_id = entity_id
+        self.attr_name = attr_name
+        self.index = index
+        self.values = values
+
+    def to_pandas(self):
+        return pd.DataFrame(
+            self.values[:, None],
+            index=self.index,
+            columns=pd.MultiIndex.from_tuples([(self.entity_id, self.attr_name, "Number")])
+        )
+
+
+class FakeQuantumLeapClient:
+    """
+    Answers like QuantumLeap from the given samples of each entity,
+    including the 404 if there are no records.
+    """
+
+    def __init__(self, samples: dict, fail: bool = False):
+        self.samples = samples
+        self.fail = fail
+        self.requests = []
+
+    def get_entity_attr_values_by_id(self, entity_id, attr_name, from_date, to_date, limit, offset):
+        self.requests.append((entity_id, from_date, to_date, limit, offset))
+        if self.fail:
+            raise requests.exceptions.ConnectionError("Connection refused")
+        index = self.samples.get(entity_id, pd.DatetimeIndex([]))
+        index = index[(index >= pd.Timestamp(from_date)) & (index <= pd.Timestamp(to_date))]
+        index = index[offset:offset + limit]
+        if len(index) == 0:
+            response = requests.Response()
+            response.status_code = 404
+            raise requests.exceptions.HTTPError("Not Found", response=response)
+        values = (index - pd.Timestamp(FROM_DATE)).total_seconds().to_numpy()
+        return FakeTimeSeries(entity_id, attr_name, index, values)
+
+
+def get_data(client, entity_name_attributes, interval, **kwargs):
+    with mock.patch.object(quantumleap.sessions, "get_quantumleap_client", return_value=client):
+        return quantumleap.get_data_from_ql(
+            entity_name_attributes=entity_name_attributes,
+            interval=interval,
+            to_date=FROM_DATE + datetime.timedelta(seconds=interval),
+            fiware_header={"service": "test", "service_path": "/"},
+            ql_url="http://localhost:8668",
+            **kwargs
+        )
+
+
+class TestEmptyRanges(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = TimeSeriesCache(self._tmp_dir.name, settle_time=0)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_no_records_is_an_empty_result(self):
+        client = FakeQuantumLeapClient(samples={})
+        with mock.patch.object(quantumleap.sessions, "get_quantumleap_client", return_value=client):
+            (result,) = quantumleap.fetch_ql_requests(
+                [quantumleap.QLRequest("entity/attr", FROM_DATE, FROM_DATE)],
+                fiware_header={}, ql_url="http://localhost:8668"
+            )
+        self.assertIsNone(result.data)
+        self.assertFalse(result.failed)
+
+    def test_empty_ranges_are_cached(self):
+        client = FakeQuantumLeapClient(samples={})
+        data = get_data(client, ["entity/attr"], 3600, cache=self.cache)
+        self.assertTrue(data.empty)
+        self.assertEqual(len(client.requests), 1)
+
+        data = get_data(client, ["entity/attr"], 3600, cache=self.cache)
+        self.assertTrue(data.empty)
+        self.assertEqual(len(client.requests), 1)
+
+    def test_failed_ranges_are_not_cached(self):
+        client = FakeQuantumLeapClient(samples={}, fail=True)
+        get_data(client, ["entity/attr"], 3600, cache=self.cache)
+        get_data(client, ["entity/attr"], 3600, cache=self.cache)
+        self.assertEqual(len(client.requests), 2)
+
+    def test_gaps_between_cached_ranges_are_not_requested_again(self):
+        samples = {"entity": pd.date_range(FROM_DATE, periods=10, freq="60s")}
+        client = FakeQuantumLeapClient(samples=samples)
+        first = get_data(client, ["entity/attr"], 3600, cache=self.cache)
+        n_requests = len(client.requests)
+
+        second = get_data(client, ["entity/attr"], 3600, cache=self.cache)
+
+        self.assertEqual(len(client.requests), n_requests)
+        pd.testing.assert_frame_equal(first, second)
+        np.testing.assert_array_equal(first["entity/attr"].to_numpy(), np.arange(10) * 60.0)
+
+
+class TestConcurrency(unittest.TestCase):
+
+    def test_results_keep_the_order_of_the_requests(self):
+        samples = {f"entity_{idx}": pd.date_range(FROM_DATE, periods=idx + 1, freq="1s")
+                   for idx in range(8)}
+        client = FakeQuantumLeapClient(samples=samples)
+        ql_requests = [
+            quantumleap.QLRequest(f"entity_{idx}/attr", FROM_DATE,
+                                  FROM_DATE + datetime.timedelta(hours=1))
+            for idx in range(8)
+        ]
+        with mock.patch.object(quantumleap.sessions, "get_quantumleap_client", return_value=client):
+            results = quantumleap.fetch_ql_requests(
+                ql_requests, fiware_header={}, ql_url="http://localhost:8668", max_workers=4
+            )
+        self.assertEqual([result.request for result in results], ql_requests)
+        self.assertEqual([result.n_records for result in results], list(range(1, 9)))
+
+
+class TestPagination(unittest.TestCase):
+
+    def test_requests_are_paginated_by_records(self):
+        samples = {"entity": pd.date_range(FROM_DATE, periods=25, freq="1s")}
+        client = FakeQuantumLeapClient(samples=samples)
+        data = get_data(client, ["entity/attr"], 3600, chunk_size=10)
+        self.assertEqual([request[3:] for request in client.requests], [(10, 0), (10, 10), (10, 20)])
+        np.testing.assert_array_equal(data["entity/attr"].to_numpy(), np.arange(25.0))
+
+    def test_dense_attributes_are_split_into_slices(self):
+        samples = {"entity": pd.date_range(FROM_DATE, periods=3601, freq="1s")}
+        client = FakeQuantumLeapClient(samples=samples)
+        sample_density = {"entity/attr": 1.0}
+        data = get_data(client, ["entity/attr"], 3600, chunk_size=1000,
+                        sample_density=sample_density)
+        # About 0.8 * chunk_size records per slice
+        self.assertEqual(len(client.requests), 5)
+        self.assertTrue(all(request[4] == 0 for request in client.requests))
+        # The shared boundaries of the slices are not duplicated
+        np.testing.assert_array_equal(data["entity/attr"].to_numpy(), np.arange(3601.0))
+        # The observed density is used for the next extraction
+        self.assertAlmostEqual(sample_density["entity/attr"], 1.0, places=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
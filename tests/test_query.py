@@ -0,0 +1,63 @@
+import threading
+import time
+import unittest
+
+import requests
+
+from agentlib_fiware.utils.query import iter_query_entities, query_entities
+
+
+class FakeContextBrokerClient:
+    """Returns the ids of the queried patterns, later chunks faster"""
+
+    def __init__(self, fail_ids=()):
+        self.fail_ids = set(fail_ids)
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def query(self, query):
+        ids = [pattern.id for pattern in query.entities]
+        with self._lock:
+            self.queries.append((ids, query.attrs))
+        if self.fail_ids.intersection(ids):
+            raise requests.exceptions.ConnectionError("Connection refused")
+        time.sleep(0.01 / (1 + len(self.queries)))
+        return ids
+
+
+class TestQueryEntities(unittest.TestCase):
+
+    def test_chunks_keep_their_order(self):
+        client = FakeContextBrokerClient()
+        entity_ids = [f"room_{idx}" for idx in range(10)]
+        chunks = list(iter_query_entities(
+            http_client=client, entity_ids=entity_ids, attrs=["temperature"],
+            chunk_size=3, max_workers=4
+        ))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 3, 1])
+        self.assertEqual(sum(chunks, []), entity_ids)
+        self.assertTrue(all(attrs == ["temperature"] for _ids, attrs in client.queries))
+
+    def test_failed_chunks(self):
+        entity_ids = [f"room_{idx}" for idx in range(4)]
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            query_entities(http_client=FakeContextBrokerClient(fail_ids=["room_2"]),
+                           entity_ids=entity_ids, chunk_size=2)
+
+        errors = []
+        result = query_entities(
+            http_client=FakeContextBrokerClient(fail_ids=["room_2"]),
+            entity_ids=entity_ids, chunk_size=2, max_workers=2,
+            on_error=lambda err, chunk: errors.append([pattern.id for pattern in chunk])
+        )
+        self.assertEqual(result, ["room_0", "room_1"])
+        self.assertEqual(errors, [["room_2", "room_3"]])
+
+    def test_no_patterns(self):
+        client = FakeContextBrokerClient()
+        self.assertEqual(query_entities(http_client=client), [])
+        self.assertEqual(client.queries, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import datetime
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from filip.models.ngsi_v2.context import ContextEntity
+from filip.models.ngsi_v2.subscriptions import Subscription
+
+from agentlib_fiware.modules.context_broker import base
+from agentlib_fiware.modules.context_broker.notified_attributes import (
+    NotifiedAttributesContextBroker,
+    NotifiedAttributesContextBrokerConfig
+)
+from agentlib_fiware.modules.iota_mqtt.base import BaseIoTACommunicator
+from agentlib_fiware.modules.iota_mqtt.context_broker_to_service import (
+    ContextBrokerCommunicator,
+    ContextBrokerCommunicatorConfig
+)
+from agentlib_fiware.utils.subscription_registry import SubscriptionRegistry
+from tests.helpers import create_context_broker_config, receive_during_init
+
+DESCRIPTION = "agent/context_broker"
+ENTITY = ContextEntity(id="urn:ngsi-ld:Room:001", type="Room",
+                       temperature={"type": "Number", "value": 21})
+# Notification of a subscription persisted by a former run
+NOTIFICATION = mock.Mock(payload=json.dumps({
+    "subscriptionId": "persisted",
+    "data": [ENTITY.model_dump(mode="json", exclude_none=True)]
+}).encode())
+
+
+def get_subscription(**kwargs) -> Subscription:
+    return Subscription(
+        description=DESCRIPTION,
+        subject={"entities": [{"id": "urn:ngsi-ld:Room:001"}]},
+        notification={"mqtt": {"url": "mqtt://localhost:1883", "topic": "/notify"}},
+        **kwargs
+    )
+
+
+class FakeContextBrokerClient:
+    """Stores the subscriptions like the ContextBroker, including expired ones"""
+
+    base_url = "http://localhost:1026"
+    fiware_headers = {"fiware-service": "test", "fiware-servicepath": "/"}
+
+    def __init__(self, subscriptions=()):
+        self.subscriptions = {sub.id: sub for sub in subscriptions}
+        self.deleted = []
+        self._next_id = 0
+
+    def get_subscription_list(self):
+        return list(self.subscriptions.values())
+
+    def post_subscription(self, subscription, update):
+        self._next_id += 1
+        subscription_id = f"new_{self._next_id}"
+        self.subscriptions[subscription_id] = subscription.model_copy(update={"id": subscription_id})
+        return subscription_id
+
+    def update_subscription(self, subscription):
+        self.subscriptions[subscription.id] = subscription
+
+    def delete_subscription(self, subscription_id):
+        self.deleted.append(subscription_id)
+        del self.subscriptions[subscription_id]
+
+
+class TestSubscriptionRegistry(unittest.TestCase):
+
+    def test_expired_leases_are_deleted(self):
+        past = datetime.datetime(2020, 1, 1)
+        client = FakeContextBrokerClient([
+            get_subscription(id="expired_status", status="expired"),
+            get_subscription(id="expired_lease", expires=past),
+            get_subscription(id="other_module", status="expired").model_copy(
+                update={"description": "other"})
+        ])
+        registry = SubscriptionRegistry(
+            http_client=client, key="agent/context_broker",
+            description=DESCRIPTION, lease_duration=60
+        )
+        with mock.patch.object(registry, "_start_renewal"):
+            subscription_ids = registry.register([get_subscription()])
+
+        self.assertEqual(sorted(client.deleted), ["expired_lease", "expired_status"])
+        self.assertEqual(sorted(client.subscriptions), sorted(["other_module", *subscription_ids]))
+
+    def test_active_subscriptions_are_kept_without_delete_orphans(self):
+        client = FakeContextBrokerClient([get_subscription(id="running")])
+        registry = SubscriptionRegistry(
+            http_client=client, key="agent/context_broker",
+            description=DESCRIPTION, lease_duration=60
+        )
+        with mock.patch.object(registry, "_start_renewal"):
+            registry.register([get_subscription()])
+        self.assertEqual(client.deleted, [])
+
+    def test_expired_stored_subscriptions_are_recreated(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_file = Path(tmp_dir, "subscriptions.json")
+            client = FakeContextBrokerClient()
+            registry = SubscriptionRegistry(
+                http_client=client, key="agent/context_broker",
+                description=DESCRIPTION, state_file=state_file
+            )
+            (stored_id,) = registry.register([get_subscription()])
+
+            # Reused while active
+            registry = SubscriptionRegistry(
+                http_client=client, key="agent/context_broker",
+                description=DESCRIPTION, state_file=state_file
+            )
+            self.assertEqual(registry.register([get_subscription()]), [stored_id])
+
+            client.subscriptions[stored_id].status = "expired"
+            registry = SubscriptionRegistry(
+                http_client=client, key="agent/context_broker",
+                description=DESCRIPTION, state_file=state_file
+            )
+            (new_id,) = registry.register([get_subscription()])
+            self.assertNotEqual(new_id, stored_id)
+            self.assertEqual(client.deleted, [stored_id])
+
+
+class TestNotificationsBeforeRegistration(unittest.TestCase):
+
+    def test_communicator(self):
+        for decoding in ("strict", "fast"):
+            with self.subTest(notification_decoding=decoding):
+                config = ContextBrokerCommunicatorConfig(
+                    _agent_id="agent",
+                    module_id="cb",
+                    type="cb",
+                    mqtt_url="mqtt://localhost:1883",
+                    cb_url="http://localhost:1026",
+                    fiware_header={"service": "test", "service_path": "/"},
+                    defer_entity_sync=True,
+                    entities=[ENTITY],
+                    notification_decoding=decoding
+                )
+                module = receive_during_init(
+                    ContextBrokerCommunicator, BaseIoTACommunicator, config, NOTIFICATION
+                )
+                module._agent.data_broker.send_variable.assert_not_called()
+
+    def test_notified_attributes_context_broker(self):
+        for decoding in ("strict", "fast"):
+            with self.subTest(notification_decoding=decoding):
+                config = create_context_broker_config(
+                    NotifiedAttributesContextBrokerConfig,
+                    entities=[ENTITY],
+                    mqtt_url="mqtt://localhost:1883",
+                    read_entity_attributes=[{"name": f"{ENTITY.id}/temperature"}],
+                    notification_decoding=decoding
+                )
+                module = receive_during_init(
+                    NotifiedAttributesContextBroker, base.BaseContextBroker, config, NOTIFICATION
+                )
+                module._agent.data_broker.send_variable.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import re
+import unittest
+
+from agentlib_fiware.utils.subscriptions import (
+    SubscriptionGrouping,
+    get_entity_patterns,
+    group_entities
+)
+
+ENTITIES = [
+    ("urn:ngsi-ld:Room:001", "Room"),
+    ("urn:ngsi-ld:Sensor:001", "Sensor"),
+    ("urn:ngsi-ld:Room:002", "Room"),
+    ("urn:ngsi-ld:Room:003", "Room")
+]
+
+
+class TestGrouping(unittest.TestCase):
+
+    def test_entity(self):
+        groups = group_entities(ENTITIES, SubscriptionGrouping.ENTITY, max_entities_per_subscription=2)
+        self.assertEqual(groups, [[entity] for entity in ENTITIES])
+
+    def test_grouped(self):
+        groups = group_entities(ENTITIES, "grouped", max_entities_per_subscription=3)
+        self.assertEqual(groups, [ENTITIES[:3], ENTITIES[3:]])
+        patterns = get_entity_patterns(groups[0], "grouped")
+        self.assertEqual([(pattern.id, pattern.type) for pattern in patterns], ENTITIES[:3])
+
+    def test_id_pattern_groups_by_type(self):
+        groups = group_entities(ENTITIES, "id_pattern", max_entities_per_subscription=2)
+        self.assertEqual(groups, [
+            [ENTITIES[0], ENTITIES[2]],
+            [ENTITIES[3]],
+            [ENTITIES[1]]
+        ])
+
+    def test_id_pattern_matches_exactly_the_ids(self):
+        entities = [("urn:ngsi-ld:Room:001", "Room"), ("room.1(a)", "Room")]
+        (pattern,) = get_entity_patterns(entities, "id_pattern")
+        self.assertEqual(pattern.type, "Room")
+        regex = re.compile(pattern.idPattern.pattern)
+        for entity_id, _ in entities:
+            self.assertTrue(regex.match(entity_id))
+        for entity_id in ("urn:ngsi-ld:Room:0012", "room11(a)", "urn:ngsi-ld:Room:00"):
+            self.assertFalse(regex.match(entity_id))
+
+
+if __name__ == "__main__":
+    unittest.main()
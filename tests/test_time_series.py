@@ -0,0 +1,80 @@
+import datetime
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from agentlib_fiware.modules.time_series.base import (
+    BaseTimeSeriesAcquisition,
+    BaseTimeSeriesAcquisitionConfig
+)
+from tests.helpers import create_module
+
+FROM_DATE = datetime.datetime(2020, 1, 1)
+
+
+class FakeServer:
+    """Returns one sample per minute of the requested interval"""
+
+    def __init__(self):
+        self.requests = []
+
+    def get_data(self, interval, to_date):
+        self.requests.append((interval, to_date))
+        index = pd.date_range(to_date - datetime.timedelta(seconds=interval), to_date, freq="60s")
+        values = (index - pd.Timestamp(FROM_DATE)).total_seconds()
+        return pd.DataFrame({"entity/attr": values}, index=index)
+
+
+def create_acquisition(**kwargs) -> BaseTimeSeriesAcquisition:
+    config = BaseTimeSeriesAcquisitionConfig(
+        _agent_id="agent", module_id="time_series", type="time_series", **kwargs
+    )
+    return create_module(BaseTimeSeriesAcquisition, config, _window=None, _window_to_date=None)
+
+
+class TestIncrementalWindow(unittest.TestCase):
+
+    def test_only_new_data_is_requested(self):
+        module = create_acquisition(incremental=True, time_period=3600)
+        server = FakeServer()
+        to_date = FROM_DATE + datetime.timedelta(hours=1)
+        module.get_window(to_date, server.get_data)
+        window = module.get_window(to_date + datetime.timedelta(minutes=10), server.get_data)
+
+        self.assertEqual([interval for interval, _to_date in server.requests], [3600, 600])
+        # Same window as a full extraction
+        expected = FakeServer().get_data(3600, to_date + datetime.timedelta(minutes=10))
+        pd.testing.assert_frame_equal(window, expected, check_freq=False)
+
+    def test_full_window_is_requested_after_long_pauses(self):
+        module = create_acquisition(incremental=True, time_period=3600)
+        server = FakeServer()
+        module.get_window(FROM_DATE + datetime.timedelta(hours=1), server.get_data)
+        module.get_window(FROM_DATE + datetime.timedelta(hours=3), server.get_data)
+        module.get_window(FROM_DATE + datetime.timedelta(hours=2), server.get_data)
+        self.assertEqual([interval for interval, _to_date in server.requests], [3600, 3600, 3600])
+
+    def test_new_samples_are_forward_filled_from_the_window(self):
+        module = create_acquisition(incremental=True, time_period=3600)
+        to_date = FROM_DATE + datetime.timedelta(hours=1)
+        module.get_window(to_date, FakeServer().get_data)
+        new_data = pd.DataFrame(
+            {"entity/attr": [np.nan], "entity/other": [1.0]},
+            index=[to_date + datetime.timedelta(minutes=1)]
+        )
+        window = module.get_window(to_date + datetime.timedelta(minutes=1), lambda *_: new_data)
+        self.assertEqual(window["entity/attr"].iloc[-1], 3600)
+        self.assertEqual(window.index[0], FROM_DATE + datetime.timedelta(minutes=1))
+
+    def test_not_incremental(self):
+        module = create_acquisition(interval=600)
+        server = FakeServer()
+        module.get_window(FROM_DATE, server.get_data)
+        module.get_window(FROM_DATE + datetime.timedelta(minutes=1), server.get_data)
+        self.assertEqual([interval for interval, _to_date in server.requests], [600, 600])
+        self.assertIsNone(module._window)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from agentlib_fiware.utils.timeseries_cache import (
+    TimeSeriesCache,
+    merge_intervals,
+    subtract_intervals
+)
+
+FROM_DATE = datetime.datetime(2020, 1, 1)
+
+
+def get_data(from_date, periods, freq="1h") -> pd.DataFrame:
+    index = pd.date_range(from_date, periods=periods, freq=freq)
+    return pd.DataFrame({"entity/attr": range(periods)}, index=index, dtype=float)
+
+
+class TestIntervals(unittest.TestCase):
+
+    def test_merge_intervals(self):
+        self.assertEqual(merge_intervals([(5, 6), (0, 2), (2, 3), (1, 2.5)]), [(0, 3), (5, 6)])
+        self.assertEqual(merge_intervals([]), [])
+
+    def test_subtract_intervals(self):
+        self.assertEqual(subtract_intervals(0, 10, []), [(0, 10)])
+        self.assertEqual(subtract_intervals(0, 10, [(2, 3), (5, 12)]), [(0, 2), (3, 5)])
+        self.assertEqual(subtract_intervals(0, 10, [(-1, 11)]), [])
+        self.assertEqual(subtract_intervals(4, 10, [(0, 2), (3, 5), (20, 30)]), [(5, 10)])
+
+
+class TestTimeSeriesCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = TimeSeriesCache(self._tmp_dir.name, settle_time=0)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_store_and_load(self):
+        to_date = FROM_DATE + datetime.timedelta(days=2)
+        data = get_data(FROM_DATE, periods=48)
+        self.cache.store("source", "entity/attr", data, ranges=[(FROM_DATE, to_date)])
+
+        self.assertEqual(self.cache.get_missing_ranges("source", "entity/attr", FROM_DATE, to_date), [])
+        # Partitions of several days are combined and sliced
+        loaded = self.cache.load("source", "entity/attr",
+                                 FROM_DATE + datetime.timedelta(hours=20),
+                                 FROM_DATE + datetime.timedelta(hours=30))
+        pd.testing.assert_frame_equal(loaded, data.iloc[20:31], check_freq=False)
+        # Other series and sources are independent
+        self.assertEqual(
+            self.cache.get_missing_ranges("source", "entity/other", FROM_DATE, to_date),
+            [(FROM_DATE, to_date)]
+        )
+        self.assertTrue(self.cache.load("other", "entity/attr", FROM_DATE, to_date).empty)
+
+    def test_missing_ranges_between_covered_ranges(self):
+        to_date = FROM_DATE + datetime.timedelta(hours=10)
+        self.cache.store("source", "entity/attr", None, ranges=[
+            (FROM_DATE, FROM_DATE + datetime.timedelta(hours=2)),
+            (FROM_DATE + datetime.timedelta(hours=6), to_date)
+        ])
+        self.assertEqual(
+            self.cache.get_missing_ranges("source", "entity/attr", FROM_DATE, to_date),
+            [(FROM_DATE + datetime.timedelta(hours=2), FROM_DATE + datetime.timedelta(hours=6))]
+        )
+
+    def test_recent_ranges_are_not_covered(self):
+        cache = TimeSeriesCache(self._tmp_dir.name, settle_time=3600)
+        to_date = datetime.datetime.now(datetime.timezone.utc)
+        from_date = to_date - datetime.timedelta(hours=2)
+        cache.store("source", "entity/attr", None, ranges=[(from_date, to_date)])
+        ((missing_from, missing_to),) = cache.get_missing_ranges(
+            "source", "entity/attr", from_date, to_date
+        )
+        self.assertAlmostEqual((to_date - missing_from).total_seconds(), 3600, delta=60)
+        self.assertEqual(missing_to, to_date)
+
+    def test_overlapping_stores_keep_the_latest_values(self):
+        self.cache.store("source", "entity/attr", get_data(FROM_DATE, periods=3), ranges=[])
+        self.cache.store("source", "entity/attr", get_data(FROM_DATE, periods=2) + 10, ranges=[])
+        loaded = self.cache.load("source", "entity/attr", FROM_DATE,
+                                 FROM_DATE + datetime.timedelta(hours=2))
+        self.assertEqual(loaded["entity/attr"].tolist(), [10, 11, 2])
+
+    def test_eviction_removes_coverage_of_the_day(self):
+        to_date = FROM_DATE + datetime.timedelta(days=2)
+        self.cache.store("source", "entity/attr", get_data(FROM_DATE, periods=48),
+                         ranges=[(FROM_DATE, to_date)])
+        partitions = sorted(self.cache.cache_dir.glob(f"*/*/*{self.cache._suffix}"))
+        self.assertEqual(len(partitions), 2)
+        # Make the first day the least recently used one
+        first_day = partitions[0]
+        mtime = first_day.stat().st_mtime - 100
+        os.utime(first_day, (mtime, mtime))
+
+        self.cache.max_size = partitions[1].stat().st_size
+        self.cache.evict()
+
+        self.assertFalse(first_day.exists())
+        self.assertEqual(
+            self.cache.get_missing_ranges("source", "entity/attr", FROM_DATE, to_date),
+            [(FROM_DATE, FROM_DATE + datetime.timedelta(days=1))]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from agentlib_fiware.utils.timestamps import (
+    time_instant_to_unix,
+    time_instants_to_unix,
+    unix_to_time_instant
+)
+
+UNIX_2020 = 1577836800.0
+
+
+class TestTimestamps(unittest.TestCase):
+
+    def test_time_instant_to_unix(self):
+        self.assertEqual(time_instant_to_unix("2020-01-01T00:00:00.000Z"), UNIX_2020)
+        self.assertEqual(time_instant_to_unix("2020-01-01T01:00:00+01:00"), UNIX_2020)
+        # Without timezone, UTC is assumed
+        self.assertEqual(time_instant_to_unix("2020-01-01T00:00:01"), UNIX_2020 + 1)
+        self.assertEqual(time_instant_to_unix("01.01.2020 00:00", "%d.%m.%Y %H:%M"), UNIX_2020)
+
+    def test_time_instants_to_unix(self):
+        np.testing.assert_array_equal(
+            time_instants_to_unix(["2020-01-01T00:00:00.000Z", None, "2020-01-01T00:00:01.500Z"]),
+            [UNIX_2020, np.nan, UNIX_2020 + 1.5]
+        )
+        # Mixed formats are converted one by one
+        np.testing.assert_array_equal(
+            time_instants_to_unix(["2020-01-01T00:00:00.000Z", "2020-01-01T01:00:00+01:00"]),
+            [UNIX_2020, UNIX_2020]
+        )
+        self.assertEqual(len(time_instants_to_unix([])), 0)
+
+    def test_unix_to_time_instant(self):
+        local = datetime.datetime.fromtimestamp(UNIX_2020)
+        self.assertEqual(unix_to_time_instant(UNIX_2020), local.strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+        self.assertEqual(unix_to_time_instant(UNIX_2020, "%d.%m.%Y"), local.strftime("%d.%m.%Y"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import threading
+import time
+import unittest
+
+from agentlib_fiware.utils.workers import BackgroundWorker, OverflowPolicy
+
+
+class TestKeyOrdering(unittest.TestCase):
+
+    def test_tasks_of_one_key_keep_their_order(self):
+        worker = BackgroundWorker(name="test", num_workers=4, overflow_policy=OverflowPolicy.BLOCK)
+        executed = []
+        active = set()
+        lock = threading.Lock()
+
+        def update(key, value):
+            with lock:
+                self.assertNotIn(key, active)
+                active.add(key)
+            # Earlier updates take longer, to reorder them without the key
+            time.sleep(0.002 * (10 - value))
+            with lock:
+                active.remove(key)
+                executed.append((key, value))
+
+        for value in range(10):
+            for key in ("a", "b"):
+                worker.submit(update, key, value, key=key)
+        worker.stop(drain=True)
+
+        for key in ("a", "b"):
+            self.assertEqual([value for _key, value in executed if _key == key], list(range(10)))
+        self.assertEqual(worker.get_metrics()["failed"], 0)
+
+    def test_different_keys_run_concurrently(self):
+        worker = BackgroundWorker(name="test", num_workers=2)
+        barrier = threading.Barrier(2, timeout=5)
+        for key in ("a", "b"):
+            worker.submit(barrier.wait, key=key)
+        worker.stop(drain=True)
+        self.assertEqual(worker.get_metrics()["executed"], 2)
+
+    def test_tasks_without_key_are_not_serialized(self):
+        worker = BackgroundWorker(name="test", num_workers=2)
+        barrier = threading.Barrier(2, timeout=5)
+        for _ in range(2):
+            worker.submit(barrier.wait)
+        worker.stop(drain=True)
+        self.assertEqual(worker.get_metrics()["executed"], 2)
+
+
+def block_worker(worker: BackgroundWorker) -> threading.Event:
+    """Occupy the worker until the returned event is set"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(timeout=5)
+
+    worker.submit(blocker)
+    started.wait(timeout=5)
+    return release
+
+
+class TestOverflowPolicies(unittest.TestCase):
+
+    def test_drop_oldest(self):
+        worker = BackgroundWorker(name="test", max_queue_size=2,
+                                  overflow_policy=OverflowPolicy.DROP_OLDEST)
+        release = block_worker(worker)
+        executed = []
+        for value in range(4):
+            worker.submit(executed.append, value)
+        release.set()
+        worker.stop(drain=True)
+        self.assertEqual(executed, [2, 3])
+        self.assertEqual(worker.get_metrics()["dropped"], 2)
+
+    def test_coalesce_replaces_pending_task_of_key(self):
+        worker = BackgroundWorker(name="test", max_queue_size=10,
+                                  overflow_policy=OverflowPolicy.COALESCE)
+        release = block_worker(worker)
+        executed = []
+        worker.submit(executed.append, ("a", 1), key="a")
+        worker.submit(executed.append, ("b", 1), key="b")
+        worker.submit(executed.append, ("a", 2), key="a")
+        release.set()
+        worker.stop(drain=True)
+        # The replaced task keeps its position in the queue
+        self.assertEqual(executed, [("a", 2), ("b", 1)])
+        self.assertEqual(worker.get_metrics()["coalesced"], 1)
+
+    def test_block_waits_for_free_slot(self):
+        worker = BackgroundWorker(name="test", max_queue_size=1,
+                                  overflow_policy=OverflowPolicy.BLOCK)
+        release = block_worker(worker)
+        executed = []
+        worker.submit(executed.append, 1)
+        submitted = threading.Event()
+
+        def submit():
+            worker.submit(executed.append, 2)
+            submitted.set()
+
+        threading.Thread(target=submit, daemon=True).start()
+        self.assertFalse(submitted.wait(timeout=0.05))
+        release.set()
+        self.assertTrue(submitted.wait(timeout=5))
+        worker.stop(drain=True)
+        self.assertEqual(executed, [1, 2])
+        self.assertEqual(worker.get_metrics()["dropped"], 0)
+
+
+class TestLifecycle(unittest.TestCase):
+
+    def test_stop_without_drain_discards_pending_tasks(self):
+        worker = BackgroundWorker(name="test")
+        release = block_worker(worker)
+        executed = []
+        worker.submit(executed.append, 1)
+        release.set()
+        worker.stop(drain=False)
+        self.assertEqual(executed, [])
+        self.assertFalse(worker.submit(executed.append, 2))
+
+    def test_metrics(self):
+        worker = BackgroundWorker(name="test", max_batch_size=10)
+        release = block_worker(worker)
+        worker.submit(time.sleep, 0)
+        worker.submit(int, "no number")
+        release.set()
+        worker.stop(drain=True)
+        metrics = worker.get_metrics()
+        self.assertEqual(metrics["submitted"], 3)
+        self.assertEqual(metrics["executed"], 2)
+        self.assertEqual(metrics["failed"], 1)
+        self.assertEqual(metrics["max_queue_depth"], 2)
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertGreaterEqual(metrics["max_latency"], metrics["mean_latency"])
+
+
+if __name__ == "__main__":
+    unittest.main()